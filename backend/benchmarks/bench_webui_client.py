@@ -0,0 +1,116 @@
+# benchmarks/bench_webui_client.py
+# ローカルのスタブwebuiに対して、リクエスト毎のAsyncClientと共有クライアントの
+# スループット(req/s)を比較する。
+#
+#   python benchmarks/bench_webui_client.py --requests 500 --concurrency 32
+import argparse
+import asyncio
+import base64
+import os
+import socket
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import webui_client  # noqa: E402
+
+# 1x1 PNG
+STUB_IMAGE = base64.b64encode(bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d4944415478da63f8cfc0f01f0005000201a5c1c8f0"
+    "0000000049454e44ae426082"
+)).decode()
+
+stub = FastAPI()
+
+
+@stub.post("/sdapi/v1/options")
+async def stub_options(payload: dict):
+    return None
+
+
+@stub.post("/sdapi/v1/txt2img")
+async def stub_txt2img(payload: dict):
+    return {"images": [STUB_IMAGE], "parameters": payload, "info": "{}"}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub(port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+PAYLOAD = {"prompt": "bench", "steps": 1, "width": 64, "height": 64, "sampler_name": "DPM++ 2M Karras"}
+
+
+# 変更前: リクエスト毎にクライアントを作り、optionsのクライアントは閉じない
+async def generate_per_request(base_url: str, leaked: list):
+    options_client = httpx.AsyncClient()
+    leaked.append(options_client)
+    await options_client.post(f"{base_url}/sdapi/v1/options", json={"sd_model_checkpoint": "stub"})
+    async with httpx.AsyncClient(timeout=httpx.Timeout(600.0)) as client:
+        response = await client.post(f"{base_url}/sdapi/v1/txt2img", json=PAYLOAD)
+        return response.json()
+
+
+# 変更後: lifespanで開いた共有クライアントを使う
+async def generate_pooled(base_url: str, leaked: list):
+    await webui_client.post("/sdapi/v1/options", json={"sd_model_checkpoint": "stub"})
+    response = await webui_client.post("/sdapi/v1/txt2img", json=PAYLOAD)
+    return response.json()
+
+
+async def run(generate, base_url: str, total: int, concurrency: int) -> float:
+    leaked = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await generate(base_url, leaked)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+
+    for client in leaked:
+        await client.aclose()
+    return total / elapsed
+
+
+async def main(args):
+    port = free_port()
+    server = start_stub(port)
+    base_url = f"http://127.0.0.1:{port}"
+    os.environ["STABLE_DIFFUSION_API"] = base_url
+    os.environ.setdefault("WEBUI_HEALTH_INTERVAL", "0")
+
+    try:
+        before = await run(generate_per_request, base_url, args.requests, args.concurrency)
+        async with webui_client.lifespan(None):
+            after = await run(generate_pooled, base_url, args.requests, args.concurrency)
+    finally:
+        server.should_exit = True
+
+    print(f"requests={args.requests} concurrency={args.concurrency}")
+    print(f"per-request client: {before:8.1f} req/s")
+    print(f"pooled client:      {after:8.1f} req/s  ({after / before:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    asyncio.run(main(parser.parse_args()))
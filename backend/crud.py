@@ -1,8 +1,17 @@
-from sqlalchemy.orm import Session
+import base64
+from datetime import datetime
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, load_only
 from models.image_record import ImageRecord
+from models.generation_job import GenerationJob
 from models.user import User
 from schemas import ImageRecordCreate, UserCreate
 
+# 履歴APIで返す列だけを読み込む
+HISTORY_COLUMNS = (ImageRecord.id, ImageRecord.image_url, ImageRecord.prompt, ImageRecord.user_id, ImageRecord.created_at)
+
 def create_user(db: Session, user: UserCreate) -> User:
     db_user = User(**user.dict())
     db.add(db_user)
@@ -30,4 +39,99 @@ def get_all_records(db: Session) -> list[ImageRecord]:
         db.query(ImageRecord)
         .order_by(ImageRecord.created_at.desc())
         .all()
-    )
\ No newline at end of file
+    )
+
+async def create_image_record_async(db: AsyncSession, record: ImageRecordCreate) -> ImageRecord:
+    db_record = ImageRecord(**record.dict())
+    db.add(db_record)
+    await db.commit()
+    await db.refresh(db_record)
+    return db_record
+
+def encode_cursor(record: ImageRecord) -> str:
+    raw = f"{record.created_at.isoformat()}|{record.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(record_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+# (created_at, id) のキーセットページング。limit+1件読んで次ページの有無を判定する（limit=None なら全件）
+async def get_records_page_async(db: AsyncSession, user_id: str | None = None, limit: int | None = 50, cursor: str | None = None) -> tuple[list[ImageRecord], str | None]:
+    query = select(ImageRecord).options(load_only(*HISTORY_COLUMNS))
+    if user_id is not None:
+        query = query.where(ImageRecord.user_id == user_id)
+    if cursor:
+        created_at, record_id = decode_cursor(cursor)
+        query = query.where(or_(
+            ImageRecord.created_at < created_at,
+            and_(ImageRecord.created_at == created_at, ImageRecord.id < record_id),
+        ))
+    query = query.order_by(ImageRecord.created_at.desc(), ImageRecord.id.desc())
+    if limit is None:
+        result = await db.execute(query)
+        return list(result.scalars().all()), None
+    query = query.limit(limit + 1)
+
+    result = await db.execute(query)
+    records = list(result.scalars().all())
+    next_cursor = encode_cursor(records[limit - 1]) if len(records) > limit else None
+    return records[:limit], next_cursor
+
+async def create_job_async(db: AsyncSession, job_id: str, kind: str, request_json: str, user_id: str | None = None, owner: str | None = None) -> GenerationJob:
+    db_job = GenerationJob(id=job_id, kind=kind, status="queued", request_json=request_json, user_id=user_id, owner=owner)
+    db.add(db_job)
+    await db.commit()
+    return db_job
+
+async def get_job_async(db: AsyncSession, job_id: str) -> GenerationJob | None:
+    return await db.get(GenerationJob, job_id)
+
+async def update_job_async(db: AsyncSession, job_id: str, **fields) -> None:
+    db_job = await db.get(GenerationJob, job_id)
+    if db_job is None:
+        return
+    for key, value in fields.items():
+        setattr(db_job, key, value)
+    await db.commit()
+
+UNFINISHED_JOB_STATUSES = ("queued", "running")
+
+# 自分のジョブか、持ち主の生存確認（updated_at）が stale_before より古い未完了ジョブ
+def recoverable_jobs_condition(owner: str, stale_before: datetime):
+    return and_(
+        GenerationJob.status.in_(UNFINISHED_JOB_STATUSES),
+        or_(GenerationJob.owner == owner, GenerationJob.owner.is_(None), GenerationJob.updated_at < stale_before),
+    )
+
+async def get_recoverable_jobs_async(db: AsyncSession, owner: str, stale_before: datetime) -> list[GenerationJob]:
+    result = await db.execute(
+        select(GenerationJob)
+        .where(recoverable_jobs_condition(owner, stale_before))
+        .order_by(GenerationJob.created_at)
+    )
+    return list(result.scalars().all())
+
+# 他のインスタンスと同時に拾わないよう、条件付きUPDATEで持ち主を移す。取れたらTrue
+async def claim_job_async(db: AsyncSession, job_id: str, owner: str, stale_before: datetime) -> bool:
+    result = await db.execute(
+        update(GenerationJob)
+        .where(GenerationJob.id == job_id, recoverable_jobs_condition(owner, stale_before))
+        .values(owner=owner, status="queued", updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+# 生存確認：持っている未完了ジョブの updated_at を更新する
+async def touch_jobs_async(db: AsyncSession, owner: str) -> None:
+    await db.execute(
+        update(GenerationJob)
+        .where(GenerationJob.owner == owner, GenerationJob.status.in_(UNFINISHED_JOB_STATUSES))
+        .values(updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
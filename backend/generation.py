@@ -0,0 +1,277 @@
+# generation.py
+import asyncio
+import base64
+import json
+import os
+import uuid
+
+import httpx
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+import model_state
+import schemas
+import storage
+import translation
+import webui_client
+
+ANYTHING_MODEL_NAME = "AnythingXL_xl.safetensors"
+
+
+class InvalidResponse(Exception):
+    # webuiが画像を返さなかったとき
+    def __init__(self, raw_response):
+        super().__init__("Invalid response")
+        self.raw_response = raw_response
+
+
+def full_generate_payload(req: schemas.GenerateImageRequest, adjusted_prompt: str) -> dict:
+    return {
+        "prompt": adjusted_prompt,
+        "steps": req.steps,
+        "width": req.width,
+        "height": req.height,
+        "sampler_name": "DPM++ 2M Karras"
+    }
+
+
+def masked_full_generate_payload(req: schemas.MaskedGenerateRequest, adjusted_prompt: str) -> dict:
+    return {
+        "prompt": adjusted_prompt,
+        "init_images": [req.original_base64],
+        "mask": req.mask_base64,
+        "inpainting_fill": 1,
+        "steps": req.steps,
+        "width": req.width,
+        "height": req.height,
+        "sampler_name": "DPM++ 2M Karras",
+        "denoising_strength": 0.35,
+        "inpaint_full_res": True,
+        "inpaint_full_res_padding": 32
+    }
+
+
+def img2img_full_generate_payload(req: schemas.Image2ImageGenerateRequest, adjusted_prompt: str) -> dict:
+    return {
+        "prompt": adjusted_prompt,
+        "init_images": [req.original_base64],
+        "steps": req.steps,
+        "width": req.width,
+        "height": req.height,
+        "sampler_name": "DPM++ 2M Karras",
+        "denoising_strength": 0.6,
+        "inpainting_fill": 1
+    }
+
+
+# 種類ごとの (webuiのエンドポイント, payload生成関数)
+KINDS = {
+    "full_generate": ("/sdapi/v1/txt2img", full_generate_payload),
+    "masked_full_generate": ("/sdapi/v1/img2img", masked_full_generate_payload),
+    "img2img_full_generate": ("/sdapi/v1/img2img", img2img_full_generate_payload),
+}
+
+
+async def prepare(kind: str, req) -> tuple[str, dict, str, str | None]:
+    path, build_payload = KINDS[kind]
+    adjusted_prompt = await translation.translate(kind, req.prompt, req.style)
+    payload = build_payload(req, adjusted_prompt)
+    checkpoint = ANYTHING_MODEL_NAME if kind == "full_generate" else None
+    return path, payload, adjusted_prompt, checkpoint
+
+
+# 接続できなかった・webuiが受け付けなかった(503)ときだけ別のインスタンスでやり直す
+# 502/504 や送信後の切断は、webui側で生成が進んでいるかもしれないので二重に生成しないようやり直さない
+RETRY_STATUSES = (503,)
+UNHEALTHY_STATUSES = (502, 503, 504)
+
+
+def decode_image_field(value: str) -> bytes:
+    if value.startswith("data:image/"):
+        value = value.split(",", 1)[1]
+    return base64.b64decode(value)
+
+
+def split_images(payload: dict) -> tuple[dict, dict]:
+    # payload内のbase64画像を取り出してバイト列にする
+    payload = dict(payload)
+    files = {"init_images": [decode_image_field(x) for x in payload.pop("init_images", None) or []]}
+    mask = payload.pop("mask", None)
+    if mask:
+        files["mask"] = decode_image_field(mask)
+    return payload, files
+
+
+async def post_binary(path: str, body: dict, files: dict, backend) -> httpx.Response:
+    if not files.get("init_images"):
+        return await webui_client.post(f"{path}/binary", json=body, backend=backend)
+
+    body = {k: v for k, v in body.items() if k not in ("init_images", "mask")}
+    multipart = [("init_images", (f"init_{i}.png", data, "application/octet-stream")) for i, data in enumerate(files["init_images"])]
+    if files.get("mask") is not None:
+        multipart.append(("mask", ("mask.png", files["mask"], "application/octet-stream")))
+    return await webui_client.post_multipart(f"{path}/binary", data={"payload": json.dumps(body)}, files=multipart, backend=backend)
+
+
+async def submit(path: str, payload: dict, checkpoint: str | None = None, on_dispatch=None, files: dict | None = None) -> dict:
+    router = webui_client.get_router()
+    if files is None and webui_client.binary_transport_enabled():
+        payload, files = split_images(payload)
+    tried = []
+    last_error = None
+
+    for _ in range(router.retries + 1):
+        backend = router.pick(checkpoint, exclude=tried)
+        tried.append(backend)
+        body = dict(payload)
+        overrides = {}
+        if on_dispatch is not None:
+            on_dispatch(backend)
+
+        try:
+            with router.track(backend):
+                # ロード済みのモデルと同じなら切り替えを省略する
+                if checkpoint is not None:
+                    # "override": txt2imgのoverride_settingsで切り替え / "options": 事前に /sdapi/v1/options を呼ぶ
+                    if os.getenv("CHECKPOINT_SWITCH_MODE", "override") == "options":
+                        await model_state.ensure_checkpoint(backend, checkpoint)
+                    else:
+                        overrides = await model_state.checkpoint_overrides(backend, checkpoint)
+                        model_state.apply_overrides(body, overrides)
+
+                if files is not None:
+                    response = await post_binary(path, body, files, backend)
+                else:
+                    response = await webui_client.post(path, json=body, backend=backend)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            router.mark_failed(backend, repr(e))
+            last_error = e
+            continue
+        except httpx.RemoteProtocolError as e:
+            router.mark_failed(backend, repr(e))
+            raise
+
+        if response.status_code in UNHEALTHY_STATUSES:
+            router.mark_failed(backend, f"HTTP {response.status_code}")
+            last_error = httpx.HTTPStatusError(f"webui returned {response.status_code}", request=response.request, response=response)
+            if response.status_code in RETRY_STATUSES:
+                continue
+            raise last_error
+
+        router.mark_ok(backend)
+        result = webui_client.parse_multipart_mixed(response) if files is not None else response.json()
+        if "images" not in result:
+            if overrides:
+                model_state.invalidate(backend)
+            raise InvalidResponse(result)
+        model_state.record_applied(backend, overrides)
+        return result
+
+    raise last_error
+
+
+IMAGE_EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp"}
+
+
+async def store(result: dict, prompt: str, db: AsyncSession, user_id: str | None = None) -> str:
+    image = result["images"][0]
+    if isinstance(image, bytes):
+        image_data = image
+        content_type = (result.get("image_types") or ["image/png"])[0]
+    else:
+        image_data = base64.b64decode(image)
+        content_type = "image/png"
+    filename = f"{uuid.uuid4()}.{IMAGE_EXTENSIONS.get(content_type, 'png')}"
+    image_url = await storage.upload_image(image_data, filename, content_type=content_type)
+
+    record = schemas.ImageRecordCreate(image_url=image_url, prompt=prompt, user_id=user_id)
+    await crud.create_image_record_async(db, record)
+    return image_url
+
+
+async def generate(kind: str, req, db: AsyncSession, files: dict | None = None) -> schemas.GenerateImageResponse:
+    path, payload, adjusted_prompt, checkpoint = await prepare(kind, req)
+    result = await submit(path, payload, checkpoint, files=files)
+    image_url = await store(result, req.prompt, db, user_id=req.user_id)
+    return schemas.GenerateImageResponse(image_url=image_url, adjusted_prompt=adjusted_prompt)
+
+
+async def poll_progress(backend, body: dict) -> dict | None:
+    # 進捗の問い合わせに失敗したら None を返す（生成そのものが失敗したわけではない）
+    try:
+        response = await webui_client.post("/internal/progress", json=body, backend=backend)
+    except httpx.HTTPError:
+        return None
+    if response.status_code != 200:
+        return None
+    try:
+        progress = response.json()
+    except ValueError:
+        return None
+    return progress if isinstance(progress, dict) else None
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+async def stream(kind: str, req, session_factory, files: dict | None = None):
+    # 進捗・ライブプレビュー・最終結果を (event, data) の形で順に返す
+    poll_interval = _env_float("STREAM_POLL_INTERVAL", 0.5)
+    preview_interval = _env_float("STREAM_PREVIEW_INTERVAL", 2.0)
+
+    path, payload, adjusted_prompt, checkpoint = await prepare(kind, req)
+    task_id = f"task(gateway-{uuid.uuid4().hex})"
+    payload["force_task_id"] = task_id
+    yield "queued", {"task_id": task_id, "adjusted_prompt": adjusted_prompt}
+
+    # 進捗はジョブを送ったインスタンスに問い合わせる
+    dispatched = {}
+    job = asyncio.create_task(submit(path, payload, checkpoint, on_dispatch=lambda backend: dispatched.update(backend=backend), files=files))
+    try:
+        id_live_preview = -1
+        last_preview = 0.0
+        loop = asyncio.get_running_loop()
+        while not job.done():
+            backend = dispatched.get("backend")
+            if backend is None:
+                await asyncio.wait({job}, timeout=poll_interval)
+                continue
+
+            # プレビューはwebui側でVAEデコードとエンコードが走るので間引く
+            want_preview = loop.time() - last_preview >= preview_interval
+            progress = await poll_progress(backend, {
+                "id_task": task_id,
+                "id_live_preview": id_live_preview,
+                "live_preview": want_preview,
+            })
+            if progress is None:
+                # この回は飛ばして job を待つ。ストリームを終わらせるのは job の結果だけ
+                await asyncio.wait({job}, timeout=poll_interval)
+                continue
+
+            if want_preview and progress.get("active"):
+                last_preview = loop.time()
+            if progress.get("live_preview") and progress.get("id_live_preview") != id_live_preview:
+                id_live_preview = progress["id_live_preview"]
+                yield "preview", {"image": progress["live_preview"], "id_live_preview": id_live_preview}
+
+            yield "progress", {
+                "active": progress.get("active"),
+                "queued": progress.get("queued"),
+                "progress": progress.get("progress"),
+                "eta": progress.get("eta"),
+                "textinfo": progress.get("textinfo"),
+            }
+
+            await asyncio.wait({job}, timeout=poll_interval)
+
+        result = job.result()
+        async with session_factory() as db:
+            image_url = await store(result, req.prompt, db, user_id=req.user_id)
+        yield "result", {"image_url": image_url, "adjusted_prompt": adjusted_prompt}
+    finally:
+        # クライアントが切断したら待機中のリクエストも止める
+        if not job.done():
+            job.cancel()
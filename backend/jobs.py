@@ -0,0 +1,192 @@
+# jobs.py
+import asyncio
+import math
+import os
+import socket
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+import crud
+import generation
+import schemas
+
+# ジョブの種類ごとのリクエストスキーマ（DBから復元するときに使う）
+JOB_SCHEMAS = {
+    "full_generate": schemas.GenerateImageRequest,
+    "masked_full_generate": schemas.MaskedGenerateRequest,
+    "img2img_full_generate": schemas.Image2ImageGenerateRequest,
+}
+
+FINISHED_STATUSES = ("succeeded", "failed")
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("job queue is full")
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    # DBに状態を残すジョブキュー。webuiへのリクエストは固定数のワーカーだけが送る
+    # ジョブには owner としてこのインスタンスのIDを記録し、heartbeat_interval ごとに updated_at を更新する
+    def __init__(self, session_factory, workers: int = 2, max_queued: int = 100, owner: str | None = None,
+                 heartbeat_interval: float = 30.0, stale_after: float = 300.0):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.owner = owner or socket.gethostname()
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        # キュー内の順番（position用）。asyncio.Queue の中身は覗かずに自分で持つ
+        self.queued_ids: dict[str, None] = {}
+        self.worker_tasks: list[asyncio.Task] = []
+        self.finished: dict[str, asyncio.Event] = {}
+        # Retry-After の見積もりに使う平均処理時間（秒）
+        self.average_duration = 30.0
+
+    async def start(self) -> None:
+        await self.recover()
+        for i in range(self.workers):
+            self.worker_tasks.append(asyncio.create_task(self.worker(), name=f"job-worker-{i}"))
+        self.worker_tasks.append(asyncio.create_task(self.heartbeat(), name="job-heartbeat"))
+
+    async def stop(self) -> None:
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks.clear()
+
+    def stale_before(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.stale_after)
+
+    async def recover(self) -> None:
+        # 再起動前に終わらなかった自分のジョブと、生存確認が途絶えたインスタンスのジョブを積み直す
+        # （実行中だったものもやり直す）。動いている他のインスタンスのジョブには触らない
+        async with self.session_factory() as db:
+            stale_before = self.stale_before()
+            unfinished = await crud.get_recoverable_jobs_async(db, self.owner, stale_before)
+            for job in unfinished:
+                if not await crud.claim_job_async(db, job.id, self.owner, stale_before):
+                    continue  # 他のインスタンスが先に拾った
+                if self.queue.full():
+                    await crud.update_job_async(db, job.id, status="failed", error="dropped on restart: queue is full")
+                    continue
+                self.finished[job.id] = asyncio.Event()
+                self.enqueue(job.id)
+
+    async def heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                async with self.session_factory() as db:
+                    await crud.touch_jobs_async(db, self.owner)
+            except Exception:
+                print("ジョブの生存確認に失敗:", traceback.format_exc())
+
+    def enqueue(self, job_id: str) -> None:
+        self.queue.put_nowait(job_id)
+        self.queued_ids[job_id] = None
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.queue.qsize() * self.average_duration / max(self.workers, 1)))
+
+    async def submit(self, kind: str, req) -> str:
+        if self.queue.full():
+            raise QueueFull(self.retry_after())
+
+        job_id = str(uuid.uuid4())
+        async with self.session_factory() as db:
+            await crud.create_job_async(db, job_id, kind, req.model_dump_json(), user_id=req.user_id, owner=self.owner)
+        self.finished[job_id] = asyncio.Event()
+        try:
+            self.enqueue(job_id)
+        except asyncio.QueueFull:
+            async with self.session_factory() as db:
+                await crud.update_job_async(db, job_id, status="failed", error="job queue is full")
+            self.finished.pop(job_id).set()
+            raise QueueFull(self.retry_after())
+        return job_id
+
+    async def get(self, job_id: str):
+        async with self.session_factory() as db:
+            return await crud.get_job_async(db, job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> None:
+        event = self.finished.get(job_id)
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def position(self, job_id: str) -> int | None:
+        # 先頭が0。キューにいなければ None
+        if job_id not in self.queued_ids:
+            return None
+        return list(self.queued_ids).index(job_id)
+
+    async def worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id = await self.queue.get()
+            self.queued_ids.pop(job_id, None)
+            started = loop.time()
+            try:
+                await self.run(job_id)
+            finally:
+                self.average_duration = 0.8 * self.average_duration + 0.2 * (loop.time() - started)
+                self.queue.task_done()
+                event = self.finished.pop(job_id, None)
+                if event is not None:
+                    event.set()
+
+    async def run(self, job_id: str) -> None:
+        async with self.session_factory() as db:
+            job = await crud.get_job_async(db, job_id)
+            if job is None or job.status in FINISHED_STATUSES:
+                return
+            await crud.update_job_async(db, job_id, status="running")
+            try:
+                req = JOB_SCHEMAS[job.kind].model_validate_json(job.request_json)
+                response = await generation.generate(job.kind, req, db)
+            except asyncio.CancelledError:
+                # シャットダウン時は queued に戻して次回起動時にやり直す
+                await crud.update_job_async(db, job_id, status="queued")
+                raise
+            except generation.InvalidResponse as e:
+                await crud.update_job_async(db, job_id, status="failed", error=f"Invalid response: {e.raw_response}")
+            except Exception:
+                await crud.update_job_async(db, job_id, status="failed", error=traceback.format_exc())
+            else:
+                await crud.update_job_async(db, job_id, status="succeeded", image_url=response.image_url, adjusted_prompt=response.adjusted_prompt)
+
+
+_queue: JobQueue | None = None
+
+
+def get_queue() -> JobQueue:
+    if _queue is None:
+        raise RuntimeError("job queue is not running; is the app lifespan running?")
+    return _queue
+
+
+async def start(session_factory) -> JobQueue:
+    global _queue
+    _queue = JobQueue(
+        session_factory,
+        workers=int(os.getenv("JOB_WORKERS", "2")),
+        max_queued=int(os.getenv("JOB_QUEUE_SIZE", "100")),
+        owner=os.getenv("JOB_INSTANCE_ID") or None,
+        heartbeat_interval=float(os.getenv("JOB_HEARTBEAT_INTERVAL", "30")),
+        stale_after=float(os.getenv("JOB_STALE_AFTER", "300")),
+    )
+    await _queue.start()
+    return _queue
+
+
+async def stop() -> None:
+    global _queue
+    if _queue is not None:
+        await _queue.stop()
+        _queue = None
@@ -1,24 +1,25 @@
 import os
-import base64
-import uuid
+import json
 import traceback
-import httpx
-import boto3
 import google.generativeai as genai
 
-from fastapi import FastAPI, Depends
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, File, Form, HTTPException, Query, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 
-from db import SessionLocal, engine, get_db
-from models.base import Base
-
-from crud import get_images_by_user
-from schemas import ImageRecordOut
+from db import SessionLocal, AsyncSessionLocal, engine, async_engine, get_db, get_async_db
+from models.base import Base, create_missing_indexes
 
 import models, schemas, crud
+import webui_client
+import translation
+import storage
+import generation
+import jobs
 
 # .env読み込み
 dotenv_path = os.path.join(os.path.dirname(__file__), "../.env")
@@ -26,21 +27,11 @@ load_dotenv(dotenv_path)
 
 # 各種キー設定
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_REGION = os.getenv("AWS_REGION")
-S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
-
-# S3クライアント
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
 
 # DB初期化
 Base.metadata.create_all(bind=engine)
+# create_all は既存テーブルにインデックスを足さないので、足りないものだけ作る
+create_missing_indexes(engine)
 
 def get_db():
     db = SessionLocal()
@@ -49,19 +40,20 @@ def get_db():
     finally:
         db.close()
 
-# S3アップロード共通関数
-def upload_to_s3(file_data: bytes, filename: str) -> str:
-    s3_client.put_object(
-        Bucket=S3_BUCKET_NAME,
-        Key=filename,
-        Body=file_data,
-        ContentType='image/png',
-        ACL='public-read'
-    )
-    return f"https://{S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{filename}"
-
 # FastAPIアプリケーション
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with webui_client.lifespan(app):
+        await jobs.start(AsyncSessionLocal)
+        try:
+            yield
+        finally:
+            await jobs.stop()
+            translation.shutdown()
+            await storage.close()
+            await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -71,145 +63,160 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-STABLE_DIFFUSION_API = "http://127.0.0.1:7860"
-ANYTHING_MODEL_NAME = "AnythingXL_xl.safetensors"
-
-@app.post("/api/full_generate", response_model=schemas.GenerateImageResponse)
-async def full_generate(req: schemas.GenerateImageRequest, db: Session = Depends(get_db)):
+async def run_generate(kind: str, req, db: AsyncSession, files: dict | None = None):
     try:
-        model = genai.GenerativeModel("models/gemini-1.5-flash")
-        prompt = f"""
-        You are an expert in generating prompts for Stable Diffusion XL.
-        Convert the following Japanese description into a prompt: {req.prompt}
-        Style: {req.style}
-        """
-        gemini_response = model.generate_content(prompt)
-        adjusted_prompt = gemini_response.text.strip()
-
-        await httpx.AsyncClient().post(f"{STABLE_DIFFUSION_API}/sdapi/v1/options", json={
-            "sd_model_checkpoint": ANYTHING_MODEL_NAME
-        })
-
-        payload = {
-            "prompt": adjusted_prompt,
-            "steps": req.steps,
-            "width": req.width,
-            "height": req.height,
-            "sampler_name": "DPM++ 2M Karras"
-        }
-
-        async with httpx.AsyncClient(timeout=httpx.Timeout(600.0)) as client:
-            response = await client.post(f"{STABLE_DIFFUSION_API}/sdapi/v1/txt2img", json=payload)
-            result = response.json()
-
-        if "images" not in result:
-            return JSONResponse(status_code=500, content={"error": "Invalid response", "raw_response": result})
-
-        image_data = base64.b64decode(result["images"][0])
-        filename = f"{uuid.uuid4()}.png"
-        image_url = upload_to_s3(image_data, filename)
-
-        record = schemas.ImageRecordCreate(image_url=image_url, prompt=req.prompt)
-        crud.create_image_record(db, record)
-
-        return schemas.GenerateImageResponse(image_url=image_url, adjusted_prompt=adjusted_prompt)
+        return await generation.generate(kind, req, db, files=files)
 
+    except generation.InvalidResponse as e:
+        return JSONResponse(status_code=500, content={"error": "Invalid response", "raw_response": e.raw_response})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e), "trace": traceback.format_exc()})
 
-@app.post("/api/masked_full_generate", response_model=schemas.GenerateImageResponse)
-async def masked_full_generate(req: schemas.MaskedGenerateRequest, db: Session = Depends(get_db)):
-    try:
-        model = genai.GenerativeModel("models/gemini-1.5-flash")
-        prompt = f"""
-        Convert the following Japanese image description into a short, high-quality English prompt for img2img generation.
-        Style: {req.style}
-        """
-        gemini_response = model.generate_content(prompt)
-        adjusted_prompt = gemini_response.text.strip()
-
-        payload = {
-            "prompt": adjusted_prompt,
-            "init_images": [req.original_base64],
-            "mask": req.mask_base64,
-            "inpainting_fill": 1,
-            "steps": req.steps,
-            "width": req.width,
-            "height": req.height,
-            "sampler_name": "DPM++ 2M Karras",
-            "denoising_strength": 0.35,
-            "inpaint_full_res": True,
-            "inpaint_full_res_padding": 32
-        }
-
-        async with httpx.AsyncClient(timeout=httpx.Timeout(600.0)) as client:
-            response = await client.post(f"{STABLE_DIFFUSION_API}/sdapi/v1/img2img", json=payload)
-            result = response.json()
-
-        if "images" not in result:
-            return JSONResponse(status_code=500, content={"error": "Invalid response", "raw_response": result})
-
-        image_data = base64.b64decode(result["images"][0])
-        filename = f"{uuid.uuid4()}.png"
-        image_url = upload_to_s3(image_data, filename)
-
-        record = schemas.ImageRecordCreate(image_url=image_url, prompt=req.prompt)
-        crud.create_image_record(db, record)
-
-        return schemas.GenerateImageResponse(image_url=image_url, adjusted_prompt=adjusted_prompt)
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e), "trace": traceback.format_exc()})
+# 進捗とライブプレビューを Server-Sent Events で返す
+def stream_generate(kind: str, req) -> StreamingResponse:
+    async def events():
+        try:
+            async for event, data in generation.stream(kind, req, AsyncSessionLocal):
+                yield sse_event(event, data)
+        except generation.InvalidResponse as e:
+            yield sse_event("error", {"error": "Invalid response", "raw_response": e.raw_response})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e), "trace": traceback.format_exc()})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/api/full_generate", response_model=schemas.GenerateImageResponse)
+async def full_generate(req: schemas.GenerateImageRequest, db: AsyncSession = Depends(get_async_db)):
+    return await run_generate("full_generate", req, db)
+
+@app.post("/api/masked_full_generate", response_model=schemas.GenerateImageResponse)
+async def masked_full_generate(req: schemas.MaskedGenerateRequest, db: AsyncSession = Depends(get_async_db)):
+    return await run_generate("masked_full_generate", req, db)
 
 @app.post("/api/img2img_full_generate", response_model=schemas.GenerateImageResponse)
-async def img2img_full_generate(req: schemas.Image2ImageGenerateRequest, db: Session = Depends(get_db)):
+async def img2img_full_generate(req: schemas.Image2ImageGenerateRequest, db: AsyncSession = Depends(get_async_db)):
+    return await run_generate("img2img_full_generate", req, db)
+
+# 画像をbase64ではなくmultipartのファイルとして受け取る版（webuiへもバイト列のまま送る）
+@app.post("/api/masked_full_generate/upload", response_model=schemas.GenerateImageResponse)
+async def masked_full_generate_upload(
+    original: UploadFile = File(...),
+    mask: UploadFile = File(...),
+    prompt: str = Form(...),
+    steps: int = Form(...),
+    width: int = Form(...),
+    height: int = Form(...),
+    style: str = Form(...),
+    user_id: str | None = Form(None),
+    db: AsyncSession = Depends(get_async_db),
+):
+    req = schemas.MaskedGenerateRequest(prompt=prompt, original_base64="", mask_base64="", steps=steps, width=width, height=height, style=style, user_id=user_id)
+    files = {"init_images": [await original.read()], "mask": await mask.read()}
+    return await run_generate("masked_full_generate", req, db, files=files)
+
+@app.post("/api/img2img_full_generate/upload", response_model=schemas.GenerateImageResponse)
+async def img2img_full_generate_upload(
+    original: UploadFile = File(...),
+    prompt: str = Form(...),
+    steps: int = Form(...),
+    width: int = Form(...),
+    height: int = Form(...),
+    style: str = Form(...),
+    user_id: str | None = Form(None),
+    db: AsyncSession = Depends(get_async_db),
+):
+    req = schemas.Image2ImageGenerateRequest(prompt=prompt, original_base64="", steps=steps, width=width, height=height, style=style, user_id=user_id)
+    files = {"init_images": [await original.read()]}
+    return await run_generate("img2img_full_generate", req, db, files=files)
+
+@app.post("/api/full_generate/stream")
+async def full_generate_stream(req: schemas.GenerateImageRequest):
+    return stream_generate("full_generate", req)
+
+@app.post("/api/masked_full_generate/stream")
+async def masked_full_generate_stream(req: schemas.MaskedGenerateRequest):
+    return stream_generate("masked_full_generate", req)
+
+@app.post("/api/img2img_full_generate/stream")
+async def img2img_full_generate_stream(req: schemas.Image2ImageGenerateRequest):
+    return stream_generate("img2img_full_generate", req)
+
+async def submit_job(kind: str, req) -> JSONResponse:
+    try:
+        job_id = await jobs.get_queue().submit(kind, req)
+    except jobs.QueueFull as e:
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": str(e.retry_after)})
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued"})
+
+@app.post("/api/jobs/full_generate", status_code=202)
+async def full_generate_job(req: schemas.GenerateImageRequest):
+    return await submit_job("full_generate", req)
+
+@app.post("/api/jobs/masked_full_generate", status_code=202)
+async def masked_full_generate_job(req: schemas.MaskedGenerateRequest):
+    return await submit_job("masked_full_generate", req)
+
+@app.post("/api/jobs/img2img_full_generate", status_code=202)
+async def img2img_full_generate_job(req: schemas.Image2ImageGenerateRequest):
+    return await submit_job("img2img_full_generate", req)
+
+@app.get("/api/jobs/{job_id}", response_model=schemas.JobOut)
+async def get_job(job_id: str):
+    job = await jobs.get_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+# ジョブの状態が変わるたびに Server-Sent Events で通知する
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    queue = jobs.get_queue()
+    if await queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="job not found")
+
+    async def events():
+        last = None
+        while True:
+            job = schemas.JobOut.model_validate(await queue.get(job_id))
+            data = job.model_dump(mode="json")
+            data["position"] = queue.position(job_id)
+            if data != last:
+                yield sse_event("status", data)
+                last = data
+            if job.status in jobs.FINISHED_STATUSES:
+                return
+            await queue.wait(job_id, timeout=2.0)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+HISTORY_PAGE_SIZE = 50
+
+# limit も cursor も無ければ従来どおり全件のリストを返す。どちらかがあれば ImageRecordPage を返す
+async def get_records_page(db: AsyncSession, user_id: str | None, limit: int | None, cursor: str | None) -> schemas.ImageRecordPage | list[schemas.ImageRecordOut]:
+    paged = limit is not None or cursor is not None
     try:
-        model = genai.GenerativeModel("models/gemini-1.5-flash")
-        prompt = f"""
-        Convert the following Japanese image description into a comma-separated high-quality English prompt.
-        Style: {req.style}
-        """
-        gemini_response = model.generate_content(prompt)
-        adjusted_prompt = gemini_response.text.strip()
-
-        payload = {
-            "prompt": adjusted_prompt,
-            "init_images": [req.original_base64],
-            "steps": req.steps,
-            "width": req.width,
-            "height": req.height,
-            "sampler_name": "DPM++ 2M Karras",
-            "denoising_strength": 0.6,
-            "inpainting_fill": 1
-        }
-
-        async with httpx.AsyncClient(timeout=httpx.Timeout(600.0)) as client:
-            response = await client.post(f"{STABLE_DIFFUSION_API}/sdapi/v1/img2img", json=payload)
-            result = response.json()
-
-        if "images" not in result:
-            return JSONResponse(status_code=500, content={"error": "Invalid response", "raw_response": result})
-
-        image_data = base64.b64decode(result["images"][0])
-        filename = f"{uuid.uuid4()}.png"
-        image_url = upload_to_s3(image_data, filename)
-
-        record = schemas.ImageRecordCreate(image_url=image_url, prompt=req.prompt)
-        crud.create_image_record(db, record)
-
-        return schemas.GenerateImageResponse(image_url=image_url, adjusted_prompt=adjusted_prompt)
+        records, next_cursor = await crud.get_records_page_async(db, user_id=user_id, limit=(limit or HISTORY_PAGE_SIZE) if paged else None, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not paged:
+        return records
+    return schemas.ImageRecordPage(items=records, next_cursor=next_cursor)
 
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e), "trace": traceback.format_exc()})
+@app.get("/api/history", response_model=schemas.ImageRecordPage | list[schemas.ImageRecordOut])
+async def get_history(user_id: str | None = None, limit: int | None = Query(None, ge=1, le=200), cursor: str | None = None, db: AsyncSession = Depends(get_async_db)):
+    return await get_records_page(db, user_id, limit, cursor)
 
-@app.get("/api/history", response_model=list[schemas.ImageRecordOut])
-def get_history(db: Session = Depends(get_db)):
-    return crud.get_all_records(db)
+@app.get("/api/backends")
+def list_backends():
+    return [backend.status() for backend in webui_client.get_router().backends]
 
 @app.get("/")
 def root():
     return {"message": "Backend is running."}
 
-@app.get("/api/users/{user_id}/images", response_model=list[ImageRecordOut])
-def read_user_images(user_id: int, db: Session = Depends(get_db)):
-    return get_images_by_user(db, user_id)
+@app.get("/api/users/{user_id}/images", response_model=schemas.ImageRecordPage | list[schemas.ImageRecordOut])
+async def read_user_images(user_id: int, limit: int | None = Query(None, ge=1, le=200), cursor: str | None = None, db: AsyncSession = Depends(get_async_db)):
+    return await get_records_page(db, str(user_id), limit, cursor)
@@ -0,0 +1,65 @@
+# model_state.py
+import os
+import time
+
+import webui_client
+from webui_router import WebuiBackend
+
+
+# 各webuiで現在ロードされているモデルのキャッシュは WebuiBackend.options に持つ
+def _ttl() -> float:
+    return float(os.getenv("MODEL_STATE_TTL", "60"))
+
+
+def invalidate(backend: WebuiBackend) -> None:
+    backend.options_fetched_at = 0.0
+
+
+async def refresh(backend: WebuiBackend) -> dict:
+    response = await webui_client.get("/sdapi/v1/options", backend=backend)
+    response.raise_for_status()
+    return backend.set_options(response.json())
+
+
+async def current(backend: WebuiBackend) -> dict:
+    async with backend.options_lock:
+        if not backend.options or time.monotonic() - backend.options_fetched_at > _ttl():
+            await refresh(backend)
+        return dict(backend.options)
+
+
+async def checkpoint_overrides(backend: WebuiBackend, checkpoint: str, vae: str | None = None) -> dict:
+    # 変更が必要な項目だけをtxt2imgのoverride_settingsとして返す
+    state = await current(backend)
+    overrides = {}
+    if not backend.has_checkpoint(checkpoint):
+        overrides["sd_model_checkpoint"] = checkpoint
+    if vae is not None and state.get("sd_vae") != vae:
+        overrides["sd_vae"] = vae
+    return overrides
+
+
+def apply_overrides(payload: dict, overrides: dict) -> dict:
+    if overrides:
+        payload["override_settings"] = {**payload.get("override_settings", {}), **overrides}
+        # 切り替えたモデルをそのまま残し、次のリクエストで再ロードさせない
+        payload["override_settings_restore_afterwards"] = False
+    return payload
+
+
+def record_applied(backend: WebuiBackend, overrides: dict) -> None:
+    # 生成が成功したらoverrideの内容がwebui側の状態になる
+    if overrides and backend.options:
+        backend.options.update(overrides)
+
+
+async def ensure_checkpoint(backend: WebuiBackend, checkpoint: str, vae: str | None = None) -> None:
+    # override_settingsを使わない場合: 差分があるときだけ /sdapi/v1/options を呼ぶ
+    overrides = await checkpoint_overrides(backend, checkpoint, vae)
+    if not overrides:
+        return
+    response = await webui_client.post("/sdapi/v1/options", json=overrides, backend=backend)
+    if response.is_error:
+        invalidate(backend)
+    response.raise_for_status()
+    record_applied(backend, overrides)
@@ -1,5 +1,24 @@
 # models/base.py
+from sqlalchemy import inspect
 from sqlalchemy.orm import DeclarativeBase
 
 class Base(DeclarativeBase):
     pass
+
+# 既存のテーブルに、モデルで宣言したのに無いインデックスを作る（create_all はテーブルごと無いときしか作らない）
+# MySQLなら次と同じ:
+#   CREATE INDEX ix_generated_images_user_created_id ON generated_images (user_id, created_at DESC, id);
+#   CREATE INDEX ix_generated_images_created_id ON generated_images (created_at DESC, id);
+def create_missing_indexes(bind) -> list[str]:
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind)
+                created.append(index.name)
+    return created
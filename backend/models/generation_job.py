@@ -0,0 +1,29 @@
+# models/generation_job.py
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import String, DateTime, Text, Index
+from sqlalchemy.dialects.mysql import LONGTEXT
+from datetime import datetime
+from models.base import Base
+
+class GenerationJob(Base):
+    __tablename__ = "generation_jobs"
+
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    kind: Mapped[str] = mapped_column(String(64), nullable=False)
+    # queued / running / succeeded / failed
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="queued")
+    # リクエスト本体（base64画像を含むので大きめの型にする）
+    request_json: Mapped[str] = mapped_column(Text().with_variant(LONGTEXT(), "mysql"), nullable=False)
+    user_id: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # ジョブを持っているゲートウェイのインスタンスID。updated_at はその生存確認を兼ねる
+    owner: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    adjusted_prompt: Mapped[str | None] = mapped_column(Text, nullable=True)
+    image_url: Mapped[str | None] = mapped_column(String(512), nullable=True)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # 再起動時に未完了ジョブを拾う用
+    __table_args__ = (
+        Index("ix_generation_jobs_status_created", "status", "created_at"),
+    )
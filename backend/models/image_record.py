@@ -1,6 +1,6 @@
 # models/image_record.py
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, DateTime, ForeignKey
+from sqlalchemy import String, DateTime, ForeignKey, Index
 from datetime import datetime
 from models.base import Base
 
@@ -15,3 +15,9 @@ class ImageRecord(Base):
     # 外部キー + リレーション
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
     user: Mapped["User"] = relationship(back_populates="images")
+
+    # 履歴のキーセットページング用 (user_id, created_at DESC, id)
+    __table_args__ = (
+        Index("ix_generated_images_user_created_id", "user_id", created_at.desc(), "id"),
+        Index("ix_generated_images_created_id", created_at.desc(), "id"),
+    )
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from datetime import datetime
 from typing import Optional
 
 
@@ -53,10 +54,18 @@ class ImageRecordOut(BaseModel):
     id: int
     image_url: str
     prompt: str
-    user_id: Optional[str] = None
+    user_id: Optional[str] = None  # リクエスト側と同じく文字列で返す（DBの列は整数）
+    created_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True  # pydantic v2 の新構文（旧 orm_mode）
+        coerce_numbers_to_str = True
+
+
+# ▼ ページング付きの履歴レスポンス（next_cursor を次回の cursor に渡す）
+class ImageRecordPage(BaseModel):
+    items: list[ImageRecordOut]
+    next_cursor: Optional[str] = None
 
 class UserCreate(BaseModel):
     username: str
@@ -69,4 +78,19 @@ class UserOut(BaseModel):
     email: str
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+# ▼ /api/jobs 用（ジョブの状態）
+class JobOut(BaseModel):
+    id: str
+    kind: str
+    status: str
+    adjusted_prompt: Optional[str] = None
+    image_url: Optional[str] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,154 @@
+"""
+Measures per-request work the txt2img API does outside of sampling, for different numbers of always-on scripts.
+
+Always-on scripts here are no-op scripts with two UI components each, so times are the cost of the machinery rather than of any script.
+For every request it times:
+  - making default script args from scratch, for reference; the API does it once per script runner
+  - looking up the requested always-on scripts by title, with a scan of all titles as the API used to do and as ScriptArgsTemplate does
+  - running script hooks that process_images calls for every request and image
+  - making infotexts for every image, which skip_infotext avoids
+
+    python benchmarks/bench_api_overhead.py --scripts 0 10 50 200 --batch-size 4
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--scripts", type=int, nargs="+", default=[0, 10, 50, 200], help="numbers of always-on scripts to test")
+parser.add_argument("--batch-size", type=int, default=4, help="images per request")
+parser.add_argument("--requests", type=int, default=200, help="requests to time for each measurement")
+args = parser.parse_args()
+
+# webui modules parse the command line when imported
+sys.argv = sys.argv[:1]
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from modules import shared_init  # noqa: E402
+shared_init.initialize()
+
+import gradio as gr  # noqa: E402
+from modules import processing, scripts  # noqa: E402
+from modules.api import script_templates  # noqa: E402
+
+
+class NoopScript(scripts.Script):
+    def __init__(self, index):
+        self.index = index
+        self.filename = f"noop_{index}.py"
+
+    def title(self):
+        return f"Noop {self.index}"
+
+    def show(self, is_img2img):
+        return scripts.AlwaysVisible
+
+    def ui(self, is_img2img):
+        return [gr.Checkbox(value=False), gr.Slider(value=0.5)]
+
+    def process(self, p, *args):
+        pass
+
+    def process_batch(self, p, *args, **kwargs):
+        pass
+
+    def postprocess_image(self, p, pp, *args):
+        pass
+
+    def postprocess(self, p, processed, *args):
+        pass
+
+
+def make_runner(count):
+    runner = scripts.ScriptRunner()
+
+    for index in range(count):
+        script = NoopScript(index)
+        script.args_from = 1 + index * 2
+        script.args_to = script.args_from + 2
+        script.alwayson = True
+        script.is_txt2img = True
+        script.is_img2img = False
+        runner.scripts.append(script)
+        runner.alwayson_scripts.append(script)
+
+    return runner
+
+
+def make_p(runner, script_args, batch_size):
+    p = processing.StableDiffusionProcessingTxt2Img(sd_model=None, prompt="a photo of a cat", negative_prompt="blurry", batch_size=batch_size, steps=20, sampler_name="Euler a")
+    p.scripts = runner
+    p.script_args = tuple(script_args)
+    p.sd_model_name = "model"
+    p.sd_model_hash = "0123456789"
+    p.sd_vae_name = None
+    p.sd_vae_hash = None
+    p.fill_fields_from_opts()
+    p.main_prompt, p.main_negative_prompt = p.prompt, p.negative_prompt
+    p.all_prompts = p.prompts = [p.prompt] * batch_size
+    p.all_negative_prompts = p.negative_prompts = [p.negative_prompt] * batch_size
+    p.all_seeds = p.seeds = list(range(batch_size))
+    p.all_subseeds = p.subseeds = list(range(batch_size))
+    return p
+
+
+def script_name_to_index(name, scripts):
+    """The lookup the API did before ScriptArgsTemplate: a scan of all script titles for every requested script."""
+
+    return [script.title().lower() for script in scripts].index(name.lower())
+
+
+def timed(func):
+    samples = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    return statistics.median(samples) * 1e6
+
+
+def measure(count):
+    runner = make_runner(count)
+    template = script_templates.ScriptArgsTemplate(runner)
+    requested = [script.title() for script in runner.alwayson_scripts[::5]]
+    p = make_p(runner, template.default_args, args.batch_size)
+
+    def defaults():
+        script_templates.default_script_args(runner)
+
+    def lookup_old():
+        for name in requested:
+            runner.scripts[script_name_to_index(name, runner.scripts)]
+
+    def lookup_new():
+        for name in requested:
+            template.scripts_by_title[name.lower()]
+
+    def hooks():
+        runner.process(p)
+        runner.process_batch(p, batch_number=0, prompts=p.prompts, seeds=p.seeds, subseeds=p.subseeds)
+        for _ in range(args.batch_size):
+            runner.postprocess_image(p, scripts.PostprocessImageArgs(None))
+        runner.postprocess(p, None)
+
+    def infotexts():
+        for index in range(args.batch_size):
+            processing.create_infotext(p, p.prompts, p.seeds, p.subseeds, index=index, all_negative_prompts=p.negative_prompts)
+
+    return [timed(func) for func in (defaults, lookup_old, lookup_new, hooks, infotexts)]
+
+
+def main():
+    print(f"{'scripts':>8} {'defaults':>10} {'lookup old':>11} {'lookup new':>11} {'hooks':>9} {'infotexts':>10}   (median µs per request, {args.batch_size} images)")
+
+    for count in args.scripts:
+        defaults, lookup_old, lookup_new, hooks, infotexts = measure(count)
+        print(f"{count:>8} {defaults:>10.1f} {lookup_old:>11.1f} {lookup_new:>11.1f} {hooks:>9.1f} {infotexts:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Simulates a mix of jobs contending for queue_lock and reports latency percentiles per job kind,
+comparing the old FIFOLock with PriorityLock.
+
+Jobs are sleeps standing in for GPU work. One client floods the queue with long hires-fix jobs,
+another sends short previews, and model list refreshes arrive now and then.
+
+    python benchmarks/bench_queue_lock.py --jobs 300 --load 0.9
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from modules import fifo_lock  # noqa: E402
+
+# name: (client, share of jobs, seconds holding the lock, priority)
+JOB_KINDS = {
+    "preview": ("artist", 0.45, 0.02, 0),
+    "hires": ("batch-bot", 0.45, 0.12, 0),
+    "refresh": ("admin", 0.10, 0.002, 10),
+}
+
+
+def make_schedule(jobs, load, seed):
+    rng = random.Random(seed)
+    kinds = list(JOB_KINDS)
+    weights = [JOB_KINDS[kind][1] for kind in kinds]
+    mean_hold = sum(JOB_KINDS[kind][1] * JOB_KINDS[kind][2] for kind in kinds)
+
+    schedule = []
+    at = 0.0
+    for _ in range(jobs):
+        at += rng.expovariate(load / mean_hold)
+        schedule.append((at, rng.choices(kinds, weights)[0]))
+
+    return schedule
+
+
+def run(lock, schedule, use_priority):
+    latencies = {kind: [] for kind in JOB_KINDS}
+    record = threading.Lock()
+
+    def job(kind, submitted):
+        client, _, hold, priority = JOB_KINDS[kind]
+        if use_priority:
+            lock.acquire(client=client, priority=priority)
+        else:
+            lock.acquire()
+
+        try:
+            time.sleep(hold)
+        finally:
+            lock.release()
+
+        with record:
+            latencies[kind].append(time.perf_counter() - submitted)
+
+    threads = []
+    start = time.perf_counter()
+    for at, kind in schedule:
+        delay = start + at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        thread = threading.Thread(target=job, args=(kind, time.perf_counter()))
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    return latencies, time.perf_counter() - start
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def report(name, latencies, elapsed):
+    print(f"{name} ({elapsed:.1f}s)")
+    print(f"  {'kind':<8} {'n':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, values in latencies.items():
+        if not values:
+            continue
+
+        p50, p95, p99 = (percentile(values, q) * 1000 for q in (50, 95, 99))
+        print(f"  {kind:<8} {len(values):>4} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {max(values) * 1000:>8.1f}")
+
+    everything = [x for values in latencies.values() for x in values]
+    print(f"  {'all':<8} {len(everything):>4} {statistics.median(everything) * 1000:>8.1f} {percentile(everything, 95) * 1000:>8.1f} {percentile(everything, 99) * 1000:>8.1f} {max(everything) * 1000:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=300)
+    parser.add_argument("--load", type=float, default=0.9, help="offered load as a fraction of lock capacity")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    schedule = make_schedule(args.jobs, args.load, args.seed)
+
+    report("FIFOLock", *run(fifo_lock.FIFOLock(), schedule, use_priority=False))
+    report("PriorityLock", *run(fifo_lock.PriorityLock(), schedule, use_priority=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Compares load time and peak memory of reading safetensors files with the safetensors library and with modules/safetensors_lazy.py.
+
+Each measurement runs in a new process. It loads the file, then reads a share of its tensors (the first --read of keys,
+by summing each one) the way weights are consumed by a model or a LoRA, and reports:
+  - seconds from opening the file until the last of those tensors is read
+  - peak resident memory over what the process had before loading; pages of a memory-mapped file count once they are read
+
+Ways of loading:
+  - load_file: safetensors.torch.load_file, what read_state_dict did
+  - load(bytes): safetensors.torch.load of the whole file, what read_state_dict did with disable_mmap_load_safetensors
+  - lazy mmap, lazy read: safetensors_lazy.load with use_mmap=True and False
+
+The file is read once beforehand so that all ways find it in the page cache.
+
+    python benchmarks/bench_safetensors_load.py models/Stable-diffusion/model.safetensors models/VAE/vae.safetensors models/Lora/lora.safetensors --read 1.0 0.25
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("files", nargs="+", help="safetensors files to load; a checkpoint, a VAE and a LoRA for example")
+parser.add_argument("--read", type=float, nargs="+", default=[1.0, 0.25], help="shares of tensors to read after loading")
+parser.add_argument("--device", default="cpu", help="device to load tensors to")
+parser.add_argument("--child", nargs=3, metavar=("METHOD", "FILE", "READ"), help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+METHODS = ["load_file", "load(bytes)", "lazy mmap", "lazy read"]
+
+
+def peak_rss():
+    try:
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+
+
+def run_child(method, filename, read):
+    import safetensors.torch
+    import torch  # noqa: F401
+    from modules import safetensors_lazy
+
+    baseline = peak_rss()
+    start = time.perf_counter()
+
+    if method == "load_file":
+        sd = safetensors.torch.load_file(filename, device=args.device)
+    elif method == "load(bytes)":
+        with open(filename, "rb") as file:
+            sd = safetensors.torch.load(file.read())
+        sd = {k: v.to(args.device) for k, v in sd.items()}
+    else:
+        sd = safetensors_lazy.load(filename, device=args.device, use_mmap=method == "lazy mmap")
+
+    keys = list(sd.keys())
+    for key in keys[:round(len(keys) * read)]:
+        sd[key].sum()
+
+    seconds = time.perf_counter() - start
+    print(json.dumps({"seconds": seconds, "peak": peak_rss() - baseline}))
+
+
+def measure(method, filename, read):
+    output = subprocess.check_output([sys.executable, __file__, "--device", args.device, "--child", method, filename, str(read)], text=True)
+    return json.loads(output.splitlines()[-1])
+
+
+def warm_up(filename):
+    with open(filename, "rb") as file:
+        while file.read(16 * 2**20):
+            pass
+
+
+def main():
+    if args.child:
+        method, filename, read = args.child
+        run_child(method, filename, float(read))
+        return
+
+    print(f"{'file':<40} {'size MB':>8} {'read':>5} " + " ".join(f"{method:>22}" for method in METHODS))
+    print(f"{'':<40} {'':>8} {'':>5} " + " ".join(f"{'seconds / peak MB':>22}" for _ in METHODS))
+
+    for filename in args.files:
+        warm_up(filename)
+        size = os.path.getsize(filename) / 2**20
+
+        for read in args.read:
+            results = [measure(method, filename, read) for method in METHODS]
+            cells = " ".join(f"{result['seconds']:>12.2f} / {result['peak'] / 2**20:>7.0f}" for result in results)
+            print(f"{os.path.basename(filename)[-40:]:<40} {size:>8.0f} {read:>5.2f} {cells}")
+
+
+if __name__ == "__main__":
+    main()
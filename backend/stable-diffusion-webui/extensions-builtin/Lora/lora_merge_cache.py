@@ -0,0 +1,134 @@
+import collections
+import weakref
+
+import torch
+
+from modules import devices, shared
+
+
+def tensors_size(tensors):
+    return sum(x.numel() * x.element_size() for x in tensors if x is not None)
+
+
+class MergedWeightsCache:
+    """
+    Weights of layers with sets of networks merged into them, so that switching a layer back to a set of networks it had before
+    copies its weights from here instead of restoring them from backup and merging every network again.
+
+    Entries are kept for the layer's object and the set of networks with their multipliers and file modification times.
+    Least recently used entries are evicted when their tensors take more than opts.lora_merged_cache_mb; 0 disables the cache.
+    """
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.keys_by_layer = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def budget():
+        return int(shared.opts.lora_merged_cache_mb * 1024 * 1024)
+
+    def enabled(self):
+        return self.budget() > 0
+
+    def get(self, layer, networks_key):
+        key = (id(layer), networks_key)
+        entry = self.entries.get(key)
+        if entry is None or entry[0]() is not layer:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, layer, networks_key, tensors):
+        """Stores copies of tensors, which are the layer's weights after merging the networks in networks_key."""
+
+        size = tensors_size(tensors)
+        budget = self.budget()
+        if budget <= 0 or size > budget:
+            return
+
+        device = devices.device if shared.opts.lora_merged_cache_vram else devices.cpu
+        tensors = tuple(None if x is None else x.detach().to(device, copy=True) for x in tensors)
+
+        layer_id = id(layer)
+        key = (layer_id, networks_key)
+        self.remove(key)
+
+        keys = self.keys_by_layer.get(layer_id)
+        if keys is None:
+            keys = self.keys_by_layer[layer_id] = set()
+
+        # entries of unloaded models are removed when their layers are
+        self.entries[key] = (weakref.ref(layer, lambda _: self.forget_layer_id(layer_id)), tensors, size)
+        keys.add(key)
+        self.size += size
+
+        while self.entries and self.size > budget:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        self.size -= entry[2]
+        keys = self.keys_by_layer.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_layer[key[0]]
+
+    def forget_layer(self, layer):
+        """Removes entries for the layer, for when its weights are replaced."""
+
+        self.forget_layer_id(id(layer))
+
+    def forget_layer_id(self, layer_id):
+        for key in list(self.keys_by_layer.get(layer_id, ())):
+            self.remove(key)
+
+    def trim(self):
+        budget = self.budget()
+        while self.entries and self.size > budget:
+            self.remove(next(iter(self.entries)))
+
+        devices.torch_gc()
+
+    def clear(self):
+        self.entries.clear()
+        self.keys_by_layer.clear()
+        self.size = 0
+
+        devices.torch_gc()
+
+
+def weight_fields(layer):
+    """Returns (object, attribute name) pairs of tensors in the layer that merging networks changes; bias comes last."""
+
+    if isinstance(layer, torch.nn.MultiheadAttention):
+        return [(layer, 'in_proj_weight'), (layer.out_proj, 'weight'), (layer.out_proj, 'bias')]
+
+    return [(layer, 'weight'), (layer, 'bias')]
+
+
+def layer_weights(layer):
+    return tuple(getattr(obj, field, None) for obj, field in weight_fields(layer))
+
+
+def restore_layer_weights(layer, tensors):
+    with torch.no_grad():
+        for (obj, field), cached in zip(weight_fields(layer), tensors):
+            current = getattr(obj, field, None)
+            if cached is None:
+                if current is not None:
+                    setattr(obj, field, None)
+            elif current is not None:
+                current.copy_(cached)
+
+
+merged_weights = MergedWeightsCache()
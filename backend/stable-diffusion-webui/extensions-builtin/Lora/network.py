@@ -98,6 +98,7 @@ class Network:  # LoraModule
         self.modules = {}
         self.bundle_embeddings = {}
         self.mtime = None
+        self.size = 0
 
         self.mentioned_name = None
         """the text that was used to add the network to prompt - can be either name or an alias"""
@@ -3,7 +3,9 @@ import gradio as gr
 import logging
 import os
 import re
+import time
 
+import lora_merge_cache
 import lora_patches
 import network
 import network_lora
@@ -18,7 +20,7 @@ import network_oft
 import torch
 from typing import Union
 
-from modules import shared, devices, sd_models, errors, scripts, sd_hijack
+from modules import shared, devices, sd_models, errors, scripts, sd_hijack, metrics
 import modules.textual_inversion.textual_inversion as textual_inversion
 import modules.models.sd3.mmdit
 
@@ -159,6 +161,7 @@ def load_network(name, network_on_disk):
     net = network.Network(name, network_on_disk)
     net.mtime = os.path.getmtime(network_on_disk.filename)
 
+    # for safetensors files, this only reads tensors that are looked up, which is done below only for keys that match the model
     sd = sd_models.read_state_dict(network_on_disk.filename)
 
     # this should not be needed but is here as an emergency fix for an unknown error people are experiencing in 1.2.0
@@ -180,7 +183,7 @@ def load_network(name, network_on_disk):
     matched_networks = {}
     bundle_embeddings = {}
 
-    for key_network, weight in sd.items():
+    for key_network in sd.keys():
 
         if diffusers_weight_map:
             key_network_without_network_parts, network_name, network_weight = key_network.rsplit(".", 2)
@@ -193,9 +196,9 @@ def load_network(name, network_on_disk):
             emb_dict = bundle_embeddings.get(emb_name, {})
             if vec_name.split('.')[0] == 'string_to_param':
                 _, k2 = vec_name.split('.', 1)
-                emb_dict['string_to_param'] = {k2: weight}
+                emb_dict['string_to_param'] = {k2: sd[key_network]}
             else:
-                emb_dict[vec_name] = weight
+                emb_dict[vec_name] = sd[key_network]
             bundle_embeddings[emb_name] = emb_dict
 
         if diffusers_weight_map:
@@ -241,7 +244,7 @@ def load_network(name, network_on_disk):
         if key not in matched_networks:
             matched_networks[key] = network.NetworkWeights(network_key=key_network, sd_key=key, w={}, sd_module=sd_module)
 
-        matched_networks[key].w[network_part] = weight
+        matched_networks[key].w[network_part] = sd[key_network]
 
     for key, weights in matched_networks.items():
         net_module = None
@@ -267,11 +270,40 @@ def load_network(name, network_on_disk):
     if keys_failed_to_match:
         logging.debug(f"Network {network_on_disk.filename} didn't match keys: {keys_failed_to_match}")
 
+    net.size = network_size(net)
+
     return net
 
 
+def network_size(net):
+    """Returns the size of tensors in the network's modules, not counting the model's layers they are for."""
+
+    size = 0
+    for module in net.modules.values():
+        for name, value in vars(module).items():
+            if name == 'sd_module':
+                continue
+
+            if isinstance(value, torch.Tensor):
+                size += value.numel() * value.element_size()
+            elif isinstance(value, torch.nn.Module):
+                size += sum(x.numel() * x.element_size() for x in value.parameters())
+
+    return size
+
+
 def purge_networks_from_memory():
-    while len(networks_in_memory) > shared.opts.lora_in_memory_limit and len(networks_in_memory) > 0:
+    """Evicts least recently used networks over the count limit, or over the size limit if it's set."""
+
+    budget = int(shared.opts.lora_in_memory_mb * 1024 * 1024)
+
+    def over_limit():
+        if len(networks_in_memory) > shared.opts.lora_in_memory_limit:
+            return True
+
+        return budget > 0 and sum(net.size for net in networks_in_memory.values()) > budget
+
+    while len(networks_in_memory) > 0 and over_limit():
         name = next(iter(networks_in_memory))
         networks_in_memory.pop(name, None)
 
@@ -316,6 +348,10 @@ def load_networks(names, te_multipliers=None, unet_multipliers=None, dyn_dims=No
             if net is None:
                 net = networks_in_memory.get(name)
 
+            # most recently used networks go last, and are evicted last
+            if name in networks_in_memory:
+                networks_in_memory[name] = networks_in_memory.pop(name)
+
             if net is None or os.path.getmtime(network_on_disk.filename) > net.mtime:
                 try:
                     net = load_network(name, network_on_disk)
@@ -412,9 +448,12 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
     """
     Applies the currently selected set of networks to the weights of torch layer self.
     If weights already have this particular set of networks applied, does nothing.
-    If not, restores original weights from backup and alters weights according to networks.
+    If not, restores original weights from backup and alters weights according to networks,
+    or copies weights from lora_merge_cache if the layer had this set of networks merged before.
     """
 
+    global merge_seconds
+
     network_layer_name = getattr(self, 'network_layer_name', None)
     if network_layer_name is None:
         return
@@ -451,9 +490,18 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
         self.network_bias_backup = bias_backup
 
     if current_names != wanted_names:
-        network_restore_weights_from_backup(self)
+        start = time.perf_counter()
+
+        merged_weights = lora_merge_cache.merged_weights
+        networks_key = (wanted_names, tuple(net.mtime for net in loaded_networks))
+        cached = merged_weights.get(self, networks_key) if wanted_names != () and merged_weights.enabled() else None
+
+        if cached is not None:
+            lora_merge_cache.restore_layer_weights(self, cached)
+        else:
+            network_restore_weights_from_backup(self)
 
-        for net in loaded_networks:
+        for net in (loaded_networks if cached is None else []):
             module = net.modules.get(network_layer_name, None)
             if module is not None and hasattr(self, 'weight') and not isinstance(module, modules.models.sd3.mmdit.QkvLinear):
                 try:
@@ -539,8 +587,25 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
             logging.debug(f"Network {net.name} layer {network_layer_name}: couldn't find supported operation")
             extra_network_lora.errors[net.name] = extra_network_lora.errors.get(net.name, 0) + 1
 
+        # restoring cached weights can't add bias back, so layers that networks added bias to are not cached
+        if cached is None and wanted_names != () and merged_weights.enabled() and (bias_backup is None) == (lora_merge_cache.layer_weights(self)[-1] is None):
+            merged_weights.put(self, networks_key, lora_merge_cache.layer_weights(self))
+
         self.network_current_names = wanted_names
 
+        merge_seconds += time.perf_counter() - start
+
+
+def observe_merge_time():
+    """Records time spent merging networks into weights since the previous call; called once per generation."""
+
+    global merge_seconds
+
+    if merge_seconds > 0:
+        merge_time.observe(merge_seconds)
+
+    merge_seconds = 0.0
+
 
 def network_forward(org_module, input, original_forward):
     """
@@ -573,6 +638,7 @@ def network_reset_cached_weight(self: Union[torch.nn.Conv2d, torch.nn.Linear]):
     self.network_current_names = ()
     self.network_weights_backup = None
     self.network_bias_backup = None
+    lora_merge_cache.merged_weights.forget_layer(self)
 
 
 def network_Linear_forward(self, input):
@@ -732,6 +798,9 @@ loaded_networks = []
 loaded_bundle_embeddings = {}
 networks_in_memory = {}
 available_network_hash_lookup = {}
+
+merge_seconds = 0.0
+merge_time = metrics.Histogram("sd_lora_merge_seconds", "Time per generation spent merging Lora networks into weights, including restoring weights from backup or from the merged weights cache")
 forbidden_network_aliases = {}
 
 list_available_networks()
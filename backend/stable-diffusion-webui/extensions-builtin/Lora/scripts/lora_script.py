@@ -6,6 +6,7 @@ from fastapi import FastAPI
 import network
 import networks
 import lora  # noqa:F401
+import lora_merge_cache
 import lora_patches
 import extra_networks_lora
 import ui_extra_networks_lora
@@ -40,13 +41,16 @@ shared.options_templates.update(shared.options_section(('extra_networks', "Extra
     "lora_show_all": shared.OptionInfo(False, "Always show all networks on the Lora page").info("otherwise, those detected as for incompatible version of Stable Diffusion will be hidden"),
     "lora_hide_unknown_for_versions": shared.OptionInfo([], "Hide networks of unknown versions for model versions", gr.CheckboxGroup, {"choices": ["SD1", "SD2", "SDXL"]}),
     "lora_in_memory_limit": shared.OptionInfo(0, "Number of Lora networks to keep cached in memory", gr.Number, {"precision": 0}),
+    "lora_in_memory_mb": shared.OptionInfo(0, "Size limit of Lora networks cached in memory (MB)", gr.Number, {"precision": 0}).info("least recently used networks are removed first; 0 = no limit"),
+    "lora_merged_cache_mb": shared.OptionInfo(0, "Merged Lora weights cache size (MB)", gr.Number, {"precision": 0}).info("keeps model weights with recently used sets of networks merged into them, so that switching back to a set copies weights instead of merging it again; 0 = disable"),
+    "lora_merged_cache_vram": shared.OptionInfo(False, "Keep merged Lora weights cache in VRAM").info("switching sets of networks is faster, but the cache takes VRAM rather than RAM"),
     "lora_not_found_warning_console": shared.OptionInfo(False, "Lora not found warning in console"),
     "lora_not_found_gradio_warning": shared.OptionInfo(False, "Lora not found warning popup in webui"),
 }))
 
 
 shared.options_templates.update(shared.options_section(('compatibility', "Compatibility"), {
-    "lora_functional": shared.OptionInfo(False, "Lora/Networks: use old method that takes longer when you have multiple Loras active and produces same results as kohya-ss/sd-webui-additional-networks extension"),
+    "lora_functional": shared.OptionInfo(False, "Lora/Networks: use old method that takes longer when you have multiple Loras active and produces same results as kohya-ss/sd-webui-additional-networks extension").info("networks are applied to each layer's output instead of merged into its weights; switching networks costs nothing, but every step is slower"),
 }))
 
 
@@ -100,3 +104,6 @@ def infotext_pasted(infotext, d):
 script_callbacks.on_infotext_pasted(infotext_pasted)
 
 shared.opts.onchange("lora_in_memory_limit", networks.purge_networks_from_memory)
+shared.opts.onchange("lora_in_memory_mb", networks.purge_networks_from_memory)
+shared.opts.onchange("lora_merged_cache_mb", lora_merge_cache.merged_weights.trim)
+shared.opts.onchange("lora_merged_cache_vram", lora_merge_cache.merged_weights.clear)
@@ -1,43 +1,43 @@
 import base64
 import io
+import json
 import os
+import uuid
 import time
 import datetime
+import threading
 import uvicorn
 import ipaddress
-import requests
-import gradio as gr
-from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from fastapi import APIRouter, Depends, FastAPI, Request, Response
+from fastapi import APIRouter, Depends, FastAPI, File, Form, Request, Response, UploadFile
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.exceptions import HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
 from secrets import compare_digest
 
 import modules.shared as shared
-from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers
-from modules.api import models
+from modules import call_queue, fifo_lock, metrics, profiling, progress_events, sd_models_prefetch, sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers
+from modules.api import batching, jobs, models, remote_images, script_templates
 from modules.shared import opts
 from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images
 from modules.textual_inversion.textual_inversion import create_embedding, train_embedding
 from modules.hypernetworks.hypernetwork import create_hypernetwork, train_hypernetwork
 from PIL import PngImagePlugin
+from pydantic import ValidationError
 from modules.sd_models_config import find_checkpoint_config_near_filename
 from modules.realesrgan_model import get_realesrgan_models
 from modules import devices
-from typing import Any
+from typing import Any, Optional
 import piexif
 import piexif.helper
-from contextlib import closing
-from modules.progress import create_task_id, add_task_to_queue, start_task, finish_task, current_task
+from contextlib import closing, contextmanager
+from anyio import from_thread
+from modules.progress import create_task_id, add_task_to_queue, start_task, finish_task, current_task, pending_tasks, PreviewCache
 
-def script_name_to_index(name, scripts):
-    try:
-        return [script.title().lower() for script in scripts].index(name.lower())
-    except Exception as e:
-        raise HTTPException(status_code=422, detail=f"Script '{name}' not found") from e
+def checkpoint_override(args):
+    return (args.get("override_settings") or {}).get("sd_model_checkpoint")
 
 
 def validate_sampler_name(name):
@@ -83,10 +83,8 @@ def decode_base64_to_image(encoding):
             raise HTTPException(status_code=500, detail="Request to local resource not allowed")
 
         headers = {'user-agent': opts.api_useragent} if opts.api_useragent else {}
-        response = requests.get(encoding, timeout=30, headers=headers)
         try:
-            image = images.read(BytesIO(response.content))
-            return image
+            return remote_images.fetch_image(encoding, headers=headers, timeout=30)
         except Exception as e:
             raise HTTPException(status_code=500, detail="Invalid image url") from e
 
@@ -99,37 +97,146 @@ def decode_base64_to_image(encoding):
         raise HTTPException(status_code=500, detail="Invalid encoded image") from e
 
 
-def encode_pil_to_base64(image):
-    with io.BytesIO() as output_bytes:
-        if isinstance(image, str):
-            return image
-        if opts.samples_format.lower() == 'png':
-            use_metadata = False
-            metadata = PngImagePlugin.PngInfo()
-            for key, value in image.info.items():
-                if isinstance(key, str) and isinstance(value, str):
-                    metadata.add_text(key, value)
-                    use_metadata = True
-            image.save(output_bytes, format="PNG", pnginfo=(metadata if use_metadata else None), quality=opts.jpeg_quality)
-
-        elif opts.samples_format.lower() in ("jpg", "jpeg", "webp"):
-            if image.mode in ("RGBA", "P"):
-                image = image.convert("RGB")
-            parameters = image.info.get('parameters', None)
-            exif_bytes = piexif.dump({
-                "Exif": { piexif.ExifIFD.UserComment: piexif.helper.UserComment.dump(parameters or "", encoding="unicode") }
-            })
-            if opts.samples_format.lower() in ("jpg", "jpeg"):
-                image.save(output_bytes, format="JPEG", exif = exif_bytes, quality=opts.jpeg_quality)
+api_worker_pool = None
+api_worker_pool_lock = threading.Lock()
+
+
+def map_in_worker_pool(func, items):
+    """Like list(map(func, items)), but spreads the work over a thread pool shared by all API requests.
+
+    Used for image decoding and encoding around queue_lock; PIL releases the GIL for most of that work.
+    """
+
+    global api_worker_pool
+
+    items = list(items)
+    if len(items) <= 1:
+        return list(map(func, items))
+
+    if api_worker_pool is None:
+        with api_worker_pool_lock:
+            if api_worker_pool is None:
+                api_worker_pool = ThreadPoolExecutor(max_workers=opts.api_worker_threads, thread_name_prefix="api-worker")
+
+    return list(api_worker_pool.map(func, items))
+
+
+def client_disconnected(request: Request):
+    """Checks from an endpoint's worker thread whether the HTTP client has closed the connection."""
+
+    try:
+        return from_thread.run(request.is_disconnected)
+    except RuntimeError:
+        return False
+
+
+def decode_bytes_to_image(data: bytes):
+    try:
+        return images.read(BytesIO(data))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Invalid image data") from e
+
+
+image_media_types = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+
+def output_format_name(output=None):
+    """Returns the format images are encoded in: from the request's output options if set, otherwise from settings."""
+
+    name = (output.format if output is not None and output.format else opts.samples_format).lower()
+    return "jpeg" if name == "jpg" else name
+
+
+def image_media_type(image, output=None):
+    name = output_format_name(output)
+    if name == "raw":
+        return f"image/x-raw-rgb; width={image.width}; height={image.height}"
+
+    return image_media_types.get(name, "application/octet-stream")
+
+
+def encode_pil_to_base64(image, output=None):
+    if isinstance(image, str):
+        return image
+
+    return base64.b64encode(encode_pil_to_bytes(image, output))
+
+
+def encode_pil_to_bytes(image, output=None):
+    """Encodes the image using the request's output options (models.ImageOutputOptions), with defaults from settings."""
+
+    name = output_format_name(output)
+    include_metadata = output is None or output.include_metadata
+    quality = output.quality if output is not None and output.quality is not None else opts.jpeg_quality
+
+    with metrics.image_encode.time(format=name):
+        if name == "raw":
+            return image.convert("RGB").tobytes()
+
+        with io.BytesIO() as output_bytes:
+            if name == 'png':
+                metadata = PngImagePlugin.PngInfo()
+                use_metadata = False
+                if include_metadata:
+                    for key, value in image.info.items():
+                        if isinstance(key, str) and isinstance(value, str):
+                            metadata.add_text(key, value)
+                            use_metadata = True
+
+                compress_level = output.compress_level if output is not None and output.compress_level is not None else 6
+                image.save(output_bytes, format="PNG", pnginfo=(metadata if use_metadata else None), compress_level=compress_level)
+
+            elif name in ("jpeg", "webp"):
+                if image.mode in ("RGBA", "P"):
+                    image = image.convert("RGB")
+
+                save_kwargs = {"quality": quality}
+                if include_metadata:
+                    parameters = image.info.get('parameters', None)
+                    save_kwargs["exif"] = piexif.dump({
+                        "Exif": { piexif.ExifIFD.UserComment: piexif.helper.UserComment.dump(parameters or "", encoding="unicode") }
+                    })
+
+                if name == "jpeg":
+                    image.save(output_bytes, format="JPEG", **save_kwargs)
+                else:
+                    image.save(output_bytes, format="WEBP", lossless=output is not None and output.lossless, **save_kwargs)
+
             else:
-                image.save(output_bytes, format="WEBP", exif = exif_bytes, quality=opts.jpeg_quality)
+                raise HTTPException(status_code=500, detail="Invalid image format")
+
+            return output_bytes.getvalue()
+
+
+def encode_images(images_list, output=None):
+    """Encodes images on the API worker pool; returns a list of (media type, bytes)."""
+
+    return map_in_worker_pool(lambda image: (image_media_type(image, output), encode_pil_to_bytes(image, output)), images_list)
+
 
-        else:
-            raise HTTPException(status_code=500, detail="Invalid image format")
+def encode_images_to_base64(images_list, output=None):
+    return map_in_worker_pool(lambda image: encode_pil_to_base64(image, output), images_list)
 
-        bytes_data = output_bytes.getvalue()
 
-    return base64.b64encode(bytes_data)
+def multipart_images_response(images_list, parameters, info, output=None):
+    """Returns a multipart/mixed response: a JSON part with parameters and info, followed by one part per encoded image."""
+
+    boundary = uuid.uuid4().hex
+    meta = json.dumps(jsonable_encoder({"parameters": parameters, "info": info})).encode("utf8")
+
+    chunks = []
+    for content_type, data in [("application/json", meta)] + encode_images(images_list, output):
+        chunks.append(f"--{boundary}\r\nContent-Type: {content_type}\r\nContent-Length: {len(data)}\r\n\r\n".encode("ascii"))
+        chunks.append(data)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode("ascii"))
+
+    return Response(content=b"".join(chunks), media_type=f"multipart/mixed; boundary={boundary}")
 
 
 def api_middleware(app: FastAPI):
@@ -197,7 +304,7 @@ def api_middleware(app: FastAPI):
 
 
 class Api:
-    def __init__(self, app: FastAPI, queue_lock: Lock):
+    def __init__(self, app: FastAPI, queue_lock: fifo_lock.PriorityLock):
         if shared.cmd_opts.api_auth:
             self.credentials = {}
             for auth in shared.cmd_opts.api_auth.split(","):
@@ -207,16 +314,38 @@ class Api:
         self.router = APIRouter()
         self.app = app
         self.queue_lock = queue_lock
+        self.txt2img_batcher = batching.Txt2ImgBatcher()
+        self.current_image_cache = PreviewCache(encode_pil_to_base64)
+        progress_events.setup()
+        self.jobs = jobs.ApiJobs(self, encode_images)
         api_middleware(self.app)
         self.add_api_route("/sdapi/v1/txt2img", self.text2imgapi, methods=["POST"], response_model=models.TextToImageResponse)
         self.add_api_route("/sdapi/v1/img2img", self.img2imgapi, methods=["POST"], response_model=models.ImageToImageResponse)
+        self.add_api_route("/sdapi/v1/txt2img/binary", self.text2imgapi_binary, methods=["POST"])
+        self.add_api_route("/sdapi/v1/img2img/binary", self.img2imgapi_binary, methods=["POST"])
+        self.add_api_route("/sdapi/v1/jobs/txt2img", self.jobs.submit_txt2img, methods=["POST"], response_model=models.JobStatusResponse)
+        self.add_api_route("/sdapi/v1/jobs/img2img", self.jobs.submit_img2img, methods=["POST"], response_model=models.JobStatusResponse)
+        self.add_api_route("/sdapi/v1/jobs/{id_job}", self.jobs.get_status, methods=["GET"], response_model=models.JobStatusResponse)
+        self.add_api_route("/sdapi/v1/jobs/{id_job}/results", self.jobs.get_results, methods=["GET"], response_model=models.JobResultsResponse)
+        self.add_api_route("/sdapi/v1/jobs/{id_job}/images/{index}", self.jobs.get_image, methods=["GET"])
+        self.add_api_route("/sdapi/v1/jobs/{id_job}/cancel", self.jobs.cancel, methods=["POST"], response_model=models.JobStatusResponse)
         self.add_api_route("/sdapi/v1/extra-single-image", self.extras_single_image_api, methods=["POST"], response_model=models.ExtrasSingleImageResponse)
         self.add_api_route("/sdapi/v1/extra-batch-images", self.extras_batch_images_api, methods=["POST"], response_model=models.ExtrasBatchImagesResponse)
         self.add_api_route("/sdapi/v1/png-info", self.pnginfoapi, methods=["POST"], response_model=models.PNGInfoResponse)
         self.add_api_route("/sdapi/v1/progress", self.progressapi, methods=["GET"], response_model=models.ProgressResponse)
+        self.add_api_route("/sdapi/v1/progress/stream", self.progress_stream, methods=["GET"])
         self.add_api_route("/sdapi/v1/interrogate", self.interrogateapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/interrupt", self.interruptapi, methods=["POST"])
+        self.add_api_route("/sdapi/v1/queue", self.get_queue, methods=["GET"], response_model=models.QueueResponse)
+        self.add_api_route("/sdapi/v1/queue/cancel", self.cancel_queued, methods=["POST"])
         self.add_api_route("/sdapi/v1/skip", self.skip, methods=["POST"])
+        self.add_api_route("/metrics", self.get_metrics, methods=["GET"], response_class=PlainTextResponse)
+        self.add_api_route("/sdapi/v1/profiler", self.get_profiler, methods=["GET"], response_model=models.ProfilerStatusResponse)
+        self.add_api_route("/sdapi/v1/profiler/arm", self.arm_profiler, methods=["POST"], response_model=models.ProfilerArming)
+        self.add_api_route("/sdapi/v1/profiler/disarm", self.disarm_profiler, methods=["POST"])
+        self.add_api_route("/sdapi/v1/profiler/captures/{id_capture}", self.get_profile, methods=["GET"], response_model=models.ProfilerCaptureResponse)
+        self.add_api_route("/sdapi/v1/profiler/captures/{id_capture}/trace", self.get_profile_trace, methods=["GET"])
+        self.add_api_route("/sdapi/v1/profiler/captures/{id_capture}/memory", self.get_profile_memory, methods=["GET"])
         self.add_api_route("/sdapi/v1/options", self.get_config, methods=["GET"], response_model=models.OptionsModel)
         self.add_api_route("/sdapi/v1/options", self.set_config, methods=["POST"])
         self.add_api_route("/sdapi/v1/cmd-flags", self.get_cmd_flags, methods=["GET"], response_model=models.FlagsModel)
@@ -233,6 +362,9 @@ class Api:
         self.add_api_route("/sdapi/v1/embeddings", self.get_embeddings, methods=["GET"], response_model=models.EmbeddingsResponse)
         self.add_api_route("/sdapi/v1/refresh-embeddings", self.refresh_embeddings, methods=["POST"])
         self.add_api_route("/sdapi/v1/refresh-checkpoints", self.refresh_checkpoints, methods=["POST"])
+        self.add_api_route("/sdapi/v1/checkpoint-cache", self.get_checkpoint_cache, methods=["GET"], response_model=models.CheckpointCacheResponse)
+        self.add_api_route("/sdapi/v1/prefetch-checkpoint", self.get_checkpoint_prefetch, methods=["GET"], response_model=Optional[models.CheckpointPrefetchResponse])
+        self.add_api_route("/sdapi/v1/prefetch-checkpoint", self.prefetch_checkpoint, methods=["POST"], response_model=models.CheckpointPrefetchResponse)
         self.add_api_route("/sdapi/v1/refresh-vae", self.refresh_vae, methods=["POST"])
         self.add_api_route("/sdapi/v1/create/embedding", self.create_embedding, methods=["POST"], response_model=models.CreateResponse)
         self.add_api_route("/sdapi/v1/create/hypernetwork", self.create_hypernetwork, methods=["POST"], response_model=models.CreateResponse)
@@ -252,6 +384,8 @@ class Api:
 
         self.default_script_arg_txt2img = []
         self.default_script_arg_img2img = []
+        self.script_args_templates = {}
+        self.script_args_lock = threading.Lock()
 
         txt2img_script_runner = scripts.scripts_txt2img
         img2img_script_runner = scripts.scripts_img2img
@@ -262,14 +396,73 @@ class Api:
         if not txt2img_script_runner.scripts:
             txt2img_script_runner.initialize_scripts(False)
         if not self.default_script_arg_txt2img:
-            self.default_script_arg_txt2img = self.init_default_script_args(txt2img_script_runner)
+            self.default_script_arg_txt2img = self.script_args_template(txt2img_script_runner).default_args
 
         if not img2img_script_runner.scripts:
             img2img_script_runner.initialize_scripts(True)
         if not self.default_script_arg_img2img:
-            self.default_script_arg_img2img = self.init_default_script_args(img2img_script_runner)
+            self.default_script_arg_img2img = self.script_args_template(img2img_script_runner).default_args
+
+
+
+    @contextmanager
+    def queued(self, request: Request = None, task_id=None, priority=0, checkpoint=None, is_cancelled=None):
+        """
+        Holds queue_lock for the duration of the block.
+
+        Clients can pass X-Queue-Priority to jump ahead of lower priority work, X-Queue-Timeout to give up after
+        that many seconds in queue, and X-Client-Id to be accounted separately for fair sharing (the default is
+        the client's address). A waiter whose client disconnects is dropped from the queue.
+
+        checkpoint is the checkpoint the job will switch to, if any; it may be prefetched while earlier jobs run.
+        is_cancelled, if given, is checked before waiting, while waiting and once the lock is granted; the block doesn't run if it returns True.
+        """
 
+        if is_cancelled is not None and is_cancelled():
+            pending_tasks.pop(task_id, None)
+            raise HTTPException(status_code=503, detail="cancelled")
 
+        options = {"ticket": task_id, "priority": priority, "is_cancelled": is_cancelled}
+        if request is not None:
+            options["client"] = request.headers.get("x-client-id") or (request.client.host if request.client else None)
+            options["is_cancelled"] = lambda: client_disconnected(request) or (is_cancelled is not None and is_cancelled())
+
+            try:
+                if request.headers.get("x-queue-priority"):
+                    options["priority"] = int(request.headers["x-queue-priority"])
+                if request.headers.get("x-queue-timeout"):
+                    options["deadline"] = time.monotonic() + float(request.headers["x-queue-timeout"])
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=f"Invalid queue header: {e}") from e
+
+        prefetcher = sd_models_prefetch.prefetcher
+        prefetcher.note_queued(task_id, checkpoint)
+        prefetcher.predict(self.queue_lock)
+
+        queued_at = time.perf_counter()
+        try:
+            self.queue_lock.acquire(**options)
+        except fifo_lock.QueueCancelled as e:
+            pending_tasks.pop(task_id, None)
+            prefetcher.forget_queued(task_id)
+            raise HTTPException(status_code=503, detail=str(e)) from e
+        metrics.queue_wait.observe(time.perf_counter() - queued_at, source="api")
+
+        if is_cancelled is not None and is_cancelled():
+            # cancelled just as the lock was granted
+            self.queue_lock.release()
+            pending_tasks.pop(task_id, None)
+            prefetcher.forget_queued(task_id)
+            raise HTTPException(status_code=503, detail="cancelled")
+
+        prefetcher.predict(self.queue_lock)
+
+        try:
+            yield
+        finally:
+            self.queue_lock.release()
+            prefetcher.forget_queued(task_id)
+            prefetcher.predict(self.queue_lock)
 
     def add_api_route(self, path: str, endpoint, **kwargs):
         if shared.cmd_opts.api_auth:
@@ -283,13 +476,24 @@ class Api:
 
         raise HTTPException(status_code=401, detail="Incorrect username or password", headers={"WWW-Authenticate": "Basic"})
 
+    def script_args_template(self, script_runner):
+        with self.script_args_lock:
+            template = self.script_args_templates.get(id(script_runner))
+            if template is None or not template.is_current(script_runner):
+                template = script_templates.ScriptArgsTemplate(script_runner)
+                self.script_args_templates[id(script_runner)] = template
+
+        return template
+
     def get_selectable_script(self, script_name, script_runner):
         if script_name is None or script_name == "":
             return None, None
 
-        script_idx = script_name_to_index(script_name, script_runner.selectable_scripts)
-        script = script_runner.selectable_scripts[script_idx]
-        return script, script_idx
+        found = self.script_args_template(script_runner).selectable_by_title.get(script_name.lower())
+        if found is None:
+            raise HTTPException(status_code=422, detail=f"Script '{script_name}' not found")
+
+        return found
 
     def get_scripts_list(self):
         t2ilist = [script.name for script in scripts.scripts_txt2img.scripts if script.name is not None]
@@ -309,28 +513,14 @@ class Api:
         if script_name is None or script_name == "":
             return None, None
 
-        script_idx = script_name_to_index(script_name, script_runner.scripts)
-        return script_runner.scripts[script_idx]
+        script = self.script_args_template(script_runner).scripts_by_title.get(script_name.lower())
+        if script is None:
+            raise HTTPException(status_code=422, detail=f"Script '{script_name}' not found")
+
+        return script
 
     def init_default_script_args(self, script_runner):
-        #find max idx from the scripts in runner and generate a none array to init script_args
-        last_arg_index = 1
-        for script in script_runner.scripts:
-            if last_arg_index < script.args_to:
-                last_arg_index = script.args_to
-        # None everywhere except position 0 to initialize script args
-        script_args = [None]*last_arg_index
-        script_args[0] = 0
-
-        # get default values
-        with gr.Blocks(): # will throw errors calling ui function without this
-            for script in script_runner.scripts:
-                if script.ui(script.is_img2img):
-                    ui_default_values = []
-                    for elem in script.ui(script.is_img2img):
-                        ui_default_values.append(elem.value)
-                    script_args[script.args_from:script.args_to] = ui_default_values
-        return script_args
+        return script_templates.default_script_args(script_runner)
 
     def init_script_args(self, request, default_script_args, selectable_scripts, selectable_idx, script_runner, *, input_script_args=None):
         script_args = default_script_args.copy()
@@ -429,7 +619,19 @@ class Api:
 
         return params
 
-    def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
+    def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI, request: Request = None):
+        processed = self.process_txt2img(txt2imgreq, request=request)
+
+        b64images = encode_images_to_base64(processed.images, txt2imgreq.output_format) if txt2imgreq.send_images else []
+
+        return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
+
+    def text2imgapi_binary(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI, request: Request = None):
+        processed = self.process_txt2img(txt2imgreq, request=request)
+
+        return multipart_images_response(processed.images if txt2imgreq.send_images else [], vars(txt2imgreq), processed.js(), txt2imgreq.output_format)
+
+    def process_txt2img(self, txt2imgreq, request: Request = None, is_cancelled=None):
         task_id = txt2imgreq.force_task_id or create_task_id("txt2img")
 
         script_runner = scripts.scripts_txt2img
@@ -457,48 +659,112 @@ class Api:
         args.pop('alwayson_scripts', None)
         args.pop('infotext', None)
 
-        script_args = self.init_script_args(txt2imgreq, self.default_script_arg_txt2img, selectable_scripts, selectable_script_idx, script_runner, input_script_args=infotext_script_args)
+        script_args = self.init_script_args(txt2imgreq, self.script_args_template(script_runner).default_args, selectable_scripts, selectable_script_idx, script_runner, input_script_args=infotext_script_args)
 
-        send_images = args.pop('send_images', True)
+        args.pop('send_images', None)
         args.pop('save_images', None)
+        args.pop('output_format', None)
 
         add_task_to_queue(task_id)
 
-        with self.queue_lock:
-            with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
-                p.is_api = True
-                p.scripts = script_runner
-                p.outpath_grids = opts.outdir_txt2img_grids
-                p.outpath_samples = opts.outdir_txt2img_samples
+        if batching.enabled() and selectable_scripts is None and not infotext_script_args and not txt2imgreq.alwayson_scripts:
+            key = batching.batch_key(args)
+            if key is not None:
+                member = batching.BatchMember(args, task_id)
+                return self.txt2img_batcher.submit(key, member, batching.batch_limit(args), lambda group: self.run_txt2img_batch(group, script_args))
 
-                try:
-                    shared.state.begin(job="scripts_txt2img")
-                    start_task(task_id)
-                    if selectable_scripts is not None:
-                        p.script_args = script_args
-                        processed = scripts.scripts_txt2img.run(p, *p.script_args) # Need to pass args as list here
-                    else:
-                        p.script_args = tuple(script_args) # Need to pass args as tuple here
-                        processed = process_images(p)
-                    finish_task(task_id)
-                finally:
-                    shared.state.end()
-                    shared.total_tqdm.clear()
+        with self.queued(request, task_id, checkpoint=checkpoint_override(args), is_cancelled=is_cancelled):
+            return self.run_txt2img(args, script_args, selectable_scripts, task_id)
 
-        b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
+    def run_txt2img(self, args, script_args, selectable_scripts, task_id):
+        """Runs txt2img with prepared arguments; must be called with queue_lock held."""
 
-        return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
+        script_runner = scripts.scripts_txt2img
+
+        with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
+            p.is_api = True
+            p.scripts = script_runner
+            p.outpath_grids = opts.outdir_txt2img_grids
+            p.outpath_samples = opts.outdir_txt2img_samples
+
+            try:
+                shared.state.begin(job="scripts_txt2img")
+                start_task(task_id)
+                if selectable_scripts is not None:
+                    p.script_args = script_args
+                    processed = scripts.scripts_txt2img.run(p, *p.script_args) # Need to pass args as list here
+                else:
+                    p.script_args = tuple(script_args) # Need to pass args as tuple here
+                    processed = process_images(p)
+                finish_task(task_id)
+            finally:
+                shared.state.end()
+                shared.total_tqdm.clear()
+
+        return processed
+
+    def run_txt2img_batch(self, group, script_args):
+        """Generates a group of compatible txt2img requests as one batch and splits the result between them.
+
+        The group is queued under its first request's task id; it is not dropped when a client disconnects, since other requests depend on it.
+        """
+
+        leader = group.members[0]
+
+        try:
+            with self.queued(task_id=leader.task_id, checkpoint=checkpoint_override(leader.args)):
+                members = self.txt2img_batcher.members(group)
+                processed = self.run_txt2img(batching.merge_args(members), script_args, None, leader.task_id)
+
+            batching.split_processed(processed, members)
+        finally:
+            # the other requests' tasks are done even if the batch failed; the error is raised in their threads
+            for member in self.txt2img_batcher.members(group)[1:]:
+                finish_task(member.task_id)
+                pending_tasks.pop(member.task_id, None)
+
+    def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI, request: Request = None):
+        processed = self.process_img2img(img2imgreq, request=request)
+
+        b64images = encode_images_to_base64(processed.images, img2imgreq.output_format) if img2imgreq.send_images else []
+
+        if not img2imgreq.include_init_images:
+            img2imgreq.init_images = None
+            img2imgreq.mask = None
+
+        return models.ImageToImageResponse(images=b64images, parameters=vars(img2imgreq), info=processed.js())
+
+    def img2imgapi_binary(self, request: Request, payload: str = Form("{}"), init_images: list[UploadFile] = File(...), mask: Optional[UploadFile] = File(None)):
+        """Same as img2imgapi, but takes the request as a JSON form field plus raw image uploads, and returns raw encoded images."""
+
+        try:
+            img2imgreq = models.StableDiffusionImg2ImgProcessingAPI.parse_raw(payload)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors())) from e
+        decoded_init_images = map_in_worker_pool(decode_bytes_to_image, [x.file.read() for x in init_images])
+        decoded_mask = decode_bytes_to_image(mask.file.read()) if mask is not None else None
+
+        processed = self.process_img2img(img2imgreq, init_images=decoded_init_images, mask=decoded_mask, request=request)
+
+        img2imgreq.init_images = None
+        img2imgreq.mask = None
+
+        return multipart_images_response(processed.images if img2imgreq.send_images else [], vars(img2imgreq), processed.js(), img2imgreq.output_format)
+
+    def process_img2img(self, img2imgreq, *, init_images=None, mask=None, request: Request = None, is_cancelled=None):
+        """Runs img2img for the request; init_images and mask, if given, are already decoded PIL images that take the place of the base64 fields."""
 
-    def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
         task_id = img2imgreq.force_task_id or create_task_id("img2img")
 
-        init_images = img2imgreq.init_images
         if init_images is None:
-            raise HTTPException(status_code=404, detail="Init image not found")
+            init_images = img2imgreq.init_images
+            if init_images is None:
+                raise HTTPException(status_code=404, detail="Init image not found")
+
+            init_images = map_in_worker_pool(decode_base64_to_image, init_images)
 
-        mask = img2imgreq.mask
-        if mask:
-            mask = decode_base64_to_image(mask)
+        if mask is None and img2imgreq.mask:
+            mask = decode_base64_to_image(img2imgreq.mask)
 
         script_runner = scripts.scripts_img2img
 
@@ -527,16 +793,17 @@ class Api:
         args.pop('alwayson_scripts', None)
         args.pop('infotext', None)
 
-        script_args = self.init_script_args(img2imgreq, self.default_script_arg_img2img, selectable_scripts, selectable_script_idx, script_runner, input_script_args=infotext_script_args)
+        script_args = self.init_script_args(img2imgreq, self.script_args_template(script_runner).default_args, selectable_scripts, selectable_script_idx, script_runner, input_script_args=infotext_script_args)
 
-        send_images = args.pop('send_images', True)
+        args.pop('send_images', None)
         args.pop('save_images', None)
+        args.pop('output_format', None)
 
         add_task_to_queue(task_id)
 
-        with self.queue_lock:
+        with self.queued(request, task_id, checkpoint=checkpoint_override(args), is_cancelled=is_cancelled):
             with closing(StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)) as p:
-                p.init_images = [decode_base64_to_image(x) for x in init_images]
+                p.init_images = init_images
                 p.is_api = True
                 p.scripts = script_runner
                 p.outpath_grids = opts.outdir_img2img_grids
@@ -556,34 +823,30 @@ class Api:
                     shared.state.end()
                     shared.total_tqdm.clear()
 
-        b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
+        return processed
 
-        if not img2imgreq.include_init_images:
-            img2imgreq.init_images = None
-            img2imgreq.mask = None
-
-        return models.ImageToImageResponse(images=b64images, parameters=vars(img2imgreq), info=processed.js())
-
-    def extras_single_image_api(self, req: models.ExtrasSingleImageRequest):
+    def extras_single_image_api(self, req: models.ExtrasSingleImageRequest, request: Request = None):
         reqDict = setUpscalers(req)
+        output = reqDict.pop('output_format', None)
 
         reqDict['image'] = decode_base64_to_image(reqDict['image'])
 
-        with self.queue_lock:
+        with self.queued(request):
             result = postprocessing.run_extras(extras_mode=0, image_folder="", input_dir="", output_dir="", save_output=False, **reqDict)
 
-        return models.ExtrasSingleImageResponse(image=encode_pil_to_base64(result[0][0]), html_info=result[1])
+        return models.ExtrasSingleImageResponse(image=encode_pil_to_base64(result[0][0], output), html_info=result[1])
 
-    def extras_batch_images_api(self, req: models.ExtrasBatchImagesRequest):
+    def extras_batch_images_api(self, req: models.ExtrasBatchImagesRequest, request: Request = None):
         reqDict = setUpscalers(req)
+        output = reqDict.pop('output_format', None)
 
         image_list = reqDict.pop('imageList', [])
-        image_folder = [decode_base64_to_image(x.data) for x in image_list]
+        image_folder = map_in_worker_pool(decode_base64_to_image, [x.data for x in image_list])
 
-        with self.queue_lock:
+        with self.queued(request):
             result = postprocessing.run_extras(extras_mode=1, image_folder=image_folder, image="", input_dir="", output_dir="", save_output=False, **reqDict)
 
-        return models.ExtrasBatchImagesResponse(images=list(map(encode_pil_to_base64, result[0])), html_info=result[1])
+        return models.ExtrasBatchImagesResponse(images=encode_images_to_base64(result[0], output), html_info=result[1])
 
     def pnginfoapi(self, req: models.PNGInfoRequest):
         image = decode_base64_to_image(req.image.strip())
@@ -622,12 +885,19 @@ class Api:
         shared.state.set_current_image()
 
         current_image = None
-        if shared.state.current_image and not req.skip_current_image:
-            current_image = encode_pil_to_base64(shared.state.current_image)
+        if not req.skip_current_image:
+            current_image = self.current_image_cache.get()
 
         return models.ProgressResponse(progress=progress, eta_relative=eta_relative, state=shared.state.dict(), current_image=current_image, textinfo=shared.state.textinfo, current_task=current_task)
 
-    def interrogateapi(self, interrogatereq: models.InterrogateRequest):
+    async def progress_stream(self, id_task: Optional[str] = None, live_preview: bool = True):
+        """Server-sent events with progress updates as they happen; with id_task, only for that task, ending when it completes."""
+
+        subscriber = progress_events.broadcaster.subscribe(id_task=id_task, live_preview=live_preview)
+
+        return StreamingResponse(progress_events.broadcaster.events(subscriber), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    def interrogateapi(self, interrogatereq: models.InterrogateRequest, request: Request = None):
         image_b64 = interrogatereq.image
         if image_b64 is None:
             raise HTTPException(status_code=404, detail="Image not found")
@@ -636,7 +906,7 @@ class Api:
         img = img.convert('RGB')
 
         # Override object param
-        with self.queue_lock:
+        with self.queued(request):
             if interrogatereq.model == "clip":
                 processed = shared.interrogator.interrogate(img)
             elif interrogatereq.model == "deepdanbooru":
@@ -651,6 +921,64 @@ class Api:
 
         return {}
 
+    def get_queue(self):
+        return models.QueueResponse(**self.queue_lock.snapshot())
+
+    def cancel_queued(self, req: models.QueueCancelRequest):
+        if not self.queue_lock.cancel(req.id_task):
+            raise HTTPException(status_code=404, detail="Task is not waiting in queue")
+
+        return {}
+
+    def get_metrics(self):
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    def get_profiler(self):
+        captures = [models.ProfilerCaptureItem(**capture, has_memory_timeline=capture["memory_filename"] is not None) for capture in profiling.list_captures()]
+        return models.ProfilerStatusResponse(armed=profiling.list_armed(), captures=captures)
+
+    def arm_profiler(self, req: models.ProfilerArmRequest):
+        return models.ProfilerArming(**profiling.arm(**vars(req)).dict())
+
+    def disarm_profiler(self, req: models.ProfilerDisarmRequest):
+        return {"disarmed": profiling.disarm(req.id_arm)}
+
+    def get_capture(self, id_capture):
+        capture = profiling.get_capture(id_capture)
+        if capture is None:
+            raise HTTPException(status_code=404, detail="Profile not found")
+
+        return capture
+
+    def get_profile(self, id_capture: str):
+        capture = self.get_capture(id_capture)
+        return models.ProfilerCaptureResponse(**capture, has_memory_timeline=capture["memory_filename"] is not None)
+
+    def get_profile_trace(self, id_capture: str):
+        capture = self.get_capture(id_capture)
+        return FileResponse(capture["trace_filename"], media_type="application/json", filename=f"trace-{id_capture}.json")
+
+    def get_profile_memory(self, id_capture: str):
+        capture = self.get_capture(id_capture)
+        if capture["memory_filename"] is None:
+            raise HTTPException(status_code=404, detail="Profile has no memory timeline")
+
+        return FileResponse(capture["memory_filename"], media_type="application/gzip", filename=f"memory-{id_capture}.json.gz")
+
+    def get_checkpoint_cache(self):
+        return models.CheckpointCacheResponse(**sd_models.checkpoints_loaded.stats())
+
+    def get_checkpoint_prefetch(self):
+        return sd_models_prefetch.prefetcher.status()
+
+    def prefetch_checkpoint(self, req: models.CheckpointPrefetchRequest):
+        checkpoint_info = sd_models.get_closet_checkpoint_match(req.sd_model_checkpoint)
+        if checkpoint_info is None:
+            raise HTTPException(status_code=404, detail=f"Checkpoint not found: {req.sd_model_checkpoint}")
+
+        sd_models_prefetch.prefetcher.prefetch(checkpoint_info)
+        return sd_models_prefetch.prefetcher.status()
+
     def unloadapi(self):
         sd_models.unload_model_weights()
 
@@ -769,15 +1097,15 @@ class Api:
         }
 
     def refresh_embeddings(self):
-        with self.queue_lock:
+        with self.queued(priority=call_queue.quick_task_priority):
             sd_hijack.model_hijack.embedding_db.load_textual_inversion_embeddings(force_reload=True)
 
     def refresh_checkpoints(self):
-        with self.queue_lock:
+        with self.queued(priority=call_queue.quick_task_priority):
             shared.refresh_checkpoints()
 
     def refresh_vae(self):
-        with self.queue_lock:
+        with self.queued(priority=call_queue.quick_task_priority):
             shared_items.refresh_vae_list()
 
     def create_embedding(self, args: dict):
@@ -0,0 +1,189 @@
+import copy
+import json
+import threading
+
+from modules import extra_networks, processing
+from modules.shared import opts
+
+# fields that may differ between txt2img requests that are generated together as one batch
+per_request_fields = {"prompt", "negative_prompt", "seed", "subseed", "batch_size", "force_task_id"}
+
+
+def enabled():
+    return opts.api_batching_window > 0
+
+
+def batch_key(args):
+    """Returns a key that is equal for txt2img requests that can be generated as one batch, or None if the request can't be batched."""
+
+    if args.get("n_iter", 1) != 1 or not args.get("do_not_save_grid", True):
+        return None
+
+    # prompt parsing only takes extra networks from the first prompt of a batch, so they must be the same for all requests
+    networks = [sorted(extra_networks.re_extra_net.findall(args.get(field) or "")) for field in ("prompt", "negative_prompt")]
+    shared_fields = {k: v for k, v in args.items() if k not in per_request_fields}
+
+    return json.dumps([shared_fields, networks], sort_keys=True, default=str)
+
+
+def batch_limit(args):
+    """Returns how many images a merged batch with these parameters may have, based on the size and megapixel limits."""
+
+    width, height = args.get("width", 512), args.get("height", 512)
+    if args.get("enable_hr"):
+        if args.get("hr_resize_x") or args.get("hr_resize_y"):
+            width, height = args.get("hr_resize_x") or width, args.get("hr_resize_y") or height
+        else:
+            width, height = width * args.get("hr_scale", 2.0), height * args.get("hr_scale", 2.0)
+
+    by_pixels = int(opts.api_batching_max_megapixels * 1_000_000 // max(width * height, 1))
+
+    return max(1, min(opts.api_batching_max_batch_size, by_pixels))
+
+
+def merge_args(members):
+    """Makes arguments for a single StableDiffusionProcessingTxt2Img that generates images for all members, in order."""
+
+    args = dict(members[0].args)
+    prompts, negative_prompts, seeds, subseeds = [], [], [], []
+
+    for member in members:
+        batch_size = member.args.get("batch_size", 1)
+        seed = processing.get_fixed_seed(member.args.get("seed", -1))
+        subseed = processing.get_fixed_seed(member.args.get("subseed", -1))
+        vary_seed = member.args.get("subseed_strength", 0) == 0
+
+        prompts += [member.args.get("prompt", "")] * batch_size
+        negative_prompts += [member.args.get("negative_prompt", "")] * batch_size
+        seeds += [int(seed) + (i if vary_seed else 0) for i in range(batch_size)]
+        subseeds += [int(subseed) + i for i in range(batch_size)]
+
+    args.update(prompt=prompts, negative_prompt=negative_prompts, seed=seeds, subseed=subseeds, batch_size=len(prompts), n_iter=1)
+
+    return args
+
+
+def split_processed(processed, members):
+    """Gives each member a copy of the merged Processed that only has its own images, prompts, seeds and infotexts."""
+
+    images_list = processed.images[processed.index_of_first_image:]
+    infotexts = processed.infotexts[processed.index_of_first_image:]
+    total = sum(member.args.get("batch_size", 1) for member in members)
+    if len(images_list) != total:
+        raise RuntimeError(f"batched generation returned {len(images_list)} images for {total} requested")
+
+    start = 0
+    for member in members:
+        end = start + member.args.get("batch_size", 1)
+
+        res = copy.copy(processed)
+        res.images = images_list[start:end]
+        res.infotexts = infotexts[start:end]
+        res.info = res.infotexts[0] if res.infotexts else ""
+        res.all_prompts = processed.all_prompts[start:end]
+        res.all_negative_prompts = processed.all_negative_prompts[start:end]
+        res.all_seeds = processed.all_seeds[start:end]
+        res.all_subseeds = processed.all_subseeds[start:end]
+        res.prompt = res.all_prompts[0]
+        res.negative_prompt = res.all_negative_prompts[0]
+        res.seed = res.all_seeds[0]
+        res.subseed = res.all_subseeds[0]
+        res.batch_size = end - start
+        res.index_of_first_image = 0
+
+        member.processed = res
+        start = end
+
+
+class BatchMember:
+    def __init__(self, args, task_id):
+        self.args = args
+        self.task_id = task_id
+        self.processed = None
+
+
+class BatchGroup:
+    def __init__(self, key, limit):
+        self.key = key
+        self.limit = limit
+        self.members = []
+        self.images = 0
+        self.filled = threading.Event()
+        self.done = threading.Event()
+        self.error = None
+
+
+class Txt2ImgBatcher:
+    """
+    Collects compatible txt2img requests into groups that are generated as one batch.
+
+    The first request of a group is its leader: it waits for the batching window, then for queue_lock, and runs the whole group.
+    Requests keep joining the group until the leader gets the lock or the group is full, so batches grow while the queue is busy.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open_groups = {}
+
+    def join(self, key, member, limit):
+        images = member.args.get("batch_size", 1)
+
+        with self.lock:
+            group = self.open_groups.get(key)
+            if group is not None and group.images + images <= group.limit:
+                is_leader = False
+            else:
+                group = BatchGroup(key, limit)
+                self.open_groups[key] = group
+                is_leader = True
+
+            group.members.append(member)
+            group.images += images
+            if group.images >= group.limit:
+                self.close(group)
+
+        return group, is_leader
+
+    def close(self, group):
+        """Stops new requests from joining the group. Must be called with self.lock held."""
+
+        if self.open_groups.get(group.key) is group:
+            del self.open_groups[group.key]
+        group.filled.set()
+
+    def members(self, group):
+        """Closes the group and returns its final list of members; called by the leader once it holds queue_lock."""
+
+        with self.lock:
+            self.close(group)
+            return list(group.members)
+
+    def submit(self, key, member, limit, run):
+        """
+        Adds the request to a group and returns its Processed once the group has been generated.
+
+        run(group) is called in the leader's thread; it must get queue_lock, call members(group), and fill member.processed for each member.
+        """
+
+        group, is_leader = self.join(key, member, limit)
+
+        if not is_leader:
+            group.done.wait()
+            if group.error is not None:
+                raise group.error
+
+            return member.processed
+
+        group.filled.wait(opts.api_batching_window / 1000)
+
+        try:
+            run(group)
+        except Exception as e:
+            group.error = e
+            raise
+        finally:
+            with self.lock:
+                self.close(group)
+            group.done.set()
+
+        return member.processed
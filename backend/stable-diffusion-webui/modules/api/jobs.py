@@ -0,0 +1,229 @@
+import base64
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import diskcache
+from fastapi import Response
+from fastapi.exceptions import HTTPException
+
+import modules.shared as shared
+from modules import cache, errors, progress, progress_events
+from modules.api import models
+from modules.shared import opts
+
+unfinished_statuses = ("queued", "running")
+
+
+def make_store():
+    return diskcache.Cache(
+        os.path.join(cache.cache_dir, "api-jobs"),
+        size_limit=int(opts.api_jobs_store_size_mb) * 2**20,
+        eviction_policy="least-recently-stored",
+        disk_min_file_size=2**18,  # keep up to 256KB in Sqlite
+    )
+
+
+class ApiJobs:
+    """
+    Background generation jobs for the API.
+
+    Requests are run by a small pool of job threads instead of uvicorn's request threads, so clients don't keep a connection
+    open for the whole generation. Job records and encoded output images are kept in a size-bounded disk cache for
+    opts.api_jobs_ttl seconds, so results survive clients reconnecting.
+    """
+
+    def __init__(self, api, encode_images):
+        self.api = api
+        self.encode_images = encode_images
+        self.lock = threading.RLock()
+        self.unfinished = set()
+        self.cancelled = set()
+        self._store = None
+        self._executor = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self.lock:
+                if self._store is None:
+                    self._store = make_store()
+                    self.recover(self._store)
+
+        return self._store
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self.lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=opts.api_jobs_workers, thread_name_prefix="api-job")
+
+        return self._executor
+
+    def recover(self, store):
+        # jobs that were queued or running when the server stopped won't run anymore
+        for key in list(store.iterkeys()):
+            if not key.startswith("job/"):
+                continue
+
+            record = store.get(key)
+            if record is not None and record["status"] in unfinished_statuses:
+                record.update(status="failed", error="Server restarted before the job finished", finished_at=time.time())
+                store.set(key, record, expire=opts.api_jobs_ttl)
+
+    def get_record(self, id_job):
+        record = self.store.get(f"job/{id_job}")
+        if record is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        return record
+
+    def update(self, id_job, **fields):
+        with self.lock:
+            record = self.store.get(f"job/{id_job}")
+            if record is None:
+                return None
+
+            record.update(fields)
+            self.store.set(f"job/{id_job}", record, expire=opts.api_jobs_ttl)
+
+        return record
+
+    def status(self, record):
+        res = models.JobStatusResponse(**{k: v for k, v in record.items() if k in models.JobStatusResponse.__fields__})
+
+        if record["status"] == "queued":
+            res.position = self.api.queue_lock.position(record["id_task"])
+        elif record["status"] == "running" and progress.current_task == record["id_task"]:
+            res.progress = progress_events.snapshot("poll")["progress"]
+
+        return res
+
+    def submit(self, kind, req):
+        with self.lock:
+            if len(self.unfinished) >= opts.api_jobs_max_pending:
+                raise HTTPException(status_code=429, detail="Too many unfinished jobs", headers={"Retry-After": "10"})
+
+            id_job = uuid.uuid4().hex
+            self.unfinished.add(id_job)
+
+        req.force_task_id = f"task(job-{id_job})"
+
+        # parameters are returned with results; leave out input images, as img2img does without include_init_images
+        parameters = {k: v for k, v in vars(req).items() if k not in ("init_images", "mask")}
+
+        record = {
+            "id_job": id_job,
+            "id_task": req.force_task_id,
+            "kind": kind,
+            "status": "queued",
+            "created_at": time.time(),
+            "parameters": parameters,
+        }
+        self.store.set(f"job/{id_job}", record, expire=opts.api_jobs_ttl)
+
+        progress.add_task_to_queue(req.force_task_id)
+        self.executor.submit(self.run, id_job, kind, req)
+
+        return self.status(record)
+
+    def submit_txt2img(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
+        return self.submit("txt2img", txt2imgreq)
+
+    def submit_img2img(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
+        return self.submit("img2img", img2imgreq)
+
+    def run(self, id_job, kind, req):
+        def is_cancelled():
+            return id_job in self.cancelled
+
+        try:
+            with self.lock:
+                cancelled = is_cancelled()
+                if not cancelled:
+                    self.update(id_job, status="running", started_at=time.time())
+
+            if cancelled:
+                self.update(id_job, status="cancelled", finished_at=time.time())
+                progress.pending_tasks.pop(req.force_task_id, None)
+                return
+
+            try:
+                # a job cancelled before it gets queue_lock doesn't start generating
+                if kind == "txt2img":
+                    processed = self.api.process_txt2img(req, is_cancelled=is_cancelled)
+                else:
+                    processed = self.api.process_img2img(req, is_cancelled=is_cancelled)
+
+                if id_job in self.cancelled:
+                    self.update(id_job, status="cancelled", finished_at=time.time())
+                    return
+
+                encoded = self.encode_images(processed.images, req.output_format) if req.send_images else []
+                for index, (_, data) in enumerate(encoded):
+                    self.store.set(f"image/{id_job}/{index}", data, expire=opts.api_jobs_ttl)
+
+                self.update(id_job, status="succeeded", finished_at=time.time(), info=processed.js(), images=len(encoded), media_types=[media_type for media_type, _ in encoded])
+            except Exception as e:
+                if id_job in self.cancelled:
+                    self.update(id_job, status="cancelled", finished_at=time.time())
+                else:
+                    errors.report(f"Error running API job {id_job}", exc_info=True)
+                    self.update(id_job, status="failed", finished_at=time.time(), error=f"{type(e).__name__}: {e}")
+        finally:
+            with self.lock:
+                self.unfinished.discard(id_job)
+                self.cancelled.discard(id_job)
+
+    def get_status(self, id_job: str):
+        return self.status(self.get_record(id_job))
+
+    def get_results(self, id_job: str):
+        record = self.get_record(id_job)
+        if record["status"] != "succeeded":
+            raise HTTPException(status_code=409, detail=f"Job is {record['status']}")
+
+        images_list = [self.get_image_bytes(id_job, index) for index in range(record.get("images", 0))]
+
+        return models.JobResultsResponse(images=[base64.b64encode(x).decode('ascii') for x in images_list], parameters=record["parameters"], info=record["info"])
+
+    def get_image_bytes(self, id_job, index):
+        data = self.store.get(f"image/{id_job}/{index}")
+        if data is None:
+            raise HTTPException(status_code=404, detail="Image not found; it may have expired")
+
+        return data
+
+    def get_image(self, id_job: str, index: int):
+        record = self.get_record(id_job)
+
+        data = self.get_image_bytes(id_job, index)
+
+        return Response(content=data, media_type=record["media_types"][index])
+
+    def cancel(self, id_job: str):
+        record = self.get_record(id_job)
+        if record["status"] not in unfinished_statuses:
+            return self.status(record)
+
+        with self.lock:
+            if id_job not in self.unfinished:
+                return self.status(self.get_record(id_job))
+
+            self.cancelled.add(id_job)
+
+            # not started yet: run() won't start it now that it's in cancelled
+            record = self.get_record(id_job)
+            if record["status"] == "queued":
+                record = self.update(id_job, status="cancelled", finished_at=time.time()) or record
+
+        # waiting for queue_lock: drop it from the queue; already generating: interrupt it
+        if self.api.queue_lock.cancel(record["id_task"]):
+            record = self.update(id_job, status="cancelled", finished_at=time.time()) or record
+        elif record["status"] == "running" and progress.current_task == record["id_task"]:
+            shared.state.interrupt()
+
+        return self.status(record)
@@ -97,6 +97,13 @@ class PydanticModelGenerator:
         DynamicModel.__config__.allow_mutation = True
         return DynamicModel
 
+class ImageOutputOptions(BaseModel):
+    format: Optional[Literal["png", "jpeg", "jpg", "webp", "raw"]] = Field(default=None, title="Format", description="Format to encode output images in; raw is uncompressed 8-bit RGB pixel data. Defaults to the format for saving images from settings.")
+    quality: Optional[int] = Field(default=None, ge=1, le=100, title="Quality", description="JPEG and lossy WEBP quality (lossless WEBP: compression effort). Defaults to the JPEG quality from settings.")
+    lossless: bool = Field(default=False, title="Lossless", description="Use lossless WEBP.")
+    compress_level: Optional[int] = Field(default=None, ge=0, le=9, title="PNG compression level", description="0 is fastest, 9 is smallest. Defaults to 6.")
+    include_metadata: bool = Field(default=True, title="Include metadata", description="Embed generation parameters in PNG text chunks or JPEG/WEBP EXIF.")
+
 StableDiffusionTxt2ImgProcessingAPI = PydanticModelGenerator(
     "StableDiffusionProcessingTxt2Img",
     StableDiffusionProcessingTxt2Img,
@@ -109,6 +116,7 @@ StableDiffusionTxt2ImgProcessingAPI = PydanticModelGenerator(
         {"key": "alwayson_scripts", "type": dict, "default": {}},
         {"key": "force_task_id", "type": str, "default": None},
         {"key": "infotext", "type": str, "default": None},
+        {"key": "output_format", "type": Optional[ImageOutputOptions], "default": None},
     ]
 ).generate_model()
 
@@ -128,6 +136,7 @@ StableDiffusionImg2ImgProcessingAPI = PydanticModelGenerator(
         {"key": "alwayson_scripts", "type": dict, "default": {}},
         {"key": "force_task_id", "type": str, "default": None},
         {"key": "infotext", "type": str, "default": None},
+        {"key": "output_format", "type": Optional[ImageOutputOptions], "default": None},
     ]
 ).generate_model()
 
@@ -155,6 +164,7 @@ class ExtrasBaseRequest(BaseModel):
     upscaler_2: str = Field(default="None", title="Secondary upscaler", description=f"The name of the secondary upscaler to use, it has to be one of this list: {' , '.join([x.name for x in sd_upscalers])}")
     extras_upscaler_2_visibility: float = Field(default=0, title="Secondary upscaler visibility", ge=0, le=1, allow_inf_nan=False, description="Sets the visibility of secondary upscaler, values should be between 0 and 1.")
     upscale_first: bool = Field(default=False, title="Upscale first", description="Should the upscaler run before restoring faces?")
+    output_format: Optional[ImageOutputOptions] = Field(default=None, title="Output format", description="How to encode the resulting images.")
 
 class ExtraBaseResponse(BaseModel):
     html_info: str = Field(title="HTML info", description="A series of HTML tags containing the process info.")
@@ -327,3 +337,99 @@ class ExtensionItem(BaseModel):
     version: str = Field(title="Version", description="Extension Version")
     commit_date: str = Field(title="Commit Date", description="Extension Repository Commit Date")
     enabled: bool = Field(title="Enabled", description="Flag specifying whether this extension is enabled")
+
+class QueueItem(BaseModel):
+    id: Optional[str] = Field(default=None, title="Task ID", description="Task id the waiter was queued with, if any")
+    client: Optional[str] = Field(default=None, title="Client", description="Client the waiter is accounted to for fair sharing")
+    priority: int = Field(title="Priority", description="Waiters with higher priority get the lock first")
+    waited: float = Field(title="Waited", description="Seconds since the waiter was queued")
+    position: Optional[int] = Field(default=None, title="Position", description="0-based position in queue; empty for the running task")
+
+class QueueResponse(BaseModel):
+    running: Optional[QueueItem] = Field(default=None, title="Running", description="Task holding the queue lock")
+    pending: list[QueueItem] = Field(title="Pending", description="Waiting tasks in the order they will run")
+
+class QueueCancelRequest(BaseModel):
+    id_task: str = Field(title="Task ID", description="id of the queued task to remove")
+
+class JobStatusResponse(BaseModel):
+    id_job: str = Field(title="Job ID")
+    id_task: str = Field(title="Task ID", description="id of the task for progress and queue endpoints")
+    kind: str = Field(title="Kind", description="txt2img or img2img")
+    status: str = Field(title="Status", description="queued, running, succeeded, failed or cancelled")
+    created_at: float = Field(title="Created at", description="Unix time the job was submitted")
+    started_at: Optional[float] = Field(default=None, title="Started at")
+    finished_at: Optional[float] = Field(default=None, title="Finished at")
+    position: Optional[int] = Field(default=None, title="Position", description="0-based position in the queue, once the job is waiting for the GPU")
+    progress: Optional[float] = Field(default=None, title="Progress", description="The progress with a range of 0 to 1, while running")
+    images: int = Field(default=0, title="Images", description="Number of result images")
+    error: Optional[str] = Field(default=None, title="Error")
+
+class JobResultsResponse(BaseModel):
+    images: list[str] = Field(default=None, title="Image", description="The generated images in base64 format.")
+    parameters: dict
+    info: str
+
+class ProfilerArmRequest(BaseModel):
+    jobs: int = Field(default=1, ge=1, title="Jobs", description="Number of generations to profile")
+    id_task: Optional[str] = Field(default=None, title="Task ID", description="Only profile generations of this task")
+    activities: list[Literal["CPU", "CUDA"]] = Field(default=["CPU", "CUDA"], title="Activities")
+    record_shapes: bool = Field(default=True, title="Record shapes")
+    profile_memory: bool = Field(default=True, title="Profile memory")
+    with_stack: bool = Field(default=True, title="Include python stack", description="Shapes, memory and stack are all needed for the memory timeline")
+    row_limit: int = Field(default=20, ge=1, title="Row limit", description="Number of ops in the summary tables")
+
+class ProfilerArming(BaseModel):
+    id_arm: str = Field(title="Arm ID")
+    jobs: int = Field(title="Jobs", description="Generations left to profile")
+    id_task: Optional[str] = Field(default=None, title="Task ID")
+    activities: list[str] = Field(title="Activities")
+    record_shapes: bool
+    profile_memory: bool
+    with_stack: bool
+    row_limit: int
+    created_at: float = Field(title="Created at")
+
+class ProfilerDisarmRequest(BaseModel):
+    id_arm: Optional[str] = Field(default=None, title="Arm ID", description="Arming request to remove; all of them if empty")
+
+class ProfilerCaptureItem(BaseModel):
+    id_capture: str = Field(title="Capture ID")
+    id_arm: str = Field(title="Arm ID")
+    id_task: Optional[str] = Field(default=None, title="Task ID", description="Task that was generating when the profile was captured")
+    started_at: float = Field(title="Started at")
+    finished_at: float = Field(title="Finished at")
+    has_memory_timeline: bool = Field(title="Has memory timeline")
+
+class ProfilerStatusResponse(BaseModel):
+    armed: list[ProfilerArming] = Field(title="Armed", description="Pending requests to profile generations")
+    captures: list[ProfilerCaptureItem] = Field(title="Captures", description="Retained profiles, oldest first")
+
+class ProfilerCaptureResponse(ProfilerCaptureItem):
+    tables: dict[str, str] = Field(title="Tables", description="Top ops by self CPU and CUDA time, as text tables")
+    top_ops: dict[str, list[dict[str, Any]]] = Field(title="Top ops", description="Top ops by self CPU and CUDA time")
+
+class CheckpointCacheItem(BaseModel):
+    title: str = Field(title="Title")
+    size: int = Field(title="Size", description="Bytes taken by the checkpoint's tensors")
+    mapped: bool = Field(title="Mapped", description="Whether tensors are memory-mapped from a safetensors file")
+
+class CheckpointCacheResponse(BaseModel):
+    budget: int = Field(title="Budget", description="Maximum total size of cached checkpoints in bytes; 0 if unlimited")
+    size: int = Field(title="Size", description="Total size of cached checkpoints in bytes")
+    mapped_size: int = Field(title="Mapped size", description="Part of size that is memory-mapped")
+    hits: int = Field(title="Hits")
+    misses: int = Field(title="Misses")
+    evictions: int = Field(title="Evictions")
+    checkpoints: list[CheckpointCacheItem] = Field(title="Checkpoints", description="Cached checkpoints, least recently used first")
+
+class CheckpointPrefetchRequest(BaseModel):
+    sd_model_checkpoint: str = Field(title="Checkpoint", description="Title, name or hash of the checkpoint to prefetch")
+
+class CheckpointPrefetchResponse(BaseModel):
+    title: str = Field(title="Title", description="Checkpoint being prefetched")
+    status: str = Field(title="Status", description="loading, ready, used (already switched to) or failed")
+    vae: Optional[str] = Field(default=None, title="VAE", description="VAE file prefetched with the checkpoint")
+    started_at: float = Field(title="Started at")
+    finished_at: Optional[float] = Field(default=None, title="Finished at")
+    error: Optional[str] = Field(default=None, title="Error")
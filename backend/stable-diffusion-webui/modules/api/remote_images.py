@@ -0,0 +1,132 @@
+import collections
+import hashlib
+import threading
+from io import BytesIO
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from modules import images
+from modules.shared import opts
+
+
+class DecodedImageCache:
+    """
+    Decoded images keyed by the sha256 of their encoded bytes, evicting least recently used ones above a byte budget.
+
+    Also remembers which content each URL had along with its ETag/Last-Modified, so that a repeated URL can be revalidated
+    with a conditional request instead of downloaded and decoded again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.images = collections.OrderedDict()
+        self.size = 0
+        self.urls = {}
+
+    @staticmethod
+    def image_size(image):
+        return image.width * image.height * len(image.getbands())
+
+    def budget(self):
+        return int(opts.api_image_cache_mb * 1024 * 1024)
+
+    def get(self, digest):
+        with self.lock:
+            image = self.images.get(digest)
+            if image is not None:
+                self.images.move_to_end(digest)
+
+            return image
+
+    def put(self, digest, image):
+        size = self.image_size(image)
+        if size > self.budget():
+            return
+
+        with self.lock:
+            if digest in self.images:
+                return
+
+            self.images[digest] = image
+            self.size += size
+
+            while self.size > self.budget():
+                _, evicted = self.images.popitem(last=False)
+                self.size -= self.image_size(evicted)
+
+            # forget URLs whose content is no longer cached
+            self.urls = {url: entry for url, entry in self.urls.items() if entry[0] in self.images}
+
+    def validators(self, url):
+        with self.lock:
+            return self.urls.get(url)
+
+    def remember_url(self, url, digest, response):
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+        with self.lock:
+            if digest in self.images and (etag or last_modified):
+                self.urls[url] = (digest, etag, last_modified)
+            else:
+                self.urls.pop(url, None)
+
+
+cache = DecodedImageCache()
+session = None
+session_lock = threading.Lock()
+
+
+def get_session():
+    global session
+
+    with session_lock:
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max(opts.api_worker_threads, 10))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+    return session
+
+
+def fetch_image(url, headers=None, timeout=30):
+    """Downloads and decodes an image, reusing connections and the decoded image cache. Returns a PIL image that the caller may modify."""
+
+    headers = dict(headers or {})
+
+    use_cache = opts.api_image_cache_mb > 0
+    validators = cache.validators(url) if use_cache else None
+    if validators is not None:
+        _, etag, last_modified = validators
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    response = get_session().get(url, timeout=timeout, headers=headers)
+
+    if response.status_code == 304 and validators is not None:
+        image = cache.get(validators[0])
+        if image is not None:
+            return image.copy()
+
+        # evicted between the check and the response; fetch it without validators
+        response = get_session().get(url, timeout=timeout, headers={k: v for k, v in headers.items() if not k.startswith("If-")})
+
+    data = response.content
+
+    if not use_cache:
+        return images.read(BytesIO(data))
+
+    digest = hashlib.sha256(data).hexdigest()
+    image = cache.get(digest)
+    if image is None:
+        image = images.read(BytesIO(data))
+        image.load()
+        cache.put(digest, image)
+
+    if response.ok:
+        cache.remember_url(url, digest, response)
+
+    return image.copy()
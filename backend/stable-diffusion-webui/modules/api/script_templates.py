@@ -0,0 +1,42 @@
+import gradio as gr
+
+
+def default_script_args(script_runner):
+    """Returns script_args with values from the UI components of every script, and 0 (no selectable script) at position 0."""
+
+    last_arg_index = max([1] + [script.args_to for script in script_runner.scripts])
+    script_args = [None] * last_arg_index
+    script_args[0] = 0
+
+    with gr.Blocks():  # will throw errors calling ui function without this
+        for script in script_runner.scripts:
+            components = script.ui(script.is_img2img)
+            if components:
+                script_args[script.args_from:script.args_to] = [elem.value for elem in components]
+
+    return script_args
+
+
+class ScriptArgsTemplate:
+    """
+    Default script arguments and script name lookups for a ScriptRunner.
+
+    Making default arguments runs ui() of every script, so it is only done again when scripts are reloaded;
+    scripts are looked up by lowercase title in dicts instead of lists of titles made for every request.
+    """
+
+    def __init__(self, script_runner):
+        self.script_runner = script_runner
+        self.script_count = len(script_runner.scripts)
+        self.default_args = default_script_args(script_runner)
+        self.scripts_by_title = {}
+        self.selectable_by_title = {}
+
+        # like list.index(), the first script with a title wins
+        for script in script_runner.scripts:
+            self.scripts_by_title.setdefault(script.title().lower(), script)
+        for index, script in enumerate(script_runner.selectable_scripts):
+            self.selectable_by_title.setdefault(script.title().lower(), (script, index))
+
+    def is_current(self, script_runner):
+        return self.script_runner is script_runner and self.script_count == len(script_runner.scripts)
@@ -3,14 +3,17 @@ from functools import wraps
 import html
 import time
 
-from modules import shared, progress, errors, devices, fifo_lock, profiling
+from modules import shared, progress, errors, devices, fifo_lock, profiling, metrics
 
-queue_lock = fifo_lock.FIFOLock()
+queue_lock = fifo_lock.PriorityLock()
 
+# priority for short calls that would otherwise wait behind whole generation jobs, like refreshing model lists
+quick_task_priority = 10
 
-def wrap_queued_call(func):
+
+def wrap_queued_call(func, priority=0):
     def f(*args, **kwargs):
-        with queue_lock:
+        with queue_lock.queued(priority=priority):
             res = func(*args, **kwargs)
 
         return res
@@ -29,17 +32,23 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
         else:
             id_task = None
 
-        with queue_lock:
-            shared.state.begin(job=id_task)
-            progress.start_task(id_task)
-
-            try:
-                res = func(*args, **kwargs)
-                progress.record_results(id_task, res)
-            finally:
-                progress.finish_task(id_task)
-
-            shared.state.end()
+        try:
+            queued_at = time.perf_counter()
+            with queue_lock.queued(ticket=id_task):
+                metrics.queue_wait.observe(time.perf_counter() - queued_at, source="ui")
+                shared.state.begin(job=id_task)
+                progress.start_task(id_task)
+
+                try:
+                    res = func(*args, **kwargs)
+                    progress.record_results(id_task, res)
+                finally:
+                    progress.finish_task(id_task)
+
+                shared.state.end()
+        finally:
+            # the task may have been cancelled while waiting in queue
+            progress.pending_tasks.pop(id_task, None)
 
         return res
 
@@ -1,5 +1,8 @@
+import contextlib
+import itertools
 import threading
 import collections
+import time
 
 
 # reference: https://gist.github.com/vitaliyp/6d54dd76ca2c3cdfc1149d33007dc34a
@@ -35,3 +38,188 @@ class FIFOLock(object):
 
     def __exit__(self, t, v, tb):
         self.release()
+
+
+class QueueCancelled(Exception):
+    """Raised by PriorityLock.acquire when a waiter is dropped before it gets the lock."""
+
+    def __init__(self, reason):
+        super().__init__(f"removed from queue: {reason}")
+        self.reason = reason
+
+
+class _Waiter:
+    def __init__(self, ticket, client, priority, seq):
+        self.ticket = ticket
+        self.client = client
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = None
+
+
+class PriorityLock:
+    """
+    A drop-in replacement for FIFOLock that hands the lock to the waiter with the highest priority instead of the oldest one.
+
+    Among waiters with equal priority, the lock goes to the client that has held it for the least total time (fair sharing),
+    then to the oldest request. Waiters can be given a deadline, a callback that reports whether the request is still wanted
+    (e.g. whether the HTTP connection is still open), and a ticket id that can be used to look up their position or cancel them.
+    """
+
+    def __init__(self, poll_interval=0.5):
+        self.poll_interval = poll_interval
+        self._inner_lock = threading.Lock()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._holder = None
+        self._held_since = 0.0
+        self._usage = {}
+
+    def _key(self, waiter):
+        return -waiter.priority, self._usage.get(waiter.client, 0.0), waiter.seq
+
+    def _grant_next(self):
+        if not self._waiters:
+            self._holder = None
+            self._usage.clear()
+            return
+
+        waiter = min(self._waiters, key=self._key)
+        self._waiters.remove(waiter)
+        waiter.granted = True
+        self._holder = waiter
+        self._held_since = time.monotonic()
+        waiter.event.set()
+
+    def _charge_holder(self):
+        if self._holder is not None:
+            client = self._holder.client
+            self._usage[client] = self._usage.get(client, 0.0) + time.monotonic() - self._held_since
+
+    def acquire(self, blocking=True, timeout=-1, *, priority=0, client=None, ticket=None, deadline=None, is_cancelled=None):
+        """
+        Waits for the lock. Returns False if blocking is False or timeout runs out, like threading.Lock.acquire.
+
+        Raises QueueCancelled if the deadline (a time.monotonic() value) passes, is_cancelled() returns True,
+        or cancel() is called for the ticket before the lock is granted.
+        """
+
+        with self._inner_lock:
+            waiter = _Waiter(ticket, client, priority, next(self._seq))
+
+            if self._holder is None and not self._waiters:
+                waiter.granted = True
+                self._holder = waiter
+                self._held_since = time.monotonic()
+                return True
+            elif not blocking:
+                return False
+
+            if client not in self._usage:
+                # a new client starts level with the least served client that is waiting, not at zero
+                self._usage[client] = min((self._usage.get(w.client, 0.0) for w in self._waiters), default=0.0)
+
+            self._waiters.append(waiter)
+
+        timeout_at = time.monotonic() + timeout if timeout is not None and timeout >= 0 else None
+
+        while True:
+            wait_until = min((x for x in (timeout_at, deadline) if x is not None), default=None)
+            wait_time = None if wait_until is None else max(wait_until - time.monotonic(), 0)
+            if is_cancelled is not None:
+                wait_time = self.poll_interval if wait_time is None else min(wait_time, self.poll_interval)
+
+            if waiter.event.wait(wait_time) and waiter.granted:
+                return True
+
+            now = time.monotonic()
+            if waiter.cancelled is not None:
+                reason = waiter.cancelled
+            elif deadline is not None and now >= deadline:
+                reason = "deadline exceeded"
+            elif is_cancelled is not None and is_cancelled():
+                reason = "client disconnected"
+            elif timeout_at is not None and now >= timeout_at:
+                reason = None
+            else:
+                continue
+
+            with self._inner_lock:
+                if waiter.granted:
+                    if reason is None:
+                        return True
+
+                    # the lock was handed over just as the waiter gave up; pass it on
+                    self._grant_next()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+            if reason is None:
+                return False
+
+            raise QueueCancelled(reason)
+
+    def release(self):
+        with self._inner_lock:
+            if self._holder is None:
+                raise RuntimeError("release unlocked lock")
+
+            self._charge_holder()
+            self._grant_next()
+
+    def cancel(self, ticket, reason="cancelled"):
+        """Removes the waiter with the given ticket from the queue. Returns False if there is no such waiter."""
+
+        with self._inner_lock:
+            for waiter in self._waiters:
+                if waiter.ticket == ticket:
+                    self._waiters.remove(waiter)
+                    waiter.cancelled = reason
+                    waiter.event.set()
+                    return True
+
+        return False
+
+    def position(self, ticket):
+        """Returns the 0-based position of the ticket in the queue, or None if it is not waiting."""
+
+        with self._inner_lock:
+            ordered = sorted(self._waiters, key=self._key)
+
+        return next((i for i, waiter in enumerate(ordered) if waiter.ticket == ticket), None)
+
+    def snapshot(self):
+        """Returns the current holder and the waiters in the order they will get the lock."""
+
+        def describe(waiter, position):
+            return {"id": waiter.ticket, "client": waiter.client, "priority": waiter.priority, "waited": now - waiter.enqueued_at, "position": position}
+
+        with self._inner_lock:
+            now = time.monotonic()
+            running = describe(self._holder, None) if self._holder is not None else None
+            pending = [describe(waiter, i) for i, waiter in enumerate(sorted(self._waiters, key=self._key))]
+
+        return {"running": running, "pending": pending}
+
+    def locked(self):
+        return self._holder is not None
+
+    @contextlib.contextmanager
+    def queued(self, **kwargs):
+        """Context manager form of acquire() that takes its keyword arguments."""
+
+        if not self.acquire(**kwargs):
+            raise QueueCancelled("timed out")
+
+        try:
+            yield self
+        finally:
+            self.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, t, v, tb):
+        self.release()
@@ -1,5 +1,7 @@
 import hashlib
 import os.path
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from modules import shared
 import modules.cache
@@ -7,40 +9,116 @@ import modules.cache
 dump_cache = modules.cache.dump_cache
 cache = modules.cache.cache
 
+blksize = 16 * 1024 * 1024
+
+hashing_executor = None
+hashing_lock = threading.Lock()
+pending = {}
+
+
+def read_chunks(file, buffer_size=blksize):
+    """Yields views of one reused buffer with the rest of the file; hashlib releases the GIL while hashing them, so files can be hashed in parallel threads."""
+
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        count = file.readinto(buffer)
+        if not count:
+            break
+
+        yield view[:count]
+
 
 def calculate_sha256(filename):
     hash_sha256 = hashlib.sha256()
-    blksize = 1024 * 1024
 
-    with open(filename, "rb") as f:
-        for chunk in iter(lambda: f.read(blksize), b""):
+    with open(filename, "rb", buffering=0) as f:
+        for chunk in read_chunks(f):
             hash_sha256.update(chunk)
 
     return hash_sha256.hexdigest()
 
 
+def calculate_hashes(filename):
+    """
+    Reads the file once and returns its sha256 and, for a safetensors file, its addnet hash (see addnet_hash_safetensors);
+    the addnet hash is None for other files.
+    """
+
+    hash_sha256 = hashlib.sha256()
+    hash_addnet = None
+
+    with open(filename, "rb", buffering=0) as f:
+        if filename.lower().endswith(".safetensors"):
+            header = f.read(8)
+            header_data = f.read(int.from_bytes(header, "little"))
+            hash_sha256.update(header)
+            hash_sha256.update(header_data)
+            hash_addnet = hashlib.sha256()
+
+        for chunk in read_chunks(f):
+            hash_sha256.update(chunk)
+            if hash_addnet is not None:
+                hash_addnet.update(chunk)
+
+    return hash_sha256.hexdigest(), None if hash_addnet is None else hash_addnet.hexdigest()
+
+
+def file_signature(filename):
+    """Size, mtime and inode of the file, which are stored along with its hashes; the hashes are recalculated when any of them changes."""
+
+    stat = os.stat(filename)
+    return {
+        "filename": os.path.abspath(filename),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "inode": stat.st_ino,
+    }
+
+
 def sha256_from_cache(filename, title, use_addnet_hash=False):
     hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
     try:
-        ondisk_mtime = os.path.getmtime(filename)
+        signature = file_signature(filename)
     except FileNotFoundError:
         return None
 
     if title not in hashes:
         return None
 
-    cached_sha256 = hashes[title].get("sha256", None)
-    cached_mtime = hashes[title].get("mtime", 0)
+    entry = hashes[title]
+    cached_sha256 = entry.get("sha256", None)
+    cached_mtime = entry.get("mtime", 0)
 
-    if ondisk_mtime > cached_mtime or cached_sha256 is None:
+    if signature["mtime"] > cached_mtime or cached_sha256 is None:
+        return None
+
+    # entries written before the signature was stored only have mtime
+    if any(key in entry and entry[key] != signature[key] for key in ("filename", "size", "mtime", "inode")):
         return None
 
     return cached_sha256
 
 
-def sha256(filename, title, use_addnet_hash=False):
-    hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
+def store_hashes(title, signature, sha256_value, addnet_value):
+    cache("hashes")[title] = {**signature, "sha256": sha256_value}
+    if addnet_value is not None:
+        cache("hashes-addnet")[title] = {**signature, "sha256": addnet_value}
+
+    dump_cache()
+
 
+def calculate_and_store(filename, title):
+    """Hashes the file and stores both its sha256 and addnet hash under the title; returns (sha256, addnet hash)."""
+
+    signature = file_signature(filename)
+    sha256_value, addnet_value = calculate_hashes(filename)
+    store_hashes(title, signature, sha256_value, addnet_value)
+
+    return sha256_value, addnet_value
+
+
+def sha256(filename, title, use_addnet_hash=False):
     sha256_value = sha256_from_cache(filename, title, use_addnet_hash)
     if sha256_value is not None:
         return sha256_value
@@ -48,22 +126,62 @@ def sha256(filename, title, use_addnet_hash=False):
     if shared.cmd_opts.no_hashing:
         return None
 
+    future = pending_hash(title)
+    if future is not None and future.exception() is None:
+        sha256_value = sha256_from_cache(filename, title, use_addnet_hash)
+        if sha256_value is not None:
+            return sha256_value
+
     print(f"Calculating sha256 for {filename}: ", end='')
+    sha256_value, addnet_value = calculate_and_store(filename, title)
     if use_addnet_hash:
-        with open(filename, "rb") as file:
-            sha256_value = addnet_hash_safetensors(file)
-    else:
-        sha256_value = calculate_sha256(filename)
+        sha256_value = addnet_value
     print(f"{sha256_value}")
 
-    hashes[title] = {
-        "mtime": os.path.getmtime(filename),
-        "sha256": sha256_value,
-    }
+    return sha256_value
 
-    dump_cache()
 
-    return sha256_value
+def pending_hash(title):
+    with hashing_lock:
+        return pending.get(title)
+
+
+def hash_in_background(filename, title, use_addnet_hash=False, callback=None):
+    """
+    Returns the hash if it's known; otherwise queues the file to be hashed by a background thread pool and returns "pending".
+    When the hash is calculated, callback is called without arguments. Returns None if hashing is disabled.
+    """
+
+    global hashing_executor
+
+    sha256_value = sha256_from_cache(filename, title, use_addnet_hash)
+    if sha256_value is not None:
+        return sha256_value
+
+    if shared.cmd_opts.no_hashing:
+        return None
+
+    def run():
+        try:
+            print(f"Calculating sha256 for {filename} in background")
+            calculate_and_store(filename, title)
+        finally:
+            with hashing_lock:
+                pending.pop(title, None)
+
+    with hashing_lock:
+        future = pending.get(title)
+        if future is None:
+            if hashing_executor is None:
+                hashing_executor = ThreadPoolExecutor(max_workers=max(1, shared.opts.hash_workers), thread_name_prefix="hashing")
+
+            future = hashing_executor.submit(run)
+            pending[title] = future
+
+    if callback is not None:
+        future.add_done_callback(lambda f: callback() if f.exception() is None else print(f"Error calculating sha256 for {filename}: {f.exception()}"))
+
+    return "pending"
 
 
 def addnet_hash_safetensors(b):
@@ -81,4 +199,3 @@ def addnet_hash_safetensors(b):
         hash_sha256.update(chunk)
 
     return hash_sha256.hexdigest()
-
@@ -19,7 +19,7 @@ import string
 import json
 import hashlib
 
-from modules import sd_samplers, shared, script_callbacks, errors
+from modules import sd_samplers, shared, script_callbacks, errors, metrics
 from modules.paths_internal import roboto_ttf_file
 from modules.shared import opts
 
@@ -715,15 +715,16 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
         """
         temp_file_path = f"{filename_without_extension}.tmp"
 
-        save_image_with_geninfo(image_to_save, info, temp_file_path, extension, existing_pnginfo=params.pnginfo, pnginfo_section_name=pnginfo_section_name)
+        with metrics.image_save.time(format=extension.lstrip(".").lower()):
+            save_image_with_geninfo(image_to_save, info, temp_file_path, extension, existing_pnginfo=params.pnginfo, pnginfo_section_name=pnginfo_section_name)
 
-        filename = filename_without_extension + extension
-        if shared.opts.save_images_replace_action != "Replace":
-            n = 0
-            while os.path.exists(filename):
-                n += 1
-                filename = f"{filename_without_extension}-{n}{extension}"
-        os.replace(temp_file_path, filename)
+            filename = filename_without_extension + extension
+            if shared.opts.save_images_replace_action != "Replace":
+                n = 0
+                while os.path.exists(filename):
+                    n += 1
+                    filename = f"{filename_without_extension}-{n}{extension}"
+            os.replace(temp_file_path, filename)
 
     fullfn_without_extension, extension = os.path.splitext(params.filename)
     if hasattr(os, 'statvfs'):
@@ -0,0 +1,126 @@
+"""
+Histograms of how long the stages of generation take, exported in Prometheus text format by the /metrics API endpoint.
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+step_buckets = (0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+megapixel_classes = (0.3, 0.6, 1.1, 2.2, 4.5, 9.0)  # a little over 512x512, 768x768, 1024x1024 and so on
+
+registry = []
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}
+
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+
+        with self.lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self.series.items()]
+
+        for key, counts, total, count in sorted(items):
+            labels = [f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, key)]
+
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(labels + ['le="%s"' % bound])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = format_labels(labels + ['le="+Inf"'])
+            lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+
+            label_text = format_labels(labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+
+        return lines
+
+
+generation_labels = ("checkpoint", "sampler", "megapixels")
+
+queue_wait = Histogram("sd_queue_wait_seconds", "Time spent waiting for queue_lock before a job starts", ("source",))
+stage = Histogram("sd_stage_seconds", "Time spent in each stage of generation; sample includes the hires pass, which is also recorded as hires", ("stage",) + generation_labels)
+sampling_step = Histogram("sd_sampling_step_seconds", "Time between sampling steps", generation_labels, buckets=step_buckets)
+image_encode = Histogram("sd_image_encode_seconds", "Time spent encoding an output image for an API response", ("format",))
+image_save = Histogram("sd_image_save_seconds", "Time spent encoding and writing an image file to disk", ("format",))
+
+
+def megapixel_class(width, height):
+    """Returns the smallest of megapixel_classes that the image fits in, as a label; any size of image has one of few labels."""
+
+    megapixels = width * height / 1e6
+    index = bisect.bisect_left(megapixel_classes, megapixels)
+
+    return f"{megapixel_classes[index]:g}" if index < len(megapixel_classes) else "+Inf"
+
+
+def labels_for(p):
+    """Returns checkpoint, sampler and megapixels labels for a StableDiffusionProcessing object; during the hires pass, for its sampler and size."""
+
+    if getattr(p, "is_hr_pass", False):
+        sampler = getattr(p, "hr_sampler_name", None) or p.sampler_name
+        width, height = p.hr_upscale_to_x, p.hr_upscale_to_y
+    else:
+        sampler = p.sampler_name
+        width, height = p.width, p.height
+
+    return {
+        "checkpoint": getattr(p, "sd_model_name", None) or "",
+        "sampler": sampler or "",
+        "megapixels": megapixel_class(width, height),
+    }
+
+
+def time_stage(name, p):
+    return stage.time(stage=name, **labels_for(p))
+
+
+def render():
+    lines = []
+    for histogram in registry:
+        lines += histogram.render()
+
+    return "\n".join(lines) + "\n"
@@ -5,6 +5,7 @@ import math
 import os
 import sys
 import hashlib
+import time
 from dataclasses import dataclass, field
 
 import torch
@@ -16,7 +17,7 @@ from skimage import exposure
 from typing import Any
 
 import modules.sd_hijack
-from modules import devices, prompt_parser, masking, sd_samplers, lowvram, infotext_utils, extra_networks, sd_vae_approx, scripts, sd_samplers_common, sd_unet, errors, rng, profiling
+from modules import devices, prompt_parser, masking, sd_samplers, lowvram, infotext_utils, extra_networks, sd_vae_approx, scripts, sd_samplers_common, sd_unet, errors, rng, profiling, metrics
 from modules.rng import slerp # noqa: F401
 from modules.sd_hijack import model_hijack
 from modules.sd_samplers_common import images_tensor_to_samples, decode_first_stage, approximation_indexes
@@ -180,6 +181,8 @@ class StableDiffusionProcessing:
     token_merging_ratio_hr = 0
     disable_extra_networks: bool = False
     firstpass_image: Image = None
+    # don't make infotexts for output images unless they are saved to disk; Processed.infotexts then has empty strings
+    skip_infotext: bool = False
 
     scripts_value: scripts.ScriptRunner = field(default=None, init=False)
     script_args_value: list = field(default=None, init=False)
@@ -888,7 +891,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
         p.width, p.height = shared.sd_model.fix_dimensions(p.width, p.height)
 
     p.sd_model_name = shared.sd_model.sd_checkpoint_info.name_for_extra
-    p.sd_model_hash = shared.sd_model.sd_model_hash
+    p.sd_model_hash = shared.sd_model.sd_model_hash or shared.sd_model.sd_checkpoint_info.shorthash
     p.sd_vae_name = sd_vae.get_loaded_vae_name()
     p.sd_vae_hash = sd_vae.get_loaded_vae_hash()
 
@@ -963,7 +966,8 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             if p.scripts is not None:
                 p.scripts.process_batch(p, batch_number=n, prompts=p.prompts, seeds=p.seeds, subseeds=p.subseeds)
 
-            p.setup_conds()
+            with metrics.time_stage("conditioning", p):
+                p.setup_conds()
 
             p.extra_generation_params.update(model_hijack.extra_generation_params)
 
@@ -971,7 +975,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             # infotext could be modified by that callback
             # Example: a wildcard processed by process_batch sets an extra model
             # strength, which is saved as "Model Strength: 1.0" in the infotext
-            if n == 0 and not cmd_opts.no_prompt_history:
+            if n == 0 and not cmd_opts.no_prompt_history and not p.skip_infotext:
                 with open(os.path.join(paths.data_path, "params.txt"), "w", encoding="utf8") as file:
                     processed = Processed(p, [])
                     file.write(processed.infotext(p, 0))
@@ -984,7 +988,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
             sd_models.apply_alpha_schedule_override(p.sd_model, p)
 
-            with devices.without_autocast() if devices.unet_needs_upcast else devices.autocast():
+            with metrics.time_stage("sample", p), devices.without_autocast() if devices.unet_needs_upcast else devices.autocast():
                 samples_ddim = p.sample(conditioning=p.c, unconditional_conditioning=p.uc, seeds=p.seeds, subseeds=p.subseeds, subseed_strength=p.subseed_strength, prompts=p.prompts)
 
             if p.scripts is not None:
@@ -999,7 +1003,8 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
                 if opts.sd_vae_decode_method != 'Full':
                     p.extra_generation_params['VAE Decoder'] = opts.sd_vae_decode_method
-                x_samples_ddim = decode_latent_batch(p.sd_model, samples_ddim, target_device=devices.cpu, check_for_nans=True)
+                with metrics.time_stage("vae_decode", p):
+                    x_samples_ddim = decode_latent_batch(p.sd_model, samples_ddim, target_device=devices.cpu, check_for_nans=True)
 
             x_samples_ddim = torch.stack(x_samples_ddim).float()
             x_samples_ddim = torch.clamp((x_samples_ddim + 1.0) / 2.0, min=0.0, max=1.0)
@@ -1027,6 +1032,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                 return create_infotext(p, p.prompts, p.seeds, p.subseeds, use_main_prompt=use_main_prompt, index=index, all_negative_prompts=p.negative_prompts)
 
             save_samples = p.save_samples()
+            postprocess_start = time.perf_counter()
 
             for i, x_sample in enumerate(x_samples_ddim):
                 p.batch_index = i
@@ -1084,10 +1090,13 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                 if save_samples:
                     images.save_image(image, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p)
 
-                text = infotext(i)
-                infotexts.append(text)
-                if opts.enable_pnginfo:
-                    image.info["parameters"] = text
+                if p.skip_infotext:
+                    infotexts.append("")
+                else:
+                    text = infotext(i)
+                    infotexts.append(text)
+                    if opts.enable_pnginfo:
+                        image.info["parameters"] = text
                 output_images.append(image)
 
                 if mask_for_overlay is not None:
@@ -1105,6 +1114,9 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                         if opts.return_mask_composite:
                             output_images.append(image_mask_composite)
 
+            # includes saving images, which is also recorded on its own by images.save_image
+            metrics.stage.observe(time.perf_counter() - postprocess_start, stage="postprocess", **metrics.labels_for(p))
+
             del x_samples_ddim
 
             devices.torch_gc()
@@ -1366,6 +1378,7 @@ class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
             return samples
 
         self.is_hr_pass = True
+        hr_start = time.perf_counter()
         target_width = self.hr_upscale_to_x
         target_height = self.hr_upscale_to_y
 
@@ -1460,6 +1473,8 @@ class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
 
         decoded_samples = decode_latent_batch(self.sd_model, samples, target_device=devices.cpu, check_for_nans=True)
 
+        metrics.stage.observe(time.perf_counter() - hr_start, stage="hires", **metrics.labels_for(self))
+
         self.is_hr_pass = False
         return decoded_samples
 
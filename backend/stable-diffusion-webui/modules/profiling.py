@@ -1,46 +1,229 @@
+import collections
+import os
+import threading
+import time
+import uuid
+
 import torch
 
-from modules import shared, ui_gradio_extensions
+from modules import shared, ui_gradio_extensions, errors, progress, devices
+from modules.paths_internal import data_path
+
+profiles_dir = os.path.join(data_path, "profiles")
+
+lock = threading.Lock()
+armed = []
+captures = collections.OrderedDict()
+active = None
+
+
+class Arming:
+    """A request made through the API to profile the next `jobs` generations, optionally only those of one task."""
+
+    def __init__(self, jobs=1, id_task=None, activities=("CPU", "CUDA"), record_shapes=True, profile_memory=True, with_stack=True, row_limit=20):
+        self.id_arm = uuid.uuid4().hex
+        self.jobs = jobs
+        self.id_task = id_task
+        self.activities = list(activities)
+        self.record_shapes = record_shapes
+        self.profile_memory = profile_memory
+        self.with_stack = with_stack
+        self.row_limit = row_limit
+        self.created_at = time.time()
+
+    def matches(self, id_task):
+        return self.jobs > 0 and (self.id_task is None or self.id_task == id_task)
+
+    def dict(self):
+        return dict(vars(self))
+
+
+def arm(**kwargs):
+    arming = Arming(**kwargs)
+    with lock:
+        armed.append(arming)
+
+    return arming
+
+
+def disarm(id_arm=None):
+    """Removes one arming request, or all of them if id_arm is None; returns how many were removed."""
+
+    with lock:
+        removed = [x for x in armed if id_arm is None or x.id_arm == id_arm]
+        for x in removed:
+            armed.remove(x)
+
+    return len(removed)
+
+
+def list_armed():
+    with lock:
+        return [x.dict() for x in armed]
+
+
+def take_arming(id_task):
+    with lock:
+        # requests for this specific task go before ones for any task
+        for arming in sorted(armed, key=lambda x: x.id_task is None):
+            if arming.matches(id_task):
+                arming.jobs -= 1
+                if arming.jobs <= 0:
+                    armed.remove(arming)
+
+                return arming
+
+    return None
+
+
+def get_capture(id_capture):
+    with lock:
+        return captures.get(id_capture)
+
+
+def list_captures():
+    with lock:
+        return [{k: v for k, v in capture.items() if k not in ("tables", "top_ops")} for capture in captures.values()]
+
+
+def add_capture(capture):
+    with lock:
+        captures[capture["id_capture"]] = capture
+
+        while len(captures) > max(shared.opts.profiling_api_keep, 1):
+            _, evicted = captures.popitem(last=False)
+            for filename in (evicted["trace_filename"], evicted["memory_filename"]):
+                if filename and os.path.exists(filename):
+                    os.remove(filename)
+
+
+def top_ops(key_averages, sort_by, row_limit):
+    rows = [{
+        "name": event.key,
+        "count": event.count,
+        "self_cpu_time_us": event.self_cpu_time_total,
+        "cpu_time_us": event.cpu_time_total,
+        # renamed from cuda to device in newer torch versions
+        "self_cuda_time_us": getattr(event, "self_device_time_total", getattr(event, "self_cuda_time_total", 0)),
+        "cuda_time_us": getattr(event, "device_time_total", getattr(event, "cuda_time_total", 0)),
+        "self_cpu_memory_bytes": event.self_cpu_memory_usage,
+        "self_cuda_memory_bytes": getattr(event, "self_device_memory_usage", getattr(event, "self_cuda_memory_usage", 0)),
+    } for event in key_averages]
+
+    return sorted(rows, key=lambda x: x[sort_by], reverse=True)[:row_limit]
 
 
 class Profiler:
     def __init__(self):
-        if not shared.opts.profiling_enable:
-            self.profiler = None
+        self.profiler = None
+        self.arming = None
+        self.activities = []
+        self.id_task = progress.current_task
+        self.started_at = None
+
+        # torch profilers can't be nested; a generation started from inside another one is profiled as part of it
+        if active is not None:
+            return
+
+        self.arming = take_arming(self.id_task)
+
+        if self.arming is not None:
+            activity_names = self.arming.activities
+            record_shapes, profile_memory, with_stack = self.arming.record_shapes, self.arming.profile_memory, self.arming.with_stack
+        elif shared.opts.profiling_enable:
+            activity_names = shared.opts.profiling_activities
+            record_shapes, profile_memory, with_stack = shared.opts.profiling_record_shapes, shared.opts.profiling_profile_memory, shared.opts.profiling_with_stack
+        else:
             return
 
-        activities = []
-        if "CPU" in shared.opts.profiling_activities:
-            activities.append(torch.profiler.ProfilerActivity.CPU)
-        if "CUDA" in shared.opts.profiling_activities:
-            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        if "CPU" in activity_names:
+            self.activities.append(torch.profiler.ProfilerActivity.CPU)
+        if "CUDA" in activity_names and torch.cuda.is_available():
+            self.activities.append(torch.profiler.ProfilerActivity.CUDA)
 
-        if not activities:
-            self.profiler = None
+        if not self.activities:
             return
 
         self.profiler = torch.profiler.profile(
-            activities=activities,
-            record_shapes=shared.opts.profiling_record_shapes,
-            profile_memory=shared.opts.profiling_profile_memory,
-            with_stack=shared.opts.profiling_with_stack
+            activities=self.activities,
+            record_shapes=record_shapes,
+            profile_memory=profile_memory,
+            with_stack=with_stack
         )
 
     def __enter__(self):
+        global active
+
         if self.profiler:
+            active = self
+            self.started_at = time.time()
             self.profiler.__enter__()
 
         return self
 
     def __exit__(self, exc_type, exc, exc_tb):
-        if self.profiler:
+        global active
+
+        if not self.profiler:
+            return
+
+        try:
             shared.state.textinfo = "Finishing profile..."
 
             self.profiler.__exit__(exc_type, exc, exc_tb)
 
-            self.profiler.export_chrome_trace(shared.opts.profiling_filename)
+            if shared.opts.profiling_enable:
+                self.profiler.export_chrome_trace(shared.opts.profiling_filename)
+
+            if self.arming is not None:
+                try:
+                    self.save_capture()
+                except Exception:
+                    errors.report("Error saving profile", exc_info=True)
+        finally:
+            active = None
+
+    def save_capture(self):
+        id_capture = uuid.uuid4().hex
+        os.makedirs(profiles_dir, exist_ok=True)
+
+        trace_filename = os.path.join(profiles_dir, f"{id_capture}.json")
+        self.profiler.export_chrome_trace(trace_filename)
+
+        # needs shapes, memory and stacks to be recorded; the timeline is for the device the model runs on
+        memory_filename = None
+        if self.arming.record_shapes and self.arming.profile_memory and self.arming.with_stack and hasattr(self.profiler, "export_memory_timeline"):
+            try:
+                device = devices.device
+                if device.type == "cuda" and device.index is None:
+                    device = torch.device("cuda", torch.cuda.current_device())
+
+                memory_filename = os.path.join(profiles_dir, f"{id_capture}-memory.json.gz")
+                self.profiler.export_memory_timeline(memory_filename, device=str(device))
+            except Exception:
+                errors.report("Error exporting memory timeline", exc_info=True)
+                memory_filename = None
+
+        key_averages = self.profiler.key_averages()
+
+        tables = {"cpu": key_averages.table(sort_by="self_cpu_time_total", row_limit=self.arming.row_limit)}
+        ops = {"cpu": top_ops(key_averages, "self_cpu_time_us", self.arming.row_limit)}
+        if torch.profiler.ProfilerActivity.CUDA in self.activities:
+            tables["cuda"] = key_averages.table(sort_by="self_cuda_time_total", row_limit=self.arming.row_limit)
+            ops["cuda"] = top_ops(key_averages, "self_cuda_time_us", self.arming.row_limit)
+
+        add_capture({
+            "id_capture": id_capture,
+            "id_arm": self.arming.id_arm,
+            "id_task": self.id_task,
+            "started_at": self.started_at,
+            "finished_at": time.time(),
+            "trace_filename": trace_filename,
+            "memory_filename": memory_filename,
+            "tables": tables,
+            "top_ops": ops,
+        })
 
 
 def webpath():
     return ui_gradio_extensions.webpath(shared.opts.profiling_filename)
-
@@ -1,5 +1,6 @@
 import base64
 import io
+import threading
 import time
 
 import gradio as gr
@@ -25,11 +26,14 @@ def start_task(id_task):
 
     current_task = id_task
     pending_tasks.pop(id_task, None)
+    shared.state.notify("start")
 
 
 def finish_task(id_task):
     global current_task
 
+    shared.state.notify("finish")
+
     if current_task == id_task:
         current_task = None
 
@@ -92,9 +96,13 @@ def progressapi(req: ProgressRequest):
     if not active:
         textinfo = "Waiting..."
         if queued:
-            sorted_queued = sorted(pending_tasks.keys(), key=lambda x: pending_tasks[x])
-            queue_index = sorted_queued.index(req.id_task)
-            textinfo = "In queue: {}/{}".format(queue_index + 1, len(sorted_queued))
+            from modules.call_queue import queue_lock
+
+            queue_index = queue_lock.position(req.id_task)
+            if queue_index is None:
+                sorted_queued = sorted(pending_tasks.keys(), key=lambda x: pending_tasks[x])
+                queue_index = sorted_queued.index(req.id_task)
+            textinfo = "In queue: {}/{}".format(queue_index + 1, len(pending_tasks))
         return ProgressResponse(active=active, queued=queued, completed=completed, id_live_preview=-1, textinfo=textinfo)
 
     progress = 0
@@ -119,28 +127,58 @@ def progressapi(req: ProgressRequest):
     if opts.live_previews_enable and req.live_preview:
         shared.state.set_current_image()
         if shared.state.id_live_preview != req.id_live_preview:
-            image = shared.state.current_image
-            if image is not None:
-                buffered = io.BytesIO()
-
-                if opts.live_previews_image_format == "png":
-                    # using optimize for large images takes an enormous amount of time
-                    if max(*image.size) <= 256:
-                        save_kwargs = {"optimize": True}
-                    else:
-                        save_kwargs = {"optimize": False, "compress_level": 1}
-
-                else:
-                    save_kwargs = {}
-
-                image.save(buffered, format=opts.live_previews_image_format, **save_kwargs)
-                base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
-                live_preview = f"data:image/{opts.live_previews_image_format};base64,{base64_image}"
+            live_preview = live_preview_cache.get()
+            if live_preview is not None:
                 id_live_preview = shared.state.id_live_preview
 
     return ProgressResponse(active=active, queued=queued, completed=completed, progress=progress, eta=eta, live_preview=live_preview, id_live_preview=id_live_preview, textinfo=shared.state.textinfo)
 
 
+def encode_live_preview(image):
+    buffered = io.BytesIO()
+
+    if opts.live_previews_image_format == "png":
+        # using optimize for large images takes an enormous amount of time
+        if max(*image.size) <= 256:
+            save_kwargs = {"optimize": True}
+        else:
+            save_kwargs = {"optimize": False, "compress_level": 1}
+
+    else:
+        save_kwargs = {}
+
+    image.save(buffered, format=opts.live_previews_image_format, **save_kwargs)
+    base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
+    return f"data:image/{opts.live_previews_image_format};base64,{base64_image}"
+
+
+class PreviewCache:
+    """Keeps the encoding of the current live preview, so that it is encoded once however many clients ask for it."""
+
+    def __init__(self, encode):
+        self.encode = encode
+        self.lock = threading.Lock()
+        self.key = None
+        self.value = None
+
+    def get(self):
+        image = shared.state.current_image
+        if image is None:
+            return None
+
+        key = (shared.state.job_timestamp, shared.state.id_live_preview, id(image))
+
+        with self.lock:
+            if self.key != key:
+                self.value = self.encode(image)
+                self.key = key
+
+            return self.value
+
+
+live_preview_cache = PreviewCache(encode_live_preview)
+
+
 def restore_progress(id_task):
     while id_task == current_task or id_task in pending_tasks:
         time.sleep(0.1)
@@ -0,0 +1,170 @@
+"""
+Push-based progress updates.
+
+State calls notify() on job and sampling step changes; the broadcaster here turns those into progress snapshots
+and wakes up subscribers (server-sent event streams) instead of having every client poll shared.state.
+Live previews are decoded at most once per preview interval by State, and encoded once per preview by progress.live_preview_cache,
+however many subscribers and pollers there are.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+from modules import errors, progress, shared
+from modules.shared import opts
+
+
+def snapshot(event):
+    state = shared.state
+
+    job_count, job_no = state.job_count, state.job_no
+    sampling_steps, sampling_step = state.sampling_steps, state.sampling_step
+
+    progress_value = 0
+    if job_count > 0:
+        progress_value += job_no / job_count
+    if sampling_steps > 0 and job_count > 0:
+        progress_value += 1 / job_count * sampling_step / sampling_steps
+    progress_value = min(progress_value, 1)
+
+    eta = None
+    if progress_value > 0 and state.time_start is not None:
+        elapsed_since_start = time.time() - state.time_start
+        eta = elapsed_since_start / progress_value - elapsed_since_start
+
+    return {
+        "event": event,
+        "id_task": progress.current_task,
+        "active": bool(state.job),
+        "progress": progress_value,
+        "eta": eta,
+        "state": state.dict(),
+        "textinfo": state.textinfo,
+        "id_live_preview": state.id_live_preview,
+    }
+
+
+class Subscriber:
+    def __init__(self, loop, id_task=None, live_preview=True):
+        self.loop = loop
+        self.id_task = id_task
+        self.live_preview = live_preview
+        self.wakeup = asyncio.Event()
+        self.latest = None
+
+    def wants(self, snap):
+        return self.id_task is None or snap["id_task"] == self.id_task
+
+
+class ProgressBroadcaster:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.seq = 0
+
+    def subscribe(self, id_task=None, live_preview=True):
+        subscriber = Subscriber(asyncio.get_running_loop(), id_task=id_task, live_preview=live_preview)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def on_state_event(self, event):
+        """State listener; runs in the thread doing the generation, so it only builds a snapshot and wakes subscribers up."""
+
+        with self.lock:
+            subscribers = list(self.subscribers)
+
+        if not subscribers:
+            return
+
+        if event == "step" and opts.live_previews_enable and any(x.live_preview for x in subscribers):
+            # decodes current_latent only when show_progress_every_n_steps steps have passed since the last preview
+            shared.state.set_current_image()
+
+        snap = snapshot(event)
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+
+        for subscriber in subscribers:
+            if subscriber.wants(snap):
+                # each subscriber keeps the latest snapshot it is interested in; intermediate ones are skipped if it falls behind
+                subscriber.latest = (seq, snap)
+                try:
+                    subscriber.loop.call_soon_threadsafe(subscriber.wakeup.set)
+                except RuntimeError:
+                    # event loop of a client that went away
+                    self.unsubscribe(subscriber)
+
+    async def events(self, subscriber, keepalive=15.0):
+        """Yields server-sent event strings for the subscriber until its task finishes (or forever, without a task filter)."""
+
+        last_seq = None
+        last_preview = None
+
+        try:
+            if subscriber.id_task is not None and subscriber.id_task in progress.finished_tasks:
+                yield f"event: completed\ndata: {json.dumps({'id_task': subscriber.id_task})}\n\n"
+                return
+
+            data = snapshot("subscribe")
+            data["queued"] = subscriber.id_task in progress.pending_tasks
+            yield f"event: progress\ndata: {json.dumps(data)}\n\n"
+
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.wakeup.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+
+                    if subscriber.id_task is not None and subscriber.id_task in progress.finished_tasks:
+                        yield f"event: completed\ndata: {json.dumps({'id_task': subscriber.id_task})}\n\n"
+                        return
+
+                    continue
+
+                subscriber.wakeup.clear()
+
+                seq, snap = subscriber.latest or (None, None)
+                if snap is None or seq == last_seq:
+                    continue
+                last_seq = seq
+
+                data = dict(snap)
+                if subscriber.live_preview and snap["id_live_preview"] != last_preview:
+                    data["live_preview"] = await asyncio.get_running_loop().run_in_executor(None, progress.live_preview_cache.get)
+                    last_preview = snap["id_live_preview"]
+
+                yield f"event: progress\ndata: {json.dumps(data)}\n\n"
+
+                if subscriber.id_task is not None and snap["event"] in ("finish", "end"):
+                    yield f"event: completed\ndata: {json.dumps({'id_task': subscriber.id_task})}\n\n"
+                    return
+        finally:
+            self.unsubscribe(subscriber)
+
+
+broadcaster = ProgressBroadcaster()
+listening = False
+
+
+def on_state_event(event):
+    try:
+        broadcaster.on_state_event(event)
+    except Exception:
+        errors.report("Error sending progress event", exc_info=True)
+
+
+def setup():
+    global listening
+
+    if not listening:
+        shared.state.add_listener(on_state_event)
+        listening = True
@@ -0,0 +1,176 @@
+"""
+Lazy loading of safetensors files.
+
+load() parses the header of a file once and returns a LazyStateDict, which makes each tensor from the file's bytes when it's
+first looked up. The bytes are either a copy-on-write memory map of the file, or the whole file read into one buffer with a
+single read; tensors are views of them rather than copies until they are moved to another device.
+"""
+
+import json
+import mmap
+import os
+
+import torch
+
+dtypes = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+for name, dtype_name in (("F8_E4M3", "float8_e4m3fn"), ("F8_E5M2", "float8_e5m2")):
+    if hasattr(torch, dtype_name):
+        dtypes[name] = getattr(torch, dtype_name)
+
+itemsizes = {dtype: torch.empty(0, dtype=dtype).element_size() for dtype in dtypes.values()}
+
+
+class TensorLocation:
+    """Where a tensor that hasn't been read yet is in the file's buffer."""
+
+    __slots__ = ("dtype", "shape", "start", "end")
+
+    def __init__(self, dtype, shape, start, end):
+        self.dtype = dtype
+        self.shape = shape
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"TensorLocation({self.dtype}, {self.shape})"
+
+    def tensor(self, buffer, device):
+        if self.end == self.start:
+            tensor = torch.empty(self.shape, dtype=self.dtype)
+        else:
+            tensor = torch.frombuffer(buffer, dtype=self.dtype, count=(self.end - self.start) // itemsizes[self.dtype], offset=self.start).reshape(self.shape)
+
+        if str(device) != "cpu":
+            tensor = tensor.to(device)
+
+        return tensor
+
+
+class LazyStateDict(dict):
+    """
+    A dict of tensors from a safetensors file, each made when it's first looked up; setting and deleting keys works as in a regular dict.
+    Iterating over keys and checking for them doesn't read tensors, items() and values() read all of them.
+    Pickles as a regular dict.
+    """
+
+    def __init__(self, buffer, locations, device="cpu"):
+        super().__init__(locations)
+        self.buffer = buffer
+        self.device = device
+
+    def make_tensor(self, value):
+        if isinstance(value, TensorLocation):
+            return value.tensor(self.buffer, self.device)
+
+        return value
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, TensorLocation):
+            value = self.make_tensor(value)
+            dict.__setitem__(self, key, value)
+
+        return value
+
+    # dict() and dict.update() only use __getitem__ for subclasses that override __iter__
+    def __iter__(self):
+        return dict.__iter__(self)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def pop(self, key, *default):
+        return self.make_tensor(dict.pop(self, key, *default))
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        return key, self.make_tensor(value)
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+
+        self[key] = default
+        return default
+
+    def items(self):
+        return [(key, self[key]) for key in list(dict.keys(self))]
+
+    def values(self):
+        return [self[key] for key in list(dict.keys(self))]
+
+    def copy(self):
+        """Returns a shallow copy that shares the file's buffer and the tensors that were already read."""
+
+        res = LazyStateDict.__new__(LazyStateDict)
+        dict.__init__(res, dict.items(self))
+        res.buffer = self.buffer
+        res.device = self.device
+        return res
+
+    def rename_keys(self, func):
+        """Replaces every key with func(key), dropping keys for which it returns None, without reading tensors."""
+
+        renamed = {}
+        for key, value in dict.items(self):
+            new_key = func(key)
+            if new_key is not None:
+                renamed[new_key] = value
+
+        dict.clear(self)
+        dict.update(self, renamed)
+
+    def nbytes(self):
+        """Size of all tensors, without reading those that weren't read yet."""
+
+        return sum(value.end - value.start if isinstance(value, TensorLocation) else value.numel() * value.element_size() for value in dict.values(self) if isinstance(value, (TensorLocation, torch.Tensor)))
+
+    def __reduce__(self):
+        return dict, (dict(self.items()),)
+
+
+def read_header(file):
+    """Returns tensor descriptions from the header and the offset of tensor data in the file."""
+
+    header_size = int.from_bytes(file.read(8), "little")
+    header = json.loads(file.read(header_size))
+    header.pop("__metadata__", None)
+
+    return header, 8 + header_size
+
+
+def load(filename, device="cpu", use_mmap=True):
+    """
+    Reads the header of a safetensors file and returns a LazyStateDict of its tensors on the device.
+    With use_mmap=False, the file is read into memory at once, for filesystems where memory maps are slow.
+    """
+
+    with open(filename, "rb") as file:
+        header, data_start = read_header(file)
+
+        if use_mmap:
+            # copy-on-write, so that tensors are writable and changing them doesn't change the file
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        else:
+            buffer = bytearray(os.fstat(file.fileno()).st_size)
+            file.seek(0)
+            file.readinto(buffer)
+
+    locations = {}
+    for key, info in header.items():
+        start, end = info["data_offsets"]
+        locations[key] = TensorLocation(dtypes[info["dtype"]], info["shape"], data_start + start, data_start + end)
+
+    return LazyStateDict(buffer, locations, device=device)
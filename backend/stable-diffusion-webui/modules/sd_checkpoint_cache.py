@@ -0,0 +1,127 @@
+import collections
+import threading
+
+import torch
+
+from modules import shared, safetensors_lazy
+
+
+def state_dict_size(state_dict):
+    if isinstance(state_dict, safetensors_lazy.LazyStateDict):
+        return state_dict.nbytes()
+
+    return sum(v.numel() * v.element_size() for v in state_dict.values() if isinstance(v, torch.Tensor))
+
+
+class CheckpointCache:
+    """
+    State dicts of recently loaded checkpoints, keyed by CheckpointInfo.
+
+    Least recently used state dicts are evicted when their tensors take more than opts.sd_checkpoint_cache_mb,
+    or when there are more than opts.sd_checkpoint_cache of them; either limit is off when set to 0.
+    Entries may be memory-mapped views of safetensors files, which take page cache rather than process memory;
+    they are counted against the budget all the same.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def enabled():
+        return shared.opts.sd_checkpoint_cache_mb > 0 or shared.opts.sd_checkpoint_cache > 0
+
+    @staticmethod
+    def budget():
+        return int(shared.opts.sd_checkpoint_cache_mb * 1024 * 1024)
+
+    def over_limit(self):
+        count_limit = shared.opts.sd_checkpoint_cache
+        budget = self.budget()
+
+        return (count_limit > 0 and len(self.entries) > count_limit) or (budget > 0 and self.size > budget)
+
+    def get(self, checkpoint_info):
+        with self.lock:
+            entry = self.entries.get(checkpoint_info)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(checkpoint_info)
+            return entry[0]
+
+    def put(self, checkpoint_info, state_dict, mapped=False):
+        """Adds a shallow copy of the state dict; returns False if it alone is over the budget and was not added."""
+
+        size = state_dict_size(state_dict)
+        budget = self.budget()
+        if budget > 0 and size > budget:
+            return False
+
+        with self.lock:
+            previous = self.entries.pop(checkpoint_info, None)
+            if previous is not None:
+                self.size -= previous[1]
+
+            self.entries[checkpoint_info] = (state_dict.copy(), size, mapped)
+            self.size += size
+            self.evict()
+
+        return True
+
+    def evict(self):
+        """Evicts least recently used entries over the limits. Must be called with self.lock held."""
+
+        while self.entries and self.over_limit():
+            checkpoint_info, (_, size, _) = self.entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            print(f"Evicted {checkpoint_info.title} from checkpoint cache ({size / 2**20:.0f} MB)")
+
+    def trim(self):
+        """Applies the limits after they were changed in settings."""
+
+        with self.lock:
+            if not self.enabled():
+                self.entries.clear()
+                self.size = 0
+            else:
+                self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def __contains__(self, checkpoint_info):
+        with self.lock:
+            return checkpoint_info in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, checkpoint_info):
+        with self.lock:
+            return self.entries[checkpoint_info][0]
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "budget": self.budget(),
+                "size": self.size,
+                "mapped_size": sum(size for _, size, mapped in self.entries.values() if mapped),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "checkpoints": [{"title": info.title, "size": size, "mapped": mapped} for info, (_, size, mapped) in self.entries.items()],
+            }
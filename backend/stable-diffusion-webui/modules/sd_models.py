@@ -1,4 +1,3 @@
-import collections
 import importlib
 import os
 import sys
@@ -7,12 +6,11 @@ import enum
 
 import torch
 import re
-import safetensors.torch
 from omegaconf import OmegaConf, ListConfig
 from urllib import request
 import ldm.modules.midas as midas
 
-from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches
+from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches, sd_checkpoint_cache, sd_models_prefetch, safetensors_lazy
 from modules.timer import Timer
 from modules.shared import opts
 import tomesd
@@ -24,7 +22,8 @@ model_path = os.path.abspath(os.path.join(paths.models_path, model_dir))
 checkpoints_list = {}
 checkpoint_aliases = {}
 checkpoint_alisases = checkpoint_aliases  # for compatibility with old name
-checkpoints_loaded = collections.OrderedDict()
+checkpoints_lock = threading.RLock()  # for changing checkpoints_list and checkpoint_aliases, which hashing in background does
+checkpoints_loaded = sd_checkpoint_cache.CheckpointCache()
 
 
 class ModelType(enum.Enum):
@@ -104,29 +103,53 @@ class CheckpointInfo:
         for id in self.ids:
             checkpoint_aliases[id] = self
 
-    def calculate_shorthash(self):
-        self.sha256 = hashes.sha256(self.filename, f"checkpoint/{self.name}")
+    def calculate_shorthash(self, wait=True):
+        """Returns the short hash; with wait=False, returns None and hashes the file in background if the hash isn't known yet."""
+
+        if wait:
+            self.sha256 = hashes.sha256(self.filename, f"checkpoint/{self.name}")
+        else:
+            sha256 = hashes.hash_in_background(self.filename, f"checkpoint/{self.name}", callback=self.hash_calculated)
+            self.sha256 = None if sha256 == "pending" else sha256
+
         if self.sha256 is None:
             return
 
-        shorthash = self.sha256[0:10]
-        if self.shorthash == self.sha256[0:10]:
-            return self.shorthash
+        with checkpoints_lock:
+            shorthash = self.sha256[0:10]
+            if self.shorthash == self.sha256[0:10]:
+                return self.shorthash
 
-        self.shorthash = shorthash
+            self.shorthash = shorthash
 
-        if self.shorthash not in self.ids:
-            self.ids += [self.shorthash, self.sha256, f'{self.name} [{self.shorthash}]', f'{self.name_for_extra} [{self.shorthash}]']
+            if self.shorthash not in self.ids:
+                self.ids += [self.shorthash, self.sha256, f'{self.name} [{self.shorthash}]', f'{self.name_for_extra} [{self.shorthash}]']
 
-        old_title = self.title
-        self.title = f'{self.name} [{self.shorthash}]'
-        self.short_title = f'{self.name_for_extra} [{self.shorthash}]'
+            old_title = self.title
+            self.title = f'{self.name} [{self.shorthash}]'
+            self.short_title = f'{self.name_for_extra} [{self.shorthash}]'
 
-        replace_key(checkpoints_list, old_title, self.title, self)
-        self.register()
+            replace_key(checkpoints_list, old_title, self.title, self)
+            self.register()
 
         return self.shorthash
 
+    def hash_calculated(self):
+        """Called on a hashing thread when the file's hash is known."""
+
+        with checkpoints_lock:
+            # the list may have been refreshed while the file was hashed
+            if checkpoints_list.get(self.title) is not self:
+                return
+
+            shorthash = self.calculate_shorthash()
+
+        # the loaded model has no hash if it was loaded before hashing finished
+        model = model_data.sd_model
+        if model is not None and model.sd_checkpoint_info is self:
+            model.sd_model_hash = shorthash
+            shared.opts.data["sd_checkpoint_hash"] = self.sha256
+
 
 try:
     # this silences the annoying "Some weights of the model checkpoint were not used when initializing..." message at start.
@@ -151,6 +174,16 @@ def checkpoint_tiles(use_short=False):
 
 
 def list_models():
+    with checkpoints_lock:
+        find_models()
+
+    if shared.opts.sd_checkpoint_hash_on_discovery:
+        for checkpoint_info in list(checkpoints_list.values()):
+            if checkpoint_info.sha256 is None:
+                checkpoint_info.calculate_shorthash(wait=False)
+
+
+def find_models():
     checkpoints_list.clear()
     checkpoint_aliases.clear()
 
@@ -265,12 +298,15 @@ def get_state_dict_from_checkpoint(pl_sd):
 
     is_sd2_turbo = 'conditioner.embedders.0.model.ln_final.weight' in pl_sd and pl_sd['conditioner.embedders.0.model.ln_final.weight'].size()[0] == 1024
 
+    replacements = checkpoint_dict_replacements_sd2_turbo if is_sd2_turbo else checkpoint_dict_replacements_sd1
+
+    if isinstance(pl_sd, safetensors_lazy.LazyStateDict):
+        pl_sd.rename_keys(lambda k: transform_checkpoint_dict_key(k, replacements))
+        return pl_sd
+
     sd = {}
     for k, v in pl_sd.items():
-        if is_sd2_turbo:
-            new_key = transform_checkpoint_dict_key(k, checkpoint_dict_replacements_sd2_turbo)
-        else:
-            new_key = transform_checkpoint_dict_key(k, checkpoint_dict_replacements_sd1)
+        new_key = transform_checkpoint_dict_key(k, replacements)
 
         if new_key is not None:
             sd[new_key] = v
@@ -314,11 +350,7 @@ def read_state_dict(checkpoint_file, print_global_state=False, map_location=None
     if extension.lower() == ".safetensors":
         device = map_location or shared.weight_load_location or devices.get_optimal_device_name()
 
-        if not shared.opts.disable_mmap_load_safetensors:
-            pl_sd = safetensors.torch.load_file(checkpoint_file, device=device)
-        else:
-            pl_sd = safetensors.torch.load(open(checkpoint_file, 'rb').read())
-            pl_sd = {k: v.to(device) for k, v in pl_sd.items()}
+        pl_sd = safetensors_lazy.load(checkpoint_file, device=device, use_mmap=not shared.opts.disable_mmap_load_safetensors)
     else:
         pl_sd = torch.load(checkpoint_file, map_location=map_location or shared.weight_load_location)
 
@@ -329,16 +361,26 @@ def read_state_dict(checkpoint_file, print_global_state=False, map_location=None
     return sd
 
 
+def read_state_dict_mapped(checkpoint_file):
+    """Reads a safetensors file into CPU tensors backed by a memory map of the file, so they only take page cache until modified."""
+
+    return get_state_dict_from_checkpoint(safetensors_lazy.load(checkpoint_file, device="cpu"))
+
+
 def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
-    sd_model_hash = checkpoint_info.calculate_shorthash()
+    sd_model_hash = checkpoint_info.calculate_shorthash(wait=not shared.opts.sd_checkpoint_hash_background) or "pending"
     timer.record("calculate hash")
 
-    if checkpoint_info in checkpoints_loaded:
-        # use checkpoint cache
-        print(f"Loading weights [{sd_model_hash}] from cache")
-        # move to end as latest
-        checkpoints_loaded.move_to_end(checkpoint_info)
-        return checkpoints_loaded[checkpoint_info]
+    prefetched = sd_models_prefetch.prefetcher.take_state_dict(checkpoint_info)
+    if prefetched is not None:
+        print(f"Loading weights [{sd_model_hash}] from prefetch")
+        return prefetched
+
+    if checkpoints_loaded.enabled():
+        cached = checkpoints_loaded.get(checkpoint_info)
+        if cached is not None:
+            print(f"Loading weights [{sd_model_hash}] from cache")
+            return cached.copy()
 
     print(f"Loading weights [{sd_model_hash}] from {checkpoint_info.filename}")
     res = read_state_dict(checkpoint_info.filename)
@@ -408,7 +450,7 @@ def set_model_fields(model):
 
 
 def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer):
-    sd_model_hash = checkpoint_info.calculate_shorthash()
+    sd_model_hash = checkpoint_info.calculate_shorthash(wait=not shared.opts.sd_checkpoint_hash_background)
     timer.record("calculate hash")
 
     if devices.fp8:
@@ -430,9 +472,12 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     if model.is_ssd:
         sd_hijack.model_hijack.convert_sdxl_to_ssd(model)
 
-    if shared.opts.sd_checkpoint_cache > 0:
+    if checkpoints_loaded.enabled() and checkpoint_info not in checkpoints_loaded:
         # cache newly loaded model
-        checkpoints_loaded[checkpoint_info] = state_dict.copy()
+        if shared.opts.sd_checkpoint_cache_mmap and checkpoint_info.filename.lower().endswith(".safetensors"):
+            checkpoints_loaded.put(checkpoint_info, read_state_dict_mapped(checkpoint_info.filename), mapped=True)
+        else:
+            checkpoints_loaded.put(checkpoint_info, state_dict)
 
     if hasattr(model, "before_load_weights"):
         model.before_load_weights(state_dict)
@@ -520,13 +565,10 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     model.first_stage_model.to(devices.dtype_vae)
     timer.record("apply dtype to VAE")
 
-    # clean up cache if limit is reached
-    while len(checkpoints_loaded) > shared.opts.sd_checkpoint_cache:
-        checkpoints_loaded.popitem(last=False)
-
-    model.sd_model_hash = sd_model_hash
     model.sd_model_checkpoint = checkpoint_info.filename
     model.sd_checkpoint_info = checkpoint_info
+    # after sd_checkpoint_info is set, so that a hash that was calculated in background meanwhile isn't missed
+    model.sd_model_hash = sd_model_hash or checkpoint_info.shorthash
     shared.opts.data["sd_checkpoint_hash"] = checkpoint_info.sha256
 
     if hasattr(model, 'logvar'):
@@ -806,7 +848,7 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None):
 
     timer.record("find config")
 
-    sd_config = OmegaConf.load(checkpoint_config)
+    sd_config = sd_models_prefetch.prefetcher.take_config(checkpoint_info, checkpoint_config) or OmegaConf.load(checkpoint_config)
     repair_config(sd_config, state_dict)
 
     timer.record("load config")
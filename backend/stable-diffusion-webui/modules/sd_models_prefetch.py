@@ -0,0 +1,231 @@
+"""
+Reads checkpoints in the background, so that switching to them later only has to load weights that are already in memory.
+
+A prefetch hashes the checkpoint file, reads its state dict into CPU memory, finds and loads its config, and reads the VAE
+that would be used with it. sd_models and sd_vae take prefetched data instead of reading files when they switch to that checkpoint.
+Only the most recently requested checkpoint is kept.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import errors, hashes, shared
+
+
+class Prefetched:
+    def __init__(self, checkpoint_info):
+        self.checkpoint_info = checkpoint_info
+        self.state_dict = None
+        self.config = None
+        self.sd_config = None
+        self.vae_file = None
+        self.vae_dict = None
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def status(self):
+        if self.error is not None:
+            return "failed"
+        if not self.done.is_set():
+            return "loading"
+        if self.state_dict is None:
+            return "used"
+
+        return "ready"
+
+
+def warm_page_cache(filename, chunk_size=16 * 2**20):
+    """Reads the file so that a memory-mapped load of it doesn't have to wait for the disk."""
+
+    buffer = bytearray(chunk_size)
+    with open(filename, "rb", buffering=0) as file:
+        while file.readinto(buffer):
+            pass
+
+
+class CheckpointPrefetcher:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-prefetch")
+        self.current = None
+        self.queued_checkpoints = {}
+        self.queue_lock = None
+
+    def prefetch(self, checkpoint_info):
+        """Starts reading the checkpoint in the background, unless it's already loaded or being prefetched; returns its Prefetched."""
+
+        with self.lock:
+            if self.current is not None and self.current.checkpoint_info == checkpoint_info and self.current.status() in ("loading", "ready"):
+                return self.current
+
+            self.current = Prefetched(checkpoint_info)
+            prefetched = self.current
+
+        self.executor.submit(self.run, prefetched)
+        return prefetched
+
+    def run(self, prefetched):
+        from modules import sd_models, sd_models_config, sd_vae
+        from omegaconf import OmegaConf
+
+        checkpoint_info = prefetched.checkpoint_info
+
+        try:
+            if self.current is not prefetched:
+                return
+
+            # only stores the hash in cache; checkpoints are renamed with their hash when they are loaded, on the thread that loads them
+            hashes.sha256(checkpoint_info.filename, f"checkpoint/{checkpoint_info.name}")
+
+            is_safetensors = checkpoint_info.filename.lower().endswith(".safetensors")
+            if is_safetensors and not shared.opts.disable_mmap_load_safetensors:
+                warm_page_cache(checkpoint_info.filename)
+
+            state_dict = sd_models.read_state_dict(checkpoint_info.filename, map_location="cpu")
+            prefetched.config = sd_models_config.find_checkpoint_config(state_dict, checkpoint_info)
+            prefetched.sd_config = OmegaConf.load(prefetched.config)
+
+            vae_file, _ = sd_vae.resolve_vae(checkpoint_info.filename).tuple()
+            if vae_file:
+                prefetched.vae_file = vae_file
+                prefetched.vae_dict = sd_vae.load_vae_dict(vae_file, map_location="cpu")
+
+            prefetched.state_dict = state_dict
+            print(f"Prefetched checkpoint {checkpoint_info.title} in {time.time() - prefetched.started_at:.1f}s")
+        except Exception as e:
+            errors.report(f"Error prefetching checkpoint {checkpoint_info.title}", exc_info=True)
+            prefetched.error = e
+        finally:
+            prefetched.finished_at = time.time()
+            prefetched.done.set()
+
+    def find(self, checkpoint_info):
+        """Returns the Prefetched for the checkpoint, waiting for it if it's still loading, or None."""
+
+        with self.lock:
+            prefetched = self.current
+
+        if prefetched is None or prefetched.checkpoint_info != checkpoint_info:
+            return None
+
+        prefetched.done.wait()
+        return prefetched
+
+    def take_state_dict(self, checkpoint_info):
+        prefetched = self.find(checkpoint_info)
+        if prefetched is None or prefetched.state_dict is None:
+            return None
+
+        state_dict, prefetched.state_dict = prefetched.state_dict, None
+
+        # the next job's checkpoint can be read now
+        self.executor.submit(self.predict)
+
+        return state_dict
+
+    def take_config(self, checkpoint_info, config):
+        """Returns the loaded config if it was prefetched from the same file; load_model modifies it, so it's only given out once."""
+
+        prefetched = self.find(checkpoint_info)
+        if prefetched is None or prefetched.sd_config is None or prefetched.config != config:
+            return None
+
+        sd_config, prefetched.sd_config = prefetched.sd_config, None
+        return sd_config
+
+    def take_vae_dict(self, vae_file):
+        with self.lock:
+            prefetched = self.current
+
+        if prefetched is None or not prefetched.done.is_set() or prefetched.vae_file != vae_file or prefetched.vae_dict is None:
+            return None
+
+        vae_dict, prefetched.vae_dict = prefetched.vae_dict, None
+        return vae_dict
+
+    def clear(self):
+        with self.lock:
+            self.current = None
+
+    def status(self):
+        with self.lock:
+            prefetched = self.current
+
+        if prefetched is None:
+            return None
+
+        return {
+            "title": prefetched.checkpoint_info.title,
+            "status": prefetched.status(),
+            "vae": prefetched.vae_file,
+            "started_at": prefetched.started_at,
+            "finished_at": prefetched.finished_at,
+            "error": None if prefetched.error is None else f"{type(prefetched.error).__name__}: {prefetched.error}",
+        }
+
+    def note_queued(self, id_task, checkpoint_name):
+        """Records which checkpoint a job that is about to wait for queue_lock will switch to, for predict()."""
+
+        if id_task is not None and checkpoint_name:
+            with self.lock:
+                self.queued_checkpoints[id_task] = checkpoint_name
+
+    def forget_queued(self, id_task):
+        with self.lock:
+            self.queued_checkpoints.pop(id_task, None)
+
+    def predict(self, queue_lock=None):
+        """
+        Prefetches the checkpoint of the first job after the running one that will switch to another checkpoint.
+
+        Called when jobs are queued, start and finish, and when a prefetched checkpoint is taken; does nothing unless enabled in settings.
+        A prefetch that the running job hasn't taken yet is not replaced.
+        """
+
+        if not shared.opts.sd_checkpoint_prefetch_queued:
+            return
+
+        from modules import sd_models
+
+        queue_lock = queue_lock or self.queue_lock
+        if queue_lock is None:
+            return
+        self.queue_lock = queue_lock
+
+        snapshot = queue_lock.snapshot()
+        running = snapshot["running"]["id"] if snapshot["running"] is not None else None
+        waiting = [item["id"] for item in snapshot["pending"]]
+
+        with self.lock:
+            # jobs that were noted but haven't started waiting for the lock yet go after those that have
+            order = [id_task for id_task in [running] + waiting if id_task in self.queued_checkpoints]
+            order += [id_task for id_task in self.queued_checkpoints if id_task not in order]
+            names = [(id_task, self.queued_checkpoints[id_task]) for id_task in order]
+            current = self.current
+
+        # not shared.sd_model, which would load a model if there is none
+        expected = sd_models.model_data.sd_model.sd_checkpoint_info if sd_models.model_data.sd_model is not None else None
+
+        for id_task, name in names:
+            checkpoint_info = sd_models.get_closet_checkpoint_match(name)
+            if checkpoint_info is None:
+                continue
+
+            if id_task == running:
+                expected = checkpoint_info
+                continue
+
+            if checkpoint_info == expected:
+                return
+
+            if current is not None and current.checkpoint_info == expected and current.status() in ("loading", "ready"):
+                return
+
+            self.prefetch(checkpoint_info)
+            return
+
+
+prefetcher = CheckpointPrefetcher()
@@ -1,9 +1,10 @@
 import inspect
+import time
 from collections import namedtuple
 import numpy as np
 import torch
 from PIL import Image
-from modules import devices, images, sd_vae_approx, sd_samplers, sd_vae_taesd, shared, sd_models
+from modules import devices, images, sd_vae_approx, sd_samplers, sd_vae_taesd, shared, sd_models, metrics
 from modules.shared import opts, state
 import k_diffusion.sampling
 
@@ -252,6 +253,8 @@ class Sampler:
         self.model_wrap_cfg = None
         self.sampler_extra_args = None
         self.options = {}
+        self.last_step_time = None
+        self.step_labels = {}
 
     def callback_state(self, d):
         step = d['i']
@@ -260,6 +263,12 @@ class Sampler:
             raise InterruptedException
 
         state.sampling_step = step
+        state.notify("step")
+
+        now = time.perf_counter()
+        if self.last_step_time is not None:
+            metrics.sampling_step.observe(now - self.last_step_time, **self.step_labels)
+        self.last_step_time = now
         shared.total_tqdm.update()
 
     def launch_sampling(self, steps, func):
@@ -268,6 +277,9 @@ class Sampler:
         state.sampling_steps = steps
         state.sampling_step = 0
 
+        self.step_labels = metrics.labels_for(self.p) if self.p is not None else {}
+        self.last_step_time = time.perf_counter()
+
         try:
             return func()
         except RecursionError:
@@ -34,6 +34,12 @@ def refresh_vae_list():
     modules.sd_vae.refresh_vae_list()
 
 
+def trim_checkpoint_cache():
+    import modules.sd_models
+
+    modules.sd_models.checkpoints_loaded.trim()
+
+
 def cross_attention_optimizations():
     import modules.sd_hijack
 
@@ -137,6 +137,7 @@ Profiling allows you to see which code uses how much of computer's resources dur
 Each generation writes its own profile to one file, overwriting previous.
 The file can be viewed in <a href="chrome:tracing">Chrome</a>, or on a <a href="https://ui.perfetto.dev/">Perfetto</a> web site.
 Warning: writing profile can take a lot of time, up to 30 seconds, and the file itelf can be around 500MB in size.
+Profiles of specific generations can also be requested through the API, at /sdapi/v1/profiler/arm, without enabling profiling here.
 """),
     "profiling_enable": OptionInfo(False, "Enable profiling"),
     "profiling_activities": OptionInfo(["CPU"], "Activities", gr.CheckboxGroup, {"choices": ["CPU", "CUDA"]}),
@@ -144,12 +145,22 @@ Warning: writing profile can take a lot of time, up to 30 seconds, and the file
     "profiling_profile_memory": OptionInfo(True, "Profile memory"),
     "profiling_with_stack": OptionInfo(True, "Include python stack"),
     "profiling_filename": OptionInfo("trace.json", "Profile filename"),
+    "profiling_api_keep": OptionInfo(5, "Number of profiles captured through the API to keep", gr.Slider, {"minimum": 1, "maximum": 50, "step": 1}).info("older profiles and their files are deleted; profiles are requested with /sdapi/v1/profiler/arm"),
 }))
 
 options_templates.update(options_section(('API', "API", "system"), {
     "api_enable_requests": OptionInfo(True, "Allow http:// and https:// URLs for input images in API", restrict_api=True),
     "api_forbid_local_requests": OptionInfo(True, "Forbid URLs to local resources", restrict_api=True),
     "api_useragent": OptionInfo("", "User agent for requests", restrict_api=True),
+    "api_image_cache_mb": OptionInfo(256, "Cache for images downloaded from URLs in API requests", gr.Number, {"precision": 0}).info("MB of decoded images; repeated URLs are revalidated with ETag instead of downloaded again; 0 = disable"),
+    "api_worker_threads": OptionInfo(4, "Number of threads for decoding and encoding images in API requests", gr.Slider, {"minimum": 1, "maximum": 32, "step": 1}).needs_restart(),
+    "api_batching_window": OptionInfo(0, "Batching window for txt2img API requests", gr.Slider, {"minimum": 0, "maximum": 2000, "step": 10}).info("milliseconds; requests that differ only in prompt and seed and arrive within the window are generated as one batch; 0 = disable"),
+    "api_batching_max_batch_size": OptionInfo(8, "Maximum number of images in a merged txt2img API batch", gr.Slider, {"minimum": 1, "maximum": 64, "step": 1}),
+    "api_batching_max_megapixels": OptionInfo(4.0, "Maximum total megapixels in a merged txt2img API batch", gr.Number).info("limits VRAM use of merged batches; counts hires fix output size"),
+    "api_jobs_workers": OptionInfo(2, "Number of threads running background API jobs", gr.Slider, {"minimum": 1, "maximum": 16, "step": 1}).needs_restart(),
+    "api_jobs_max_pending": OptionInfo(100, "Maximum number of unfinished background API jobs", gr.Number, {"precision": 0}),
+    "api_jobs_ttl": OptionInfo(3600, "Keep background API job results for", gr.Number, {"precision": 0}).info("seconds"),
+    "api_jobs_store_size_mb": OptionInfo(1024, "Maximum size of stored background API job results", gr.Number, {"precision": 0}).info("MB; oldest results are removed first").needs_restart(),
 }))
 
 options_templates.update(options_section(('training', "Training", "training"), {
@@ -171,7 +182,13 @@ options_templates.update(options_section(('sd', "Stable Diffusion", "sd"), {
     "sd_model_checkpoint": OptionInfo(None, "Stable Diffusion checkpoint", gr.Dropdown, lambda: {"choices": shared_items.list_checkpoint_tiles(shared.opts.sd_checkpoint_dropdown_use_short)}, refresh=shared_items.refresh_checkpoints, infotext='Model hash'),
     "sd_checkpoints_limit": OptionInfo(1, "Maximum number of checkpoints loaded at the same time", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}),
     "sd_checkpoints_keep_in_cpu": OptionInfo(True, "Only keep one model on device").info("will keep models other than the currently used one in RAM rather than VRAM"),
-    "sd_checkpoint_cache": OptionInfo(0, "Checkpoints to cache in RAM", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}).info("obsolete; set to 0 and use the two settings above instead"),
+    "sd_checkpoint_cache": OptionInfo(0, "Checkpoints to cache in RAM", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}, onchange=shared_items.trim_checkpoint_cache).info("obsolete; set to 0 and use the two settings above, or the cache size below, instead"),
+    "sd_checkpoint_cache_mb": OptionInfo(0, "Checkpoint cache size (MB)", gr.Number, {"precision": 0}, onchange=shared_items.trim_checkpoint_cache).info("keeps state dicts of recently loaded checkpoints in RAM up to this total tensor size, to switch back to them without reading the file; 0 = disable"),
+    "sd_checkpoint_cache_mmap": OptionInfo(False, "Cache safetensors checkpoints as memory-mapped files").info("cached checkpoints take page cache, which the system can reclaim, instead of process memory"),
+    "sd_checkpoint_prefetch_queued": OptionInfo(False, "Prefetch checkpoints of queued API jobs").info("reads the checkpoint that the next API job will switch to into RAM while the current job runs; checkpoints can also be prefetched with /sdapi/v1/prefetch-checkpoint"),
+    "sd_checkpoint_hash_background": OptionInfo(True, "Calculate checkpoint hashes in background").info("loading a checkpoint doesn't wait for its sha256; images get the model hash in infotext once it's known"),
+    "sd_checkpoint_hash_on_discovery": OptionInfo(False, "Calculate hashes of all checkpoints in background when they are found").info("reads every checkpoint file once, at startup and when the list is refreshed; hashes are kept between runs"),
+    "hash_workers": OptionInfo(2, "Background hashing threads", gr.Slider, {"minimum": 1, "maximum": 16, "step": 1}).needs_restart(),
     "sd_unet": OptionInfo("Automatic", "SD Unet", gr.Dropdown, lambda: {"choices": shared_items.sd_unet_items()}, refresh=shared_items.refresh_unet_list).info("choose Unet model: Automatic = use one with same filename as checkpoint; None = use Unet from checkpoint"),
     "enable_quantization": OptionInfo(False, "Enable quantization in K samplers for sharper and cleaner results. This may change existing seeds").needs_reload_ui(),
     "emphasis": OptionInfo("Original", "Emphasis mode", gr.Radio, lambda: {"choices": [x.name for x in sd_emphasis.options]}, infotext="Emphasis").info("makes it possible to make model to pay (more:1.1) or (less:0.9) attention to text when you use the syntax in prompt; " + sd_emphasis.get_options_descriptions()),
@@ -29,6 +29,8 @@ class State:
     server_start = None
     _server_command_signal = threading.Event()
     _server_command: Optional[str] = None
+    _listeners = []
+    _preview_lock = threading.Lock()
 
     def __init__(self):
         self.server_start = time.time()
@@ -67,6 +69,19 @@ class State:
             return req
         return None
 
+    def add_listener(self, func) -> None:
+        """
+        Registers func(event) to be called from the generating thread on progress changes.
+
+        Events are "begin", "end", "job" (next job in a batch), "step" (sampling step), "preview" (new live preview),
+        and "start"/"finish" for tasks tracked by modules.progress.
+        """
+        self._listeners.append(func)
+
+    def notify(self, event: str) -> None:
+        for func in self._listeners:
+            func(event)
+
     def request_restart(self) -> None:
         self.interrupt()
         self.server_command = "restart"
@@ -91,6 +106,7 @@ class State:
         self.job_no += 1
         self.sampling_step = 0
         self.current_image_sampling_step = 0
+        self.notify("job")
 
     def dict(self):
         obj = {
@@ -125,12 +141,14 @@ class State:
         self.job = job
         devices.torch_gc()
         log.info("Starting job %s", job)
+        self.notify("begin")
 
     def end(self):
         duration = time.time() - self.time_start
         log.info("Ending job %s (%.2f seconds)", self.job, duration)
         self.job = ""
         self.job_count = 0
+        self.notify("end")
 
         devices.torch_gc()
 
@@ -140,7 +158,15 @@ class State:
             return
 
         if self.sampling_step - self.current_image_sampling_step >= shared.opts.show_progress_every_n_steps and shared.opts.live_previews_enable and shared.opts.show_progress_every_n_steps != -1:
-            self.do_set_current_image()
+            # if another thread is already decoding this preview, don't decode it again
+            if not self._preview_lock.acquire(blocking=False):
+                return
+
+            try:
+                if self.sampling_step - self.current_image_sampling_step >= shared.opts.show_progress_every_n_steps:
+                    self.do_set_current_image()
+            finally:
+                self._preview_lock.release()
 
     def do_set_current_image(self):
         if self.current_latent is None:
@@ -166,3 +192,4 @@ class State:
             image = image.convert('RGB')
         self.current_image = image
         self.id_live_preview += 1
+        self.notify("preview")
@@ -0,0 +1,140 @@
+import threading
+import time
+import types
+
+import pytest
+
+from modules.api import batching
+
+
+@pytest.fixture
+def opts(monkeypatch):
+    opts = types.SimpleNamespace(api_batching_window=50, api_batching_max_batch_size=4, api_batching_max_megapixels=10.0)
+    monkeypatch.setattr(batching, "opts", opts)
+    return opts
+
+
+def member(prompt, seed, batch_size=1, task_id=None, **args):
+    return batching.BatchMember({"prompt": prompt, "negative_prompt": "bad", "seed": seed, "subseed": 100, "batch_size": batch_size, **args}, task_id or prompt)
+
+
+def test_merge_args():
+    args = batching.merge_args([member("a", 10, batch_size=2), member("b", 20, subseed_strength=0.5)])
+
+    assert args["prompt"] == ["a", "a", "b"]
+    assert args["negative_prompt"] == ["bad", "bad", "bad"]
+    assert args["seed"] == [10, 11, 20]
+    assert args["subseed"] == [100, 101, 100]
+    assert args["batch_size"] == 3
+    assert args["n_iter"] == 1
+
+
+def test_split_processed():
+    members = [member("a", 10, batch_size=2), member("b", 20)]
+    processed = types.SimpleNamespace(
+        images=["grid", "a1", "a2", "b1"],
+        infotexts=["grid info", "a1 info", "a2 info", "b1 info"],
+        index_of_first_image=1,
+        all_prompts=["a", "a", "b"],
+        all_negative_prompts=["bad", "bad", "bad"],
+        all_seeds=[10, 11, 20],
+        all_subseeds=[100, 101, 102],
+    )
+
+    batching.split_processed(processed, members)
+
+    first, second = members[0].processed, members[1].processed
+    assert first.images == ["a1", "a2"] and first.info == "a1 info" and first.all_seeds == [10, 11] and first.batch_size == 2
+    assert second.images == ["b1"] and second.prompt == "b" and second.seed == 20 and second.subseed == 102
+    assert second.index_of_first_image == 0
+
+    with pytest.raises(RuntimeError):
+        batching.split_processed(processed, members[:1])
+
+
+def test_batcher_join_and_limit(opts):
+    batcher = batching.Txt2ImgBatcher()
+
+    group, is_leader = batcher.join("key", member("a", 1, batch_size=2), 4)
+    assert is_leader and not group.filled.is_set()
+
+    same_group, is_leader = batcher.join("key", member("b", 2), 4)
+    assert same_group is group and not is_leader
+
+    # a request that doesn't fit starts a new group
+    other_group, is_leader = batcher.join("key", member("c", 3, batch_size=2), 4)
+    assert other_group is not group and is_leader
+
+    # filling a group to its limit closes it
+    same_group, is_leader = batcher.join("key", member("d", 4, batch_size=2), 4)
+    assert same_group is other_group and other_group.filled.is_set()
+    assert "key" not in batcher.open_groups
+
+    assert [x.task_id for x in batcher.members(group)] == ["a", "b"]
+    assert group.filled.is_set()
+
+
+def test_batcher_submit_runs_group_once(opts):
+    batcher = batching.Txt2ImgBatcher()
+    runs = []
+    results = {}
+
+    def run(group):
+        members = batcher.members(group)
+        runs.append([x.task_id for x in members])
+        for x in members:
+            x.processed = x.task_id + " result"
+
+    def submit(name):
+        results[name] = batcher.submit("key", member(name, 1), 4, run)
+
+    leader = threading.Thread(target=submit, args=("a",))
+    leader.start()
+    while "key" not in batcher.open_groups:
+        time.sleep(0.001)
+    follower = threading.Thread(target=submit, args=("b",))
+    follower.start()
+
+    leader.join()
+    follower.join()
+
+    assert runs == [["a", "b"]]
+    assert results == {"a": "a result", "b": "b result"}
+
+
+def test_batcher_submit_propagates_error(opts):
+    batcher = batching.Txt2ImgBatcher()
+    group, _ = batcher.join("key", member("a", 1), 4)
+    errors = []
+
+    def wait_as_follower():
+        try:
+            batcher.submit("key", member("b", 2), 4, None)
+        except Exception as e:
+            errors.append(e)
+
+    follower = threading.Thread(target=wait_as_follower)
+    follower.start()
+    while len(group.members) < 2:
+        time.sleep(0.001)
+
+    # the group's leader fails to generate it
+    batcher.open_groups.pop("key")
+    error = RuntimeError("out of memory")
+    group.error = error
+    group.done.set()
+    follower.join()
+
+    assert errors == [error]
+
+
+def test_batcher_submit_leader_raises(opts):
+    batcher = batching.Txt2ImgBatcher()
+
+    def run(group):
+        raise ValueError("no checkpoint")
+
+    with pytest.raises(ValueError):
+        batcher.submit("key", member("a", 1), 4, run)
+
+    assert "key" not in batcher.open_groups
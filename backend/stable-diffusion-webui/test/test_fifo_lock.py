@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from modules.fifo_lock import PriorityLock, QueueCancelled
+
+
+def start_waiter(lock, order, name, **kwargs):
+    def run():
+        try:
+            with lock.queued(**kwargs):
+                order.append(name)
+        except QueueCancelled as e:
+            order.append((name, e.reason))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    while lock.position(name) is None and thread.is_alive():
+        time.sleep(0.001)
+    return thread
+
+
+def test_priority_lock_order():
+    lock = PriorityLock()
+    order = []
+
+    lock.acquire()
+    threads = [
+        start_waiter(lock, order, "low", ticket="low", client="a"),
+        start_waiter(lock, order, "high", ticket="high", client="a", priority=10),
+        start_waiter(lock, order, "other-client", ticket="other-client", client="b"),
+    ]
+    assert [x["id"] for x in lock.snapshot()["pending"]] == ["high", "low", "other-client"]
+    lock.release()
+
+    for thread in threads:
+        thread.join()
+
+    # once client "a" has had its turn, client "b" goes ahead of a's older request
+    assert order == ["high", "other-client", "low"]
+    assert not lock.locked()
+
+
+@pytest.mark.parametrize("kwargs,reason", [
+    ({"deadline": time.monotonic() - 1}, "deadline exceeded"),
+    ({"is_cancelled": lambda: True}, "client disconnected"),
+])
+def test_priority_lock_drops_waiters(kwargs, reason):
+    lock = PriorityLock(poll_interval=0.01)
+    order = []
+
+    lock.acquire()
+    thread = start_waiter(lock, order, "job", ticket="job", **kwargs)
+    thread.join(timeout=5)
+    lock.release()
+
+    assert order == [("job", reason)]
+    assert not lock.locked()
+
+
+def test_priority_lock_cancel():
+    lock = PriorityLock()
+    order = []
+
+    lock.acquire()
+    thread = start_waiter(lock, order, "job", ticket="job")
+    assert lock.cancel("job")
+    thread.join(timeout=5)
+
+    assert order == [("job", "cancelled")]
+    assert lock.position("job") is None
+    lock.release()
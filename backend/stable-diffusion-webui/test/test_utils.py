@@ -28,6 +28,12 @@ def test_options_write(base_url):
     "sdapi/v1/realesrgan-models",
     "sdapi/v1/prompt-styles",
     "sdapi/v1/embeddings",
+    "sdapi/v1/queue",
+    "metrics",
 ])
 def test_get_api_url(base_url, url):
     assert requests.get(f"{base_url}/{url}").status_code == 200
+
+
+def test_unknown_job(base_url):
+    assert requests.get(f"{base_url}/sdapi/v1/jobs/0123456789abcdef").status_code == 404
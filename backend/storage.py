@@ -0,0 +1,116 @@
+# storage.py
+import asyncio
+import io
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+
+MB = 1024 * 1024
+
+
+class S3Uploader:
+    # boto3の同期アップロードを専用スレッドプールで実行する
+    def __init__(self, client, bucket: str, region: str, max_workers: int = 4, max_pending: int = 32,
+                 multipart_threshold: int = 8 * MB, multipart_chunksize: int = 8 * MB):
+        self.client = client
+        self.bucket = bucket
+        self.region = region
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="s3-upload")
+        # 同時に抱えるアップロード数の上限。満杯のときは拒否せず、空きが出るまで呼び出し側を待たせる（バックプレッシャー）
+        self.slots = asyncio.Semaphore(max_pending)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=2,
+            use_threads=True,
+        )
+        self.background_tasks: set[asyncio.Task] = set()
+
+    def object_url(self, filename: str) -> str:
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{filename}"
+
+    def _put(self, file_data: bytes, filename: str, content_type: str) -> None:
+        extra_args = {"ContentType": content_type, "ACL": "public-read"}
+        if len(file_data) < self.transfer_config.multipart_threshold:
+            self.client.put_object(Bucket=self.bucket, Key=filename, Body=file_data, **extra_args)
+        else:
+            self.client.upload_fileobj(io.BytesIO(file_data), self.bucket, filename, ExtraArgs=extra_args, Config=self.transfer_config)
+
+    async def _upload(self, file_data: bytes, filename: str, content_type: str) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self._put, file_data, filename, content_type)
+        finally:
+            self.slots.release()
+
+    async def upload(self, file_data: bytes, filename: str, content_type: str = "image/png") -> str:
+        await self.slots.acquire()
+        await self._upload(file_data, filename, content_type)
+        return self.object_url(filename)
+
+    async def upload_in_background(self, file_data: bytes, filename: str, content_type: str = "image/png") -> str:
+        # 先にURLを返し、アップロードは裏で続ける
+        # max_pending件が未完了のときは1件終わるまでURLを返さない（メモリに溜める画像の数を抑えるため）
+        await self.slots.acquire()
+        task = asyncio.create_task(self._upload(file_data, filename, content_type))
+        self.background_tasks.add(task)
+        task.add_done_callback(self._background_done)
+        return self.object_url(filename)
+
+    def _background_done(self, task: asyncio.Task) -> None:
+        self.background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            exc = task.exception()
+            print("S3バックグラウンドアップロード失敗:", "".join(traceback.format_exception(exc)))
+
+    async def drain(self) -> None:
+        if self.background_tasks:
+            await asyncio.gather(*self.background_tasks, return_exceptions=True)
+
+    async def close(self) -> None:
+        await self.drain()
+        self.executor.shutdown(wait=True)
+
+
+_uploader: S3Uploader | None = None
+
+
+def get_uploader() -> S3Uploader:
+    # .env読み込み後に設定を読むため、初回利用時に生成する
+    global _uploader
+    if _uploader is None:
+        client = boto3.client(
+            's3',
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            region_name=os.getenv("AWS_REGION"),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+        )
+        _uploader = S3Uploader(
+            client,
+            bucket=os.getenv("S3_BUCKET_NAME"),
+            region=os.getenv("AWS_REGION"),
+            max_workers=int(os.getenv("S3_UPLOAD_WORKERS", "4")),
+            max_pending=int(os.getenv("S3_UPLOAD_MAX_PENDING", "32")),
+            multipart_threshold=int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8")) * MB,
+            multipart_chunksize=int(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "8")) * MB,
+        )
+    return _uploader
+
+
+async def close() -> None:
+    global _uploader
+    if _uploader is not None:
+        await _uploader.close()
+        _uploader = None
+
+
+async def upload_image(file_data: bytes, filename: str, content_type: str = "image/png") -> str:
+    # S3_UPLOAD_MODE=background なら完了を待たずにURLを返す（未完了が S3_UPLOAD_MAX_PENDING 件あるときは空くまで待つ）
+    uploader = get_uploader()
+    if os.getenv("S3_UPLOAD_MODE", "sync") == "background":
+        return await uploader.upload_in_background(file_data, filename, content_type)
+    return await uploader.upload(file_data, filename, content_type)
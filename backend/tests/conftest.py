@@ -0,0 +1,5 @@
+import os
+import sys
+
+# テストは backend/ のモジュールをそのまま import する
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,82 @@
+import asyncio
+import base64
+
+import generation
+
+
+def test_store_records_user_id(monkeypatch):
+    uploaded = {}
+    records = []
+
+    async def upload_image(file_data, filename, content_type="image/png"):
+        uploaded[filename] = (file_data, content_type)
+        return f"https://example.com/{filename}"
+
+    async def create_image_record_async(db, record):
+        records.append(record)
+
+    monkeypatch.setattr(generation.storage, "upload_image", upload_image)
+    monkeypatch.setattr(generation.crud, "create_image_record_async", create_image_record_async)
+
+    result = {"images": [base64.b64encode(b"png").decode()]}
+    image_url = asyncio.run(generation.store(result, "猫", db=None, user_id="42"))
+
+    (filename, (data, content_type)), = uploaded.items()
+    assert image_url == f"https://example.com/{filename}"
+    assert (data, content_type) == (b"png", "image/png")
+    assert [(x.image_url, x.prompt, x.user_id) for x in records] == [(image_url, "猫", "42")]
+
+
+def test_stream_survives_failed_progress_polls(monkeypatch):
+    import httpx
+
+    import webui_client
+    from webui_router import WebuiBackend, WebuiRouter
+
+    polls = []
+    finish = asyncio.Event()
+
+    async def handler(request):
+        if request.url.path == "/internal/progress":
+            polls.append(None)
+            if len(polls) == 1:
+                raise httpx.ReadTimeout("timed out", request=request)
+            if len(polls) == 2:
+                return httpx.Response(500, text="Internal Server Error")
+            if len(polls) == 3:
+                return httpx.Response(200, text="not json")
+            finish.set()
+            return httpx.Response(200, json={"active": True, "progress": 0.5})
+        await finish.wait()
+        return httpx.Response(200, json={"images": ["png"]})
+
+    backend = WebuiBackend("http://webui", httpx.AsyncClient(base_url="http://webui", transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(webui_client, "_router", WebuiRouter([backend]))
+    monkeypatch.setenv("WEBUI_BINARY_TRANSPORT", "0")
+    monkeypatch.setenv("STREAM_POLL_INTERVAL", "0.01")
+
+    async def prepare(kind, req):
+        return "/sdapi/v1/txt2img", {"prompt": "cat"}, "cat", None
+
+    async def store(result, prompt, db, user_id=None):
+        return "https://example.com/a.png"
+
+    class Session:
+        async def __aenter__(self):
+            return None
+
+        async def __aexit__(self, *args):
+            return False
+
+    monkeypatch.setattr(generation, "prepare", prepare)
+    monkeypatch.setattr(generation, "store", store)
+
+    async def main():
+        req = generation.schemas.GenerateImageRequest(prompt="猫", steps=20, width=512, height=512, style="anime")
+        return [event async for event in generation.stream("full_generate", req, Session)]
+
+    events = asyncio.run(main())
+
+    assert len(polls) >= 4
+    assert [name for name, _ in events if name != "progress"] == ["queued", "result"]
+    assert events[-1][1]["image_url"] == "https://example.com/a.png"
@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine  # noqa: E402
+
+import crud  # noqa: E402
+import schemas  # noqa: E402
+from models.base import Base, create_missing_indexes  # noqa: E402
+from models.image_record import ImageRecord  # noqa: E402
+
+
+def test_record_out_returns_user_id_as_string():
+    record = ImageRecord(id=1, image_url="https://example.com/a.png", prompt="猫", user_id=42)
+
+    assert schemas.ImageRecordOut.model_validate(record).user_id == "42"
+
+
+def test_records_page_and_full_list():
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+        now = datetime.utcnow()
+        async with session_factory() as db:
+            db.add_all(ImageRecord(image_url=f"{i}.png", prompt="猫", user_id=1, created_at=now - timedelta(seconds=i)) for i in range(5))
+            await db.commit()
+
+            first, cursor = await crud.get_records_page_async(db, user_id="1", limit=2)
+            second, cursor2 = await crud.get_records_page_async(db, user_id="1", limit=2, cursor=cursor)
+            everything, no_cursor = await crud.get_records_page_async(db, user_id="1", limit=None)
+        await engine.dispose()
+        return first, second, cursor2, everything, no_cursor
+
+    first, second, cursor2, everything, no_cursor = asyncio.run(main())
+
+    assert [x.image_url for x in first] == ["0.png", "1.png"]
+    assert [x.image_url for x in second] == ["2.png", "3.png"]
+    assert cursor2 is not None
+    assert [x.image_url for x in everything] == [f"{i}.png" for i in range(5)]
+    assert no_cursor is None
+
+
+def test_create_missing_indexes_on_existing_table():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_generated_images_user_created_id"))
+        conn.execute(text("DROP INDEX ix_generated_images_created_id"))
+
+    assert sorted(create_missing_indexes(engine)) == ["ix_generated_images_created_id", "ix_generated_images_user_created_id"]
+    assert create_missing_indexes(engine) == []
+    assert "ix_generated_images_created_id" in {x["name"] for x in inspect(engine).get_indexes("generated_images")}
@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine  # noqa: E402
+
+import crud  # noqa: E402
+import jobs  # noqa: E402
+import schemas  # noqa: E402
+from models.base import Base  # noqa: E402
+from models.generation_job import GenerationJob  # noqa: E402
+
+
+def run_with_db(test):
+    # 各テストを新しいインメモリSQLiteの上で動かす
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        try:
+            return await test(session_factory)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+def request():
+    return schemas.GenerateImageRequest(prompt="猫", steps=20, width=512, height=512, style="anime", user_id="1")
+
+
+def test_position_follows_queue_order():
+    async def test(session_factory):
+        queue = jobs.JobQueue(session_factory, owner="a")
+        ids = [await queue.submit("full_generate", request()) for _ in range(3)]
+        positions = [queue.position(x) for x in ids]
+
+        # ワーカーが1件取り出すと残りが繰り上がる
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def run(job_id):
+            started.set()
+            await release.wait()
+
+        queue.run = run
+        worker = asyncio.create_task(queue.worker())
+        await started.wait()
+        after = [queue.position(x) for x in ids]
+        worker.cancel()
+        return positions, after
+
+    positions, after = run_with_db(test)
+
+    assert positions == [0, 1, 2]
+    assert after == [None, 0, 1]
+
+
+def test_recover_only_own_and_stale_jobs():
+    async def test(session_factory):
+        now = datetime.utcnow()
+        async with session_factory() as db:
+            for job_id, status, owner, age in [
+                ("own-running", "running", "a", 0),
+                ("own-queued", "queued", "a", 0),
+                ("no-owner", "queued", None, 0),
+                ("other-running", "running", "b", 10),
+                ("other-stale", "running", "c", 600),
+                ("other-finished", "succeeded", "c", 600),
+            ]:
+                db.add(GenerationJob(id=job_id, kind="full_generate", status=status, request_json=request().model_dump_json(),
+                                     owner=owner, created_at=now - timedelta(seconds=age), updated_at=now - timedelta(seconds=age)))
+            await db.commit()
+
+        queue = jobs.JobQueue(session_factory, owner="a", stale_after=300)
+        await queue.recover()
+
+        async with session_factory() as db:
+            rows = {job.id: (job.status, job.owner) for job in await db.run_sync(lambda s: s.query(GenerationJob).all())}
+        return list(queue.queued_ids), rows
+
+    queued, rows = run_with_db(test)
+
+    assert sorted(queued) == ["no-owner", "other-stale", "own-queued", "own-running"]
+    assert queued[0] == "other-stale"  # created_at の古い順
+    assert rows["own-running"] == ("queued", "a")
+    assert rows["other-stale"] == ("queued", "a")
+    assert rows["other-running"] == ("running", "b")
+    assert rows["other-finished"] == ("succeeded", "c")
+
+
+def test_claim_is_exclusive():
+    async def test(session_factory):
+        old = datetime.utcnow() - timedelta(seconds=600)
+        async with session_factory() as db:
+            db.add(GenerationJob(id="stale", kind="full_generate", status="running", request_json="{}", owner="c", updated_at=old))
+            await db.commit()
+
+            stale_before = datetime.utcnow() - timedelta(seconds=300)
+            first = await crud.claim_job_async(db, "stale", "a", stale_before)
+            second = await crud.claim_job_async(db, "stale", "b", stale_before)
+        return first, second
+
+    assert run_with_db(test) == (True, False)
+
+
+def test_heartbeat_keeps_jobs_owned():
+    async def test(session_factory):
+        old = datetime.utcnow() - timedelta(seconds=600)
+        async with session_factory() as db:
+            db.add(GenerationJob(id="job", kind="full_generate", status="running", request_json="{}", owner="b", updated_at=old))
+            await db.commit()
+            await crud.touch_jobs_async(db, "b")
+
+        queue = jobs.JobQueue(session_factory, owner="a", stale_after=300)
+        await queue.recover()
+        return list(queue.queued_ids)
+
+    assert run_with_db(test) == []
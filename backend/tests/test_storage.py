@@ -0,0 +1,116 @@
+import asyncio
+import threading
+
+import pytest
+
+import storage
+
+
+class FakeS3Client:
+    # boto3のS3クライアントの代わり（moto/MinIOの代役）。gateが開くまでアップロードを終えない
+    def __init__(self):
+        self.objects: dict[str, bytes] = {}
+        self.calls: list[tuple[str, str]] = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._store("put_object", Key, Body)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+        self._store("upload_fileobj", Key, Fileobj.read())
+
+    def _store(self, method, key, body):
+        self.calls.append((method, key))
+        self.gate.wait(5)
+        self.objects[key] = body
+
+
+@pytest.fixture
+def client():
+    client = FakeS3Client()
+    yield client
+    client.gate.set()
+
+
+def make_uploader(client, **kwargs):
+    return storage.S3Uploader(client, bucket="images", region="ap-northeast-1", multipart_threshold=1024, **kwargs)
+
+
+def test_multipart_threshold(client):
+    async def main():
+        uploader = make_uploader(client)
+        urls = [
+            await uploader.upload(b"x" * 1023, "small.png"),
+            await uploader.upload(b"x" * 1024, "large.png"),
+        ]
+        await uploader.close()
+        return urls
+
+    urls = asyncio.run(main())
+
+    assert urls == ["https://images.s3.ap-northeast-1.amazonaws.com/small.png", "https://images.s3.ap-northeast-1.amazonaws.com/large.png"]
+    assert client.calls == [("put_object", "small.png"), ("upload_fileobj", "large.png")]
+    assert len(client.objects["large.png"]) == 1024
+
+
+def test_background_returns_url_before_upload_finishes(client):
+    client.gate.clear()
+
+    async def main():
+        uploader = make_uploader(client)
+        url = await uploader.upload_in_background(b"png", "a.png")
+        pending = "a.png" not in client.objects and len(uploader.background_tasks) == 1
+
+        client.gate.set()
+        await uploader.drain()
+        await uploader.close()
+        return url, pending
+
+    url, pending = asyncio.run(main())
+
+    assert url == "https://images.s3.ap-northeast-1.amazonaws.com/a.png"
+    assert pending
+    assert client.objects["a.png"] == b"png"
+
+
+def test_background_waits_when_queue_is_full(client):
+    client.gate.clear()
+
+    async def main():
+        uploader = make_uploader(client, max_pending=1)
+        await uploader.upload_in_background(b"1", "1.png")
+
+        # 1件目が終わるまで2件目はURLを返さない
+        second = asyncio.create_task(uploader.upload_in_background(b"2", "2.png"))
+        await asyncio.sleep(0.05)
+        blocked = not second.done()
+
+        client.gate.set()
+        url = await asyncio.wait_for(second, 5)
+        await uploader.close()
+        return blocked, url
+
+    blocked, url = asyncio.run(main())
+
+    assert blocked
+    assert url.endswith("/2.png")
+    assert set(client.objects) == {"1.png", "2.png"}
+
+
+def test_background_failure_releases_slot(client):
+    def fail(*args, **kwargs):
+        raise RuntimeError("access denied")
+
+    client.put_object = fail
+
+    async def main():
+        uploader = make_uploader(client, max_pending=1)
+        await uploader.upload_in_background(b"1", "1.png")
+        await uploader.drain()
+        # 失敗したアップロードの枠も返っているので、次はすぐ受け付けられる
+        url = await asyncio.wait_for(uploader.upload_in_background(b"2", "2.png"), 1)
+        await uploader.close()
+        return url
+
+    assert asyncio.run(main()).endswith("/2.png")
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+
+import pytest
+
+import translation
+
+
+class FakeGenerate:
+    # Geminiの代わり。呼ばれた回数を数え、gateが開くまで結果を返さない
+    def __init__(self, error: Exception | None = None):
+        self.calls: list[str] = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.error = error
+
+    def __call__(self, text: str) -> str:
+        self.calls.append(text)
+        self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        return f"translated {len(self.calls)}"
+
+
+@pytest.fixture
+def generate():
+    return FakeGenerate()
+
+
+@pytest.fixture
+def translator(generate):
+    translator = translation.Translator(generate=generate, maxsize=2, ttl=60.0, max_workers=4)
+    yield translator
+    translator.shutdown()
+
+
+def test_cache_hit(translator, generate):
+    async def main():
+        first = await translator.translate("full_generate", "猫", "anime")
+        second = await translator.translate("full_generate", "猫", "anime")
+        other = await translator.translate("full_generate", "猫", "photo")
+        return first, second, other
+
+    first, second, other = asyncio.run(main())
+
+    assert first == second == "translated 1"
+    assert other == "translated 2"
+    assert len(generate.calls) == 2
+    assert "猫" in generate.calls[0]
+    assert (translator.hits, translator.misses) == (1, 2)
+
+
+def test_ttl_expiry(translator, generate, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(translation.time, "monotonic", lambda: now[0])
+
+    async def main():
+        results = [await translator.translate("full_generate", "猫", "anime")]
+        now[0] += 59
+        results.append(await translator.translate("full_generate", "猫", "anime"))
+        now[0] += 2
+        results.append(await translator.translate("full_generate", "猫", "anime"))
+        return results
+
+    assert asyncio.run(main()) == ["translated 1", "translated 1", "translated 2"]
+    assert len(generate.calls) == 2
+
+
+def test_lru_eviction(translator, generate):
+    async def main():
+        for prompt in ("a", "b", "a", "c", "a", "b"):
+            await translator.translate("full_generate", prompt, "anime")
+
+    asyncio.run(main())
+
+    # maxsize=2: "c" を入れたとき最も古い "b" が追い出される
+    assert len(generate.calls) == 4
+    assert len(translator.cache) == 2
+
+
+def test_concurrent_identical_prompts_are_coalesced(translator, generate):
+    generate.gate.clear()
+
+    async def main():
+        tasks = [asyncio.create_task(translator.translate("full_generate", "猫", "anime")) for _ in range(5)]
+        while not generate.calls:
+            await asyncio.sleep(0.001)
+        generate.gate.set()
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(main()) == ["translated 1"] * 5
+    assert len(generate.calls) == 1
+    assert translator.misses == 1
+    assert not translator._inflight
+
+
+def test_cancelled_waiter_does_not_cancel_others(translator, generate):
+    generate.gate.clear()
+
+    async def main():
+        first = asyncio.create_task(translator.translate("full_generate", "猫", "anime"))
+        second = asyncio.create_task(translator.translate("full_generate", "猫", "anime"))
+        while not generate.calls:
+            await asyncio.sleep(0.001)
+        first.cancel()
+        generate.gate.set()
+        return await second
+
+    assert asyncio.run(main()) == "translated 1"
+    assert len(generate.calls) == 1
+
+
+def test_error_propagates_and_is_not_cached(translator, generate):
+    generate.error = RuntimeError("quota exceeded")
+    generate.gate.clear()
+
+    async def main():
+        tasks = [asyncio.create_task(translator.translate("full_generate", "猫", "anime")) for _ in range(3)]
+        while not generate.calls:
+            await asyncio.sleep(0.001)
+        generate.gate.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        generate.error = None
+        retried = await translator.translate("full_generate", "猫", "anime")
+        return results, retried
+
+    results, retried = asyncio.run(main())
+
+    assert all(isinstance(x, RuntimeError) and str(x) == "quota exceeded" for x in results)
+    assert retried == "translated 2"
+    assert len(generate.calls) == 2
+    assert not translator._inflight
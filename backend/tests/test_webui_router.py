@@ -0,0 +1,141 @@
+import asyncio
+
+import httpx
+import pytest
+
+import generation
+import webui_client
+from webui_router import WebuiBackend, WebuiRouter
+
+
+def make_backend(url, handler=None, checkpoint=None, queue_depth=0):
+    client = httpx.AsyncClient(base_url=url, transport=httpx.MockTransport(handler or (lambda request: httpx.Response(404))))
+    backend = WebuiBackend(url, client)
+    backend.queue_depth = queue_depth
+    if checkpoint is not None:
+        backend.set_options({"sd_model_checkpoint": checkpoint})
+    return backend
+
+
+def test_pick_prefers_loaded_checkpoint_until_queue_is_deeper_than_switch_cost():
+    a = make_backend("http://a", checkpoint="anything.safetensors [1234567890]", queue_depth=2)
+    b = make_backend("http://b", checkpoint="other.safetensors", queue_depth=0)
+    router = WebuiRouter([a, b], switch_penalty=3)
+
+    # a: 2, b: 0 + 切り替え3
+    assert router.pick("anything.safetensors") is a
+    assert router.pick() is b
+
+    a.queue_depth = 4
+    assert router.pick("anything.safetensors") is b
+
+    # 応答待ちのリクエストも負荷に数える
+    a.queue_depth = 1
+    with router.track(b), router.track(b):
+        assert b.in_flight == 2
+        assert router.pick() is a
+    assert b.in_flight == 0
+
+
+def test_pick_skips_unhealthy_and_excluded_backends():
+    a = make_backend("http://a")
+    b = make_backend("http://b", queue_depth=5)
+    router = WebuiRouter([a, b], max_failures=2)
+
+    router.mark_failed(a, "boom")
+    assert a.healthy and router.pick() is a
+    router.mark_failed(a, "boom")
+    assert not a.healthy and router.pick() is b
+
+    assert router.pick(exclude=[b]) is a  # 他に候補がなければ不健全でも使う
+
+    router.mark_ok(a)
+    assert a.healthy and a.failures == 0 and a.last_error is None
+
+
+def test_check_updates_queue_depth_and_health():
+    responses = {
+        "/internal/pending-tasks": {"size": 3},
+        "/sdapi/v1/progress": {"state": {"job_count": 1}},
+        "/sdapi/v1/options": {"sd_model_checkpoint": "anything.safetensors [1234567890]", "sd_vae": "Automatic"},
+    }
+    up = make_backend("http://up", lambda request: httpx.Response(200, json=responses[request.url.path]))
+    down = make_backend("http://down", lambda request: httpx.Response(500))
+    router = WebuiRouter([up, down], max_failures=1)
+
+    async def main():
+        await router.check_all()
+        await router.close()
+
+    asyncio.run(main())
+
+    assert up.healthy and up.queue_depth == 4
+    assert up.has_checkpoint("anything.safetensors")
+    assert not down.healthy and "500" in down.last_error
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setenv("WEBUI_BINARY_TRANSPORT", "0")
+    calls = []
+
+    def backend(name, respond):
+        def handler(request):
+            calls.append(name)
+            return respond(request)
+        return make_backend(f"http://{name}", handler)
+
+    def connect_error(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    def disconnected(request):
+        raise httpx.RemoteProtocolError("server disconnected", request=request)
+
+    backends = {
+        "refused": backend("refused", connect_error),
+        "busy": backend("busy", lambda request: httpx.Response(503)),
+        "timeout": backend("timeout", lambda request: httpx.Response(504)),
+        "disconnected": backend("disconnected", disconnected),
+        "ok": backend("ok", lambda request: httpx.Response(200, json={"images": ["png"]})),
+    }
+
+    def use(*names, retries=2):
+        router = WebuiRouter([backends[x] for x in names], max_failures=1, retries=retries)
+        monkeypatch.setattr(webui_client, "_router", router)
+        return router
+
+    use.calls = calls
+    use.backends = backends
+    return use
+
+
+def test_submit_fails_over_on_connect_error_and_503(router):
+    router("refused", "busy", "ok")
+
+    result = asyncio.run(generation.submit("/sdapi/v1/txt2img", {"prompt": "cat"}))
+
+    assert result == {"images": ["png"]}
+    assert router.calls == ["refused", "busy", "ok"]
+    assert not router.backends["refused"].healthy and not router.backends["busy"].healthy
+    assert router.backends["ok"].healthy
+
+
+def test_submit_does_not_retry_when_the_request_may_have_run(router):
+    for name, error in (("timeout", httpx.HTTPStatusError), ("disconnected", httpx.RemoteProtocolError)):
+        router(name, "ok")
+        router.calls.clear()
+
+        with pytest.raises(error):
+            asyncio.run(generation.submit("/sdapi/v1/txt2img", {"prompt": "cat"}))
+
+        assert router.calls == [name]
+        assert not router.backends[name].healthy
+
+
+def test_submit_raises_last_error_when_retries_run_out(router):
+    router("refused", "busy", "ok", retries=1)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(generation.submit("/sdapi/v1/txt2img", {"prompt": "cat"}))
+
+    assert router.calls == ["refused", "busy"]
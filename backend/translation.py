@@ -0,0 +1,128 @@
+# translation.py
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import google.generativeai as genai
+
+GEMINI_MODEL_NAME = "models/gemini-1.5-flash"
+
+# エンドポイントごとのGemini用プロンプトテンプレート
+TEMPLATES = {
+    "full_generate": """
+        You are an expert in generating prompts for Stable Diffusion XL.
+        Convert the following Japanese description into a prompt: {prompt}
+        Style: {style}
+        """,
+    "masked_full_generate": """
+        Convert the following Japanese image description into a short, high-quality English prompt for img2img generation.
+        Style: {style}
+        """,
+    "img2img_full_generate": """
+        Convert the following Japanese image description into a comma-separated high-quality English prompt.
+        Style: {style}
+        """,
+}
+
+
+class TTLCache:
+    # 件数上限つきLRU + 有効期限
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value) -> None:
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def gemini_generate(text: str) -> str:
+    model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    return model.generate_content(text).text.strip()
+
+
+class Translator:
+    # 同期のGemini呼び出しをスレッドプールで実行し、結果をキャッシュする
+    def __init__(self, generate: Callable[[str], str] = gemini_generate, maxsize: int = 1024, ttl: float = 3600.0, max_workers: int = 8):
+        self.generate = generate
+        self.cache = TTLCache(maxsize, ttl)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def translate(self, template: str, prompt: str, style: str) -> str:
+        key = (prompt, style, template)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        # 同じキーの呼び出しが進行中なら、その結果を待つ
+        future = self._inflight.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self._run(key, TEMPLATES[template].format(prompt=prompt, style=style)))
+            self._inflight[key] = future
+        return await asyncio.shield(future)
+
+    async def _run(self, key: tuple, text: str) -> str:
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, self.generate, text)
+            self.cache.set(key, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_translator: Translator | None = None
+
+
+def get_translator() -> Translator:
+    # .env読み込み後に設定を読むため、初回利用時に生成する
+    global _translator
+    if _translator is None:
+        _translator = Translator(
+            maxsize=int(os.getenv("TRANSLATION_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("TRANSLATION_CACHE_TTL", "3600")),
+            max_workers=int(os.getenv("GEMINI_MAX_WORKERS", "8")),
+        )
+    return _translator
+
+
+def shutdown() -> None:
+    global _translator
+    if _translator is not None:
+        _translator.shutdown()
+        _translator = None
+
+
+async def translate(template: str, prompt: str, style: str) -> str:
+    return await get_translator().translate(template, prompt, style)
@@ -0,0 +1,150 @@
+# webui_client.py
+import json
+import os
+from contextlib import asynccontextmanager
+
+import httpx
+
+from webui_router import WebuiBackend, WebuiRouter
+
+DEFAULT_STABLE_DIFFUSION_API = "http://127.0.0.1:7860"
+
+# ルートごとのタイムアウト（秒）。生成系は長め、設定系は短め
+ROUTE_TIMEOUTS = {
+    "/sdapi/v1/options": 60.0,
+    "/sdapi/v1/txt2img": 600.0,
+    "/sdapi/v1/img2img": 600.0,
+    "/sdapi/v1/txt2img/binary": 600.0,
+    "/sdapi/v1/img2img/binary": 600.0,
+    "/internal/progress": 10.0,
+}
+DEFAULT_TIMEOUT = 60.0
+
+# アプリ全体で共有するルーター（lifespanで開閉する）
+_router: WebuiRouter | None = None
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def build_client(base_url: str | None = None) -> httpx.AsyncClient:
+    # .env読み込み後に呼ばれるよう、設定は生成時に読む
+    limits = httpx.Limits(
+        max_connections=_env_int("WEBUI_MAX_CONNECTIONS", 32),
+        max_keepalive_connections=_env_int("WEBUI_MAX_KEEPALIVE_CONNECTIONS", 16),
+        keepalive_expiry=_env_float("WEBUI_KEEPALIVE_EXPIRY", 30.0),
+    )
+    timeout = httpx.Timeout(
+        DEFAULT_TIMEOUT,
+        connect=_env_float("WEBUI_CONNECT_TIMEOUT", 10.0),
+        pool=_env_float("WEBUI_POOL_TIMEOUT", 30.0),
+    )
+    return httpx.AsyncClient(
+        base_url=base_url or os.getenv("STABLE_DIFFUSION_API", DEFAULT_STABLE_DIFFUSION_API),
+        limits=limits,
+        timeout=timeout,
+    )
+
+
+def backend_urls() -> list[str]:
+    # WEBUI_BACKENDS はカンマ区切り。未設定なら STABLE_DIFFUSION_API の1台だけ
+    urls = [url.strip() for url in os.getenv("WEBUI_BACKENDS", "").split(",") if url.strip()]
+    return urls or [os.getenv("STABLE_DIFFUSION_API", DEFAULT_STABLE_DIFFUSION_API)]
+
+
+async def open_client() -> WebuiRouter:
+    global _router
+    if _router is None:
+        _router = WebuiRouter(
+            [WebuiBackend(url, build_client(url)) for url in backend_urls()],
+            health_interval=_env_float("WEBUI_HEALTH_INTERVAL", 5.0),
+            switch_penalty=_env_int("WEBUI_SWITCH_PENALTY", 2),
+            max_failures=_env_int("WEBUI_MAX_FAILURES", 2),
+            retries=_env_int("WEBUI_RETRIES", 2),
+        )
+        _router.start()
+    return _router
+
+
+async def close_client() -> None:
+    global _router
+    if _router is not None:
+        await _router.close()
+        _router = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await open_client()
+    try:
+        yield
+    finally:
+        await close_client()
+
+
+def get_router() -> WebuiRouter:
+    if _router is None:
+        raise RuntimeError("webui client is not open; is the app lifespan running?")
+    return _router
+
+
+def route_timeout(path: str, client: httpx.AsyncClient) -> httpx.Timeout:
+    env_name = "WEBUI_TIMEOUT_" + path.rsplit("/", 1)[-1].upper().replace("-", "_")
+    read = _env_float(env_name, ROUTE_TIMEOUTS.get(path, DEFAULT_TIMEOUT))
+    return httpx.Timeout(read, connect=client.timeout.connect, pool=client.timeout.pool)
+
+
+async def post(path: str, json: dict, backend: WebuiBackend | None = None) -> httpx.Response:
+    backend = backend or get_router().pick()
+    return await backend.client.post(path, json=json, timeout=route_timeout(path, backend.client))
+
+
+async def get(path: str, backend: WebuiBackend | None = None) -> httpx.Response:
+    backend = backend or get_router().pick()
+    return await backend.client.get(path, timeout=route_timeout(path, backend.client))
+
+
+def binary_transport_enabled() -> bool:
+    # WEBUI_BINARY_TRANSPORT=1 なら画像をbase64のJSONではなく生のバイト列でやり取りする
+    return os.getenv("WEBUI_BINARY_TRANSPORT", "0").lower() in ("1", "true", "yes")
+
+
+async def post_multipart(path: str, data: dict, files: list, backend: WebuiBackend | None = None) -> httpx.Response:
+    backend = backend or get_router().pick()
+    return await backend.client.post(path, data=data, files=files, timeout=route_timeout(path, backend.client))
+
+
+def parse_multipart_mixed(response: httpx.Response) -> dict:
+    # 先頭がJSON (parameters, info)、続いて画像が1枚ずつ入った multipart/mixed を読む
+    content_type = response.headers.get("content-type", "")
+    if not content_type.startswith("multipart/mixed"):
+        return response.json()
+
+    boundary = content_type.split("boundary=", 1)[1].strip().encode("ascii")
+    body = response.content
+    delimiter = b"--" + boundary
+    pos = body.index(delimiter) + len(delimiter)
+
+    parts = []
+    while body[pos:pos + 2] != b"--":
+        header_end = body.index(b"\r\n\r\n", pos)
+        headers = {}
+        for line in body[pos:header_end].decode("ascii").strip().split("\r\n"):
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+        start = header_end + 4
+        end = start + int(headers["content-length"])
+        parts.append((headers["content-type"], body[start:end]))
+        pos = body.index(delimiter, end) + len(delimiter)
+
+    result = json.loads(parts[0][1])
+    result["images"] = [data for _, data in parts[1:]]
+    result["image_types"] = [content_type for content_type, _ in parts[1:]]
+    return result
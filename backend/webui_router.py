@@ -0,0 +1,144 @@
+# webui_router.py
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+
+import httpx
+
+
+def same_checkpoint(loaded: str | None, wanted: str) -> bool:
+    if not loaded:
+        return False
+    # webuiは "name.safetensors [hash]" 形式のタイトルを返す
+    title = loaded.split(" [", 1)[0]
+    return wanted in (loaded, title, os.path.basename(title))
+
+
+class NoBackendAvailable(Exception):
+    pass
+
+
+class WebuiBackend:
+    # webuiインスタンス1台分の接続と状態
+    def __init__(self, url: str, client: httpx.AsyncClient):
+        self.url = url
+        self.client = client
+        self.healthy = True
+        self.failures = 0
+        self.last_error: str | None = None
+        # webui側の待ちタスク数 + 実行中ジョブ
+        self.queue_depth = 0
+        # このゲートウェイから送って応答待ちのリクエスト数
+        self.in_flight = 0
+        # ロード中のモデル（/sdapi/v1/options のキャッシュ）
+        self.options: dict = {}
+        self.options_fetched_at = 0.0
+        self.options_lock = asyncio.Lock()
+
+    @property
+    def load(self) -> int:
+        return self.queue_depth + self.in_flight
+
+    def set_options(self, options: dict) -> dict:
+        self.options = {
+            "sd_model_checkpoint": options.get("sd_model_checkpoint"),
+            "sd_vae": options.get("sd_vae"),
+        }
+        self.options_fetched_at = time.monotonic()
+        return self.options
+
+    def has_checkpoint(self, checkpoint: str) -> bool:
+        return same_checkpoint(self.options.get("sd_model_checkpoint"), checkpoint)
+
+    def status(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "checkpoint": self.options.get("sd_model_checkpoint"),
+            "last_error": self.last_error,
+        }
+
+
+class WebuiRouter:
+    # 複数のwebuiに負荷の低い順で振り分ける
+    def __init__(self, backends: list[WebuiBackend], health_interval: float = 5.0, switch_penalty: int = 2,
+                 max_failures: int = 2, retries: int = 2):
+        self.backends = backends
+        self.health_interval = health_interval
+        # モデル切り替えが必要なインスタンスに加算するコスト（ジョブ数換算）
+        self.switch_penalty = switch_penalty
+        self.max_failures = max_failures
+        self.retries = retries
+        self._health_task: asyncio.Task | None = None
+
+    def pick(self, checkpoint: str | None = None, exclude=()) -> WebuiBackend:
+        candidates = [b for b in self.backends if b.healthy and b not in exclude]
+        if not candidates:
+            # 全滅しているときは除外したものも含めて再試行する
+            candidates = [b for b in self.backends if b not in exclude] or list(self.backends)
+        if not candidates:
+            raise NoBackendAvailable("no webui backends configured")
+
+        def cost(backend: WebuiBackend) -> tuple:
+            switch = self.switch_penalty if checkpoint and not backend.has_checkpoint(checkpoint) else 0
+            return (backend.load + switch, backend.failures)
+
+        return min(candidates, key=cost)
+
+    @contextmanager
+    def track(self, backend: WebuiBackend):
+        backend.in_flight += 1
+        try:
+            yield backend
+        finally:
+            backend.in_flight -= 1
+
+    def mark_ok(self, backend: WebuiBackend) -> None:
+        backend.failures = 0
+        backend.healthy = True
+        backend.last_error = None
+
+    def mark_failed(self, backend: WebuiBackend, error: str) -> None:
+        backend.failures += 1
+        backend.last_error = error
+        if backend.failures >= self.max_failures:
+            backend.healthy = False
+
+    async def check(self, backend: WebuiBackend) -> None:
+        try:
+            pending = await backend.client.get("/internal/pending-tasks", timeout=5.0)
+            progress = await backend.client.get("/sdapi/v1/progress", params={"skip_current_image": True}, timeout=5.0)
+            options = await backend.client.get("/sdapi/v1/options", timeout=5.0)
+            for response in (pending, progress, options):
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.mark_failed(backend, repr(e))
+            return
+
+        running = 1 if progress.json().get("state", {}).get("job_count", 0) else 0
+        backend.queue_depth = pending.json().get("size", 0) + running
+        backend.set_options(options.json())
+        self.mark_ok(backend)
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self.check(backend) for backend in self.backends))
+
+    async def _health_loop(self) -> None:
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.health_interval)
+
+    def start(self) -> None:
+        if self._health_task is None and self.health_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop(), name="webui-health")
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        for backend in self.backends:
+            await backend.client.aclose()
@@ -13,7 +13,7 @@ import MenuOriginalSection from "@/components/RightMenuPanel/MenuOriginalSection
 
 import type { Stage as KonvaStage } from 'konva/lib/Stage';
 import MenuImg2ImgSection from "@/components/RightMenuPanel/MenuImg2ImgSection";
-import {fetchHistory} from "@/components/Hooks/UseHistory";
+import {useHistory} from "@/components/Hooks/UseHistory";
 import UserIdInput from "@/components/History/UserIdInput";
 
 const FreeDrawingComponent = () => {
@@ -27,7 +27,7 @@ const FreeDrawingComponent = () => {
   const [importedUrls, setImportedUrls] = useState<string[]>([]); // Canvasに表示する画像のURL
   const [exportedUrls, setExportedUrls] = useState<string[]>([]);
   const [maskedUrls, setMaskedUrls] = useState<string[]>([]);
-  const [historyUrls, setHistoryUrls] = useState<string[]>([]);
+  const { historyUrls } = useHistory(userId); // 2ページ目以降は useHistory の loadMore() で読む
 
   const [isEnterUserId, setIsEnterUserId] = useState(false);
 
@@ -57,10 +57,9 @@ const FreeDrawingComponent = () => {
           generatedPrompt={generatedPrompt} setGeneratedPrompt={setGeneratedPrompt} userId={userId} />
   ];
 
-  // ユーザーID設定後に履歴取得
+  // ユーザーID設定後に画面を切り替える（履歴の1ページ目は useHistory が読む）
   useEffect(() => {
     if (userId) {
-      fetchHistory(userId).then(setHistoryUrls);
       setIsEnterUserId(true);
     }
   }, [userId]);
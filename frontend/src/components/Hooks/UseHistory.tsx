@@ -1,5 +1,67 @@
-export const fetchHistory = async (userId: string): Promise<string[]> => {
-  const res = await fetch("http://localhost:8000/api/history?user_id=" + userId);
-  const data = await res.json();
-  return data.image_urls; // backendと合わせてこの形式
-};
\ No newline at end of file
+import { useCallback, useEffect, useState } from "react";
+
+type HistoryPage = {
+  items: { image_url: string }[];
+  next_cursor: string | null;
+};
+
+const HISTORY_PAGE_SIZE = 50;
+
+// limit を渡すと backend は1ページ分（items と next_cursor）を返す
+export const fetchHistoryPage = async (userId: string, cursor: string | null = null): Promise<HistoryPage> => {
+  const params = new URLSearchParams({ user_id: userId, limit: String(HISTORY_PAGE_SIZE) });
+  if (cursor) {
+    params.set("cursor", cursor);
+  }
+  const res = await fetch("http://localhost:8000/api/history?" + params.toString());
+  return await res.json();
+};
+
+// 最初の1ページだけ読み、続きは loadMore() が呼ばれたときに読む
+export function useHistory(userId: string) {
+  const [historyUrls, setHistoryUrls] = useState<string[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [isLoading, setIsLoading] = useState(false);
+
+  useEffect(() => {
+    setHistoryUrls([]);
+    setNextCursor(null);
+    if (!userId) {
+      return;
+    }
+
+    let cancelled = false; // userIdが変わったら古い応答は捨てる
+    setIsLoading(true);
+    fetchHistoryPage(userId)
+      .then((data) => {
+        if (!cancelled) {
+          setHistoryUrls(data.items.map((item) => item.image_url)); // backendと合わせてこの形式
+          setNextCursor(data.next_cursor);
+        }
+      })
+      .finally(() => {
+        if (!cancelled) {
+          setIsLoading(false);
+        }
+      });
+    return () => {
+      cancelled = true;
+    };
+  }, [userId]);
+
+  const loadMore = useCallback(async () => {
+    if (!userId || !nextCursor || isLoading) {
+      return;
+    }
+    setIsLoading(true);
+    try {
+      const data = await fetchHistoryPage(userId, nextCursor);
+      setHistoryUrls((prev) => [...prev, ...data.items.map((item) => item.image_url)]);
+      setNextCursor(data.next_cursor);
+    } finally {
+      setIsLoading(false);
+    }
+  }, [userId, nextCursor, isLoading]);
+
+  return { historyUrls, loadMore, hasMore: nextCursor !== null, isLoading };
+}